@@ -363,3 +363,28 @@ class GclientManagedEnabledException(ExpectedException):
     super(GclientManagedEnabledException, self).__init__(
         message=self.MESSAGE.format(dot_gclient_path=dot_gclient_path),
         exit_code=self.EXIT_CODE)
+
+
+class ParallelIterationsNotSupportedOnAndroidError(ExpectedException):
+  """An exception raised when parallel iterations are used on Android."""
+
+  MESSAGE = (
+      "--parallel-iterations isn't supported in Android because all "
+      'iterations share a single device.')
+  EXIT_CODE = 63
+
+  def __init__(self):
+    super(ParallelIterationsNotSupportedOnAndroidError, self).__init__(
+        message=self.MESSAGE, exit_code=self.EXIT_CODE)
+
+
+class DownloadTestcaseError(ExpectedException):
+  """An exception raised when the testcase file cannot be downloaded."""
+
+  MESSAGE = 'Failed to download the testcase file from {url}: {reason}'
+  EXIT_CODE = 64
+
+  def __init__(self, url, reason):
+    super(DownloadTestcaseError, self).__init__(
+        message=self.MESSAGE.format(url=url, reason=reason),
+        exit_code=self.EXIT_CODE)
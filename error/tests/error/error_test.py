@@ -78,6 +78,8 @@ class InitTest(helpers.ExtendedTestCase):
     error.DifferentStacktraceError(
         10, [Signature('type', ['a', 'b'], 'output')])
     error.GdbNotSupportedOnAndroidError()
+    error.ParallelIterationsNotSupportedOnAndroidError()
     error.BootFailed()
     error.NoAndroidDeviceIdError('ANDROID_SERIAL')
     error.GclientManagedEnabledException('/chromium/.gclient')
+    error.DownloadTestcaseError('url', 'reason')
@@ -14,21 +14,32 @@
 # limitations under the License.
 
 import base64
+import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
 import json
 import logging
 import multiprocessing
+from multiprocessing import pool
 import os
 import re
 import shutil
 import stat
 import string
 import tempfile
+import time
 import urllib
+import zipfile
 
 import urlfetch
 
+from clusterfuzz import build_store
 from clusterfuzz import common
+from clusterfuzz import disk_cache
 from clusterfuzz import output_transformer
+from clusterfuzz import revision_index
 from error import error
 
 
@@ -39,7 +50,41 @@ CHECKOUT_MESSAGE = (
     'Shall we proceed with the following command:\n'
     '{cmd} in {source_dir}?')
 ARGS_GN_FILENAME = 'args.gn'
+DEPS_FILENAME = 'DEPS'
+# A dependency step writes its stamp file after it succeeds, and is skipped
+# while the stamp matches the fingerprint of its inputs.
+DEPS_STAMP_DIR = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'deps_stamps')
+# Files that `gn gen` writes. Ninja re-runs gn by itself when they're stale.
+GN_GENERATED_FILENAMES = ['build.ninja', 'build.ninja.d']
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+# A lazily extracted build keeps its zip, so more files can be extracted
+# later.
+BUILD_ZIP_FILENAME = '.build.zip'
+# The data that Chromium, V8 and PDFium fuzz targets load at startup. They
+# can't ask for it later, so it's always extracted with the target.
+RUNTIME_DATA_PATTERNS = ['icudtl.dat', '*_blob.bin', '*.pak']
+# gsutil downloads objects larger than the threshold in parallel slices. Like
+# other large downloads, they resume from gsutil's tracker files after an
+# interruption, and their hashes are checked at the end.
+GSUTIL_DOWNLOAD_OPTIONS = [
+    'GSUtil:sliced_object_download_threshold=50M',
+    'GSUtil:check_hashes=if_fast_else_fail',
+]
 GOMA_DIR = os.path.expanduser(os.path.join('~', 'goma'))
+NINJA_LOG_FILENAME = '.ninja_log'
+SLOWEST_STEPS_COUNT = 10
+# `goma_ctl.py stat` reports the compiles finished by goma and locally since
+# compiler_proxy started.
+GOMA_FINISHED_REGEX = re.compile(r'^\s*goma: .*\bfinished=(\d+)', re.MULTILINE)
+LOCAL_FINISHED_REGEX = re.compile(
+    r'^\s*local: .*\bfinished=(\d+)', re.MULTILINE)
+# A commit position always points to the same commit, and DEPS of a commit
+# never changes. Therefore, the resolved SHAs are cached forever.
+REVISION_CACHE = disk_cache.DiskCache('revisions', 10 * 1024 * 1024)
+BUILD_DIR_PREFIX = 'clusterfuzz_'
+BUILD_DIR_STAMP_FILENAME = '.clusterfuzz_last_used'
+MAX_BUILD_DIRS_ENV = 'CF_MAX_BUILD_DIRS'
+DEFAULT_MAX_BUILD_DIRS = 3
 
 logger = logging.getLogger('clusterfuzz')
 
@@ -54,24 +99,69 @@ def build_revision_to_sha_url(revision, repo):
               'repo': repo}))
 
 
-def sha_from_revision(revision, repo):
-  """Converts a chrome revision number to it corresponding git sha."""
-
-  response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
-  return json.loads(response.body)['git_sha']
-
-
-def get_third_party_sha(chromium_sha, key):
-  """Gets the correct Pdfium sha using the Chromium sha."""
-  response = urlfetch.fetch(
-      ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
-       'format=TEXT' % chromium_sha))
-  body = base64.b64decode(response.body)
+def get_local_chromium_dir():
+  """Return the chromium checkout if CHROMIUM_SRC is set. Unlike
+    get_or_ask_for_source_location, this never asks, because the checkout is
+    optional."""
+  return common.get_valid_abs_dir(os.environ.get('CHROMIUM_SRC'))
+
+
+def sha_from_revision(revision, repo, source_dir=None):
+  """Converts a chrome revision number to it corresponding git sha. If
+    source_dir is a checkout of repo, it's used before asking cr-rev."""
+  key = disk_cache.get_key('sha_from_revision', revision, repo)
+  sha = REVISION_CACHE.get(key)
+  if sha:
+    return sha
+
+  if source_dir:
+    sha = revision_index.get_sha(source_dir, revision)
+  if not sha:
+    response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
+    sha = json.loads(response.body)['git_sha']
+  REVISION_CACHE.set(key, sha)
+  return sha
+
+
+def get_third_party_sha(chromium_sha, key, chromium_dir=None):
+  """Gets the correct Pdfium sha using the Chromium sha. DEPS is read from
+    chromium_dir if it has the commit."""
+  cache_key = disk_cache.get_key('get_third_party_sha', chromium_sha, key)
+  sha = REVISION_CACHE.get(cache_key)
+  if sha:
+    return sha
+
+  body = None
+  if chromium_dir:
+    body = revision_index.get_file(chromium_dir, chromium_sha, 'DEPS')
+  if body is None:
+    response = urlfetch.fetch(
+        ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
+         'format=TEXT' % chromium_sha))
+    body = base64.b64decode(response.body)
 
   sha_line = [l for l in body.split('\n') if "'%s':" % key in l][0]
   sha_line = sha_line.translate(None, string.punctuation).replace(
       key.translate(None, string.punctuation), '')
-  return sha_line.strip()
+  sha = sha_line.strip()
+  REVISION_CACHE.set(cache_key, sha)
+  return sha
+
+
+def download_gs_file(gsutil_url, dest_path):
+  """Download a GCS object to dest_path, showing gsutil's progress. A partial
+    download is kept by gsutil, so running this again with the same
+    dest_path resumes it."""
+  max_components = max(4, multiprocessing.cpu_count())
+  options = GSUTIL_DOWNLOAD_OPTIONS + [
+      'GSUtil:sliced_object_download_max_components=%d' % max_components]
+  common.gsutil(
+      '%s cp %s %s' % (
+          ' '.join('-o %s' % option for option in options), gsutil_url,
+          dest_path),
+      cwd='.',
+      stdout_transformer=output_transformer.Identity(),
+      redirect_stderr_to_stdout=True)
 
 
 def get_clank_sha(revision_url):
@@ -79,7 +169,7 @@ def get_clank_sha(revision_url):
   tmp_file = tempfile.NamedTemporaryFile(delete=False)
   tmp_file.close()
 
-  common.gsutil('cp %s %s' % (revision_url, tmp_file.name), cwd='.')
+  download_gs_file(revision_url, tmp_file.name)
 
   with open(tmp_file.name, 'r') as file_handle:
     body = file_handle.read()
@@ -152,22 +242,41 @@ def install_build_deps(source_dir, include_lib32):
       preexec_fn=None, redirect_stderr_to_stdout=True)
 
 
+def get_msan_runhooks_env(msan_track_origins):
+  """Return the env of gclient runhooks for msan."""
+  return {
+      'GYP_DEFINES': (
+          'msan=1 msan_track_origins=%s '
+          'use_prebuilt_instrumented_libraries=1'
+          % (msan_track_origins or '2'))
+  }
+
+
 def gclient_runhooks_msan(source_dir, msan_track_origins):
   """Run gclient runhooks for msan."""
   common.execute(
       'gclient', 'runhooks', source_dir,
-      env={
-          'GYP_DEFINES': (
-              'msan=1 msan_track_origins=%s '
-              'use_prebuilt_instrumented_libraries=1'
-              % (msan_track_origins or '2'))
-      }
+      env=get_msan_runhooks_env(msan_track_origins)
   )
 
 
+def get_file_sha1(path):
+  """Return the SHA-1 of the file's content, or None if it doesn't exist."""
+  try:
+    with open(path, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+  except IOError:
+    return None
+
+
+def get_goma_dir():
+  """Return the dir of GOMA."""
+  return os.environ.get('GOMA_DIR', GOMA_DIR)
+
+
 def ensure_goma():
   """Ensures GOMA is installed and ready for use, and starts it."""
-  goma_dir = os.environ.get('GOMA_DIR', GOMA_DIR)
+  goma_dir = get_goma_dir()
   if not os.path.isfile(os.path.join(goma_dir, 'goma_ctl.py')):
     raise error.GomaNotInstalledError()
 
@@ -207,8 +316,106 @@ def serialize_gn_args(args_hash):
   return '\n'.join(args)
 
 
-def download_build_if_needed(dest, url):
-  """Download and extract a build (if it's not already there)."""
+def get_build_root(names, zip_path):
+  """Return the dir of args.gn among the zip members. args.gn is guaranteed to
+    be in the wanted folder. In Chrome, it's under a sub-directory. In
+    Android, it's in the top dir."""
+  args_gn_names = [
+      name for name in names if os.path.basename(name) == ARGS_GN_FILENAME]
+  if not args_gn_names:
+    raise Exception(
+        'Cannot find file named %s in %s.' % (ARGS_GN_FILENAME, zip_path))
+  return os.path.dirname(min(args_gn_names, key=lambda n: n.count('/')))
+
+
+def extract_members(zip_path, names, prefix, dest):
+  """Extract the zip members into dest without prefix. Members that were
+    already extracted are skipped. Every thread opens the zip because a
+    ZipFile can't be shared between threads."""
+  with zipfile.ZipFile(zip_path) as zip_file:
+    for name in names:
+      path = os.path.join(dest, name[len(prefix):])
+      if os.path.lexists(path):
+        continue
+
+      info = zip_file.getinfo(name)
+      mode = info.external_attr >> 16
+      # Another process might extract the same file from a shared build, so
+      # a file only appears once it's complete.
+      tmp_path = '%s.tmp-%d' % (path, os.getpid())
+
+      if stat.S_ISLNK(mode):
+        os.symlink(zip_file.read(info), tmp_path)
+      else:
+        with zip_file.open(info) as src, open(tmp_path, 'wb') as dst:
+          shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+        # Unlike unzip, ZipFile doesn't restore the permissions.
+        if stat.S_IMODE(mode):
+          os.chmod(tmp_path, stat.S_IMODE(mode))
+      os.rename(tmp_path, path)
+
+
+def matches_any(path, patterns):
+  """Return True if path matches one of the fnmatch patterns."""
+  return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def extract_build(zip_path, dest, patterns=None):
+  """Extract the dir of args.gn in the zip directly into dest, using several
+    threads. If patterns is given, only the files whose paths under the dir
+    match one of the patterns are extracted. Return the path of args.gn."""
+  with zipfile.ZipFile(zip_path) as zip_file:
+    infos = zip_file.infolist()
+
+  root = get_build_root([info.filename for info in infos], zip_path)
+  prefix = root + '/' if root else ''
+  infos = [info for info in infos
+           if info.filename.startswith(prefix) and info.filename != prefix]
+  if patterns is not None:
+    infos = [info for info in infos
+             if matches_any(info.filename[len(prefix):], patterns)]
+
+  # Create the dirs before extracting, so the threads don't race to create
+  # the same dir.
+  common.ensure_dir(dest)
+  for info in infos:
+    dir_path = os.path.dirname(os.path.join(dest, info.filename[len(prefix):]))
+    common.ensure_dir(dir_path)
+
+  # Spread the largest files over the threads first.
+  files = sorted(
+      [info for info in infos if not info.filename.endswith('/')],
+      key=lambda info: info.file_size, reverse=True)
+  thread_count = max(1, min(multiprocessing.cpu_count(), len(files)))
+  chunks = [[info.filename for info in files[i::thread_count]]
+            for i in xrange(thread_count)]
+
+  thread_pool = pool.ThreadPool(thread_count)
+  try:
+    thread_pool.map(
+        lambda names: extract_members(zip_path, names, prefix, dest), chunks)
+  finally:
+    thread_pool.terminate()
+
+  return os.path.join(dest, ARGS_GN_FILENAME)
+
+
+def extract_build_files_if_needed(dest, patterns):
+  """Extract the files matching patterns (or all files if patterns is None)
+    from the zip kept in a lazily extracted build. Do nothing if the build is
+    fully extracted."""
+  zip_path = os.path.join(dest, BUILD_ZIP_FILENAME)
+  if not os.path.exists(zip_path):
+    return
+
+  logger.info('Extracting more files from the build...')
+  extract_build(zip_path, dest, patterns)
+
+
+def download_build_if_needed(dest, url, patterns=None):
+  """Download and extract a build (if it's not already there). If patterns is
+    given, only the matching files are extracted and the zip is kept in dest
+    for extracting the others on demand."""
   if os.path.exists(dest):
     return dest
 
@@ -216,22 +423,69 @@ def download_build_if_needed(dest, url):
 
   gsutil_path = url.replace(
       'https://storage.cloud.google.com/', 'gs://')
-  common.gsutil('cp %s .' % gsutil_path, common.CLUSTERFUZZ_CACHE_DIR)
-
   filename = os.path.basename(gsutil_path)
   saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, filename)
+  download_gs_file(gsutil_path, saved_file)
 
-  tmp_dir_path = tempfile.mkdtemp(dir=common.CLUSTERFUZZ_TMP_DIR)
-  common.execute('unzip', '-q %s -d %s' % (saved_file, tmp_dir_path), cwd='.')
+  logger.info('Extracting build data...')
+  try:
+    extract_build(saved_file, dest, patterns)
+    if patterns is not None:
+      os.rename(saved_file, os.path.join(dest, BUILD_ZIP_FILENAME))
+  except:
+    common.delete_if_exists(dest)
+    raise
+  finally:
+    logger.info('Cleaning up...')
+    common.delete_if_exists(saved_file)
+  return dest
 
-  # args.gn is guaranteed to be in the wanted folder. In Chrome, it's under a
-  # sub-directory. In Android, it's in the top dir.
-  args_gn_path = common.find_file('args.gn', tmp_dir_path)
-  shutil.copytree(os.path.dirname(args_gn_path), dest)
 
-  logger.info('Cleaning up...')
-  common.delete_if_exists(saved_file)
-  common.delete_if_exists(tmp_dir_path)
+def get_max_build_dirs():
+  """Return how many out dirs are kept for reuse."""
+  return max(1, int(os.environ.get(MAX_BUILD_DIRS_ENV, DEFAULT_MAX_BUILD_DIRS)))
+
+
+def get_gn_args_fingerprint(gn_args):
+  """Return a short hash of the gn args."""
+  return hashlib.sha1(serialize_gn_args(gn_args)).hexdigest()[:16]
+
+
+def mark_build_dir_used(build_dir):
+  """Record that the out dir is used now."""
+  common.ensure_dir(build_dir)
+  with open(os.path.join(build_dir, BUILD_DIR_STAMP_FILENAME), 'w'):
+    pass
+
+
+def get_build_dir_last_used_time(build_dir):
+  """Return when the out dir was used last, or None if it wasn't made by
+    get_build_dir_path, e.g. the per-testcase out dirs of older versions."""
+  try:
+    return os.stat(os.path.join(build_dir, BUILD_DIR_STAMP_FILENAME)).st_mtime
+  except OSError:
+    return None
+
+
+def evict_build_dirs(out_dir, build_dir, max_count):
+  """Delete the least recently used out dirs made by get_build_dir_path,
+    except build_dir, until at most max_count are left. Other out dirs might
+    have been edited by the user, so they are never deleted."""
+  build_dirs = []
+  for filename in os.listdir(out_dir):
+    path = os.path.join(out_dir, filename)
+    if (not filename.startswith(BUILD_DIR_PREFIX) or
+        not os.path.isdir(path) or path == build_dir):
+      continue
+    last_used_time = get_build_dir_last_used_time(path)
+    if last_used_time is not None:
+      build_dirs.append((last_used_time, path))
+
+  # build_dir is always kept.
+  evicted_count = len(build_dirs) + 1 - max_count
+  for _, path in sorted(build_dirs)[:max(0, evicted_count)]:
+    logger.info('Deleting the least recently used out dir %s.', path)
+    common.delete_if_exists(path)
 
 
 def git_checkout(sha, revision, source_dir_path):
@@ -256,6 +510,65 @@ def git_checkout(sha, revision, source_dir_path):
   common.execute(binary, args, source_dir_path)
 
 
+def get_goma_stats(goma_dir):
+  """Return (compiles finished by goma, compiles finished locally), or None
+    if goma doesn't report them."""
+  returncode, output = common.execute(
+      'python', 'goma_ctl.py stat', goma_dir, print_command=False,
+      print_output=False, exit_on_error=False)
+  goma_match = GOMA_FINISHED_REGEX.search(output)
+  local_match = LOCAL_FINISHED_REGEX.search(output)
+  if returncode != 0 or not goma_match or not local_match:
+    return None
+  return int(goma_match.group(1)), int(local_match.group(1))
+
+
+def compute_goma_fraction(stats_before, stats_after):
+  """Return the fraction of the compiles between the two stats that ran on
+    goma, or None if it's unknown."""
+  if not stats_before or not stats_after:
+    return None
+  goma_count = stats_after[0] - stats_before[0]
+  local_count = stats_after[1] - stats_before[1]
+  if goma_count + local_count <= 0:
+    return None
+  return float(goma_count) / (goma_count + local_count)
+
+
+def get_file_size(path):
+  """Return the size of the file, or 0 if it doesn't exist."""
+  try:
+    return os.path.getsize(path)
+  except OSError:
+    return 0
+
+
+def read_ninja_log_steps(path, offset):
+  """Return (seconds, output) of the steps that ninja logged after offset.
+    Ninja sometimes recompacts its log, in which case the whole log is read.
+    An edge with several outputs is logged once per output, so only its first
+    output is kept."""
+  steps = collections.OrderedDict()
+  try:
+    with open(path, 'r') as f:
+      if offset > os.fstat(f.fileno()).st_size:
+        offset = 0
+      f.seek(offset)
+      for line in f:
+        if line.startswith('#'):
+          continue
+        parts = line.rstrip('\n').split('\t')
+        if len(parts) != 5 or not parts[0].isdigit() or not parts[1].isdigit():
+          continue
+        start_ms, end_ms, _, command_hash, output = parts
+        key = (start_ms, end_ms, command_hash)
+        if key not in steps:
+          steps[key] = ((int(end_ms) - int(start_ms)) / 1000.0, output)
+  except IOError:
+    return []
+  return steps.values()
+
+
 def compute_goma_cores(goma_threads, disable_goma):
   """Choose the correct amount of GOMA cores for a build."""
   if goma_threads:
@@ -360,18 +673,41 @@ class BinaryProvider(object):
     """Get the binary name."""
     return self.definition.binary_name
 
+  def get_required_file_patterns(self):
+    """Return the patterns of the files that a reproduction needs from a
+      downloaded build, or None if it needs the whole build."""
+    return None
+
+  def extract_files(self, patterns):
+    """Make sure the files matching patterns are in the build directory."""
+
 
 class DownloadedBinary(BinaryProvider):
   """Uses a downloaded binary."""
 
   @common.memoize
   def get_build_dir_path(self):
-    """Returns the location of the correct build to use for reproduction."""
+    """Returns the location of the correct build to use for reproduction.
+      Testcases with the same build share one copy from the build store."""
     path = os.path.join(
         common.CLUSTERFUZZ_BUILDS_DIR, '%s_downloaded_build' % self.testcase.id)
-    download_build_if_needed(path, self.testcase.build_url)
+    # Builds downloaded before the build store existed are used as they are.
+    if os.path.isdir(path) and not os.path.islink(path):
+      return path
+
+    patterns = self.get_required_file_patterns()
+    build_store.link_build(
+        self.testcase.build_url, path,
+        functools.partial(download_build_if_needed, patterns=patterns))
+    # Another testcase might have extracted only its own files of the build.
+    extract_build_files_if_needed(path, patterns)
     return path
 
+  def extract_files(self, patterns):
+    """Extract the files matching patterns if the build is extracted
+      lazily."""
+    extract_build_files_if_needed(self.get_build_dir_path(), patterns)
+
   # Ensure the downloaded build uses the top dir. Because ClankiumBuilder
   # overrides this method.
   @common.memoize
@@ -382,7 +718,8 @@ class DownloadedBinary(BinaryProvider):
   @common.memoize
   def get_source_dir_path(self):
     """Return the chromium source dir path."""
-    # Need asan_symbolizer.py from Chromium's source code.
+    # Old layout tests are copied into Chromium's LayoutTests directory. See
+    # reproducers.update_testcase_path_in_layout_test.
     return get_or_ask_for_source_location('chromium')
 
   def get_android_libclang_dir_path(self):
@@ -411,6 +748,42 @@ class GenericBuilder(BinaryProvider):
     # These attributes don't need computation. Therefore, they are not methods.
     self.extra_gn_args = {}
     self.include_lib32 = False
+    self.timings = collections.OrderedDict()
+    self.build_summary = None
+
+  @contextlib.contextmanager
+  def timed(self, step):
+    """Record how long the step takes."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.timings[step] = time.time() - start_time
+
+  def log_build_summary(self):
+    """Log how long each step of the build took and how ninja performed. The
+      whole summary goes into the log file."""
+    lines = ['  %-16s %7.1fs' % (step, seconds)
+             for step, seconds in self.build_summary['timings'].iteritems()]
+
+    ninja_summary = self.build_summary['ninja']
+    ninja_line = '  ninja: %d/%d edges with -j %s -l %s' % (
+        ninja_summary['finished_edges'], ninja_summary['total_edges'],
+        self.build_summary['goma_cores'], self.build_summary['goma_load'])
+    if ninja_summary['edges_per_second']:
+      ninja_line += ', %.1f edges/s' % ninja_summary['edges_per_second']
+    if self.build_summary['goma_fraction'] is not None:
+      ninja_line += ', %d%% on goma' % (
+          self.build_summary['goma_fraction'] * 100)
+    lines.append(ninja_line)
+
+    if self.build_summary['slowest_steps']:
+      lines.append('  Slowest steps:')
+      for step in self.build_summary['slowest_steps']:
+        lines.append('    %7.1fs %s' % (step['seconds'], step['output']))
+
+    logger.info('Build summary:\n%s', '\n'.join(lines))
+    logger.debug('Build summary: %s', json.dumps(self.build_summary))
 
   @common.memoize
   def get_target_names(self):
@@ -435,10 +808,18 @@ class GenericBuilder(BinaryProvider):
 
   @common.memoize
   def get_build_dir_path(self):
-    """Return the correct out dir in which to build the revision.
-      Directory name is of the format clusterfuzz_<testcase_id>_<git_sha>."""
-    return os.path.join(
-        self.get_source_dir_path(), 'out', 'clusterfuzz_%s' % self.testcase.id)
+    """Return the correct out dir in which to build the revision. Testcases
+      with the same gn args share an out dir, so ninja only rebuilds what
+      changed since the last build in it. Directory name is of the format
+      clusterfuzz_<gn_args_fingerprint>."""
+    out_dir = os.path.join(self.get_source_dir_path(), 'out')
+    build_dir = os.path.join(
+        out_dir, '%s%s' % (
+            BUILD_DIR_PREFIX, get_gn_args_fingerprint(self.get_gn_args())))
+
+    mark_build_dir_used(build_dir)
+    evict_build_dirs(out_dir, build_dir, get_max_build_dirs())
+    return build_dir
 
   @common.memoize
   def get_gn_args(self):
@@ -455,12 +836,27 @@ class GenericBuilder(BinaryProvider):
 
     return args
 
+  def is_gn_gen_needed(self, content):
+    """Return True if args.gn differs from content or gn hasn't generated the
+      build files yet."""
+    build_dir = self.get_build_dir_path()
+    for filename in GN_GENERATED_FILENAMES:
+      if not os.path.exists(os.path.join(build_dir, filename)):
+        return True
+
+    try:
+      with open(os.path.join(build_dir, ARGS_GN_FILENAME), 'r') as f:
+        return f.read() != content
+    except IOError:
+      return True
+
   def gn_gen(self):
-    """Finalize args.gn and run `gn gen`."""
+    """Finalize args.gn and run `gn gen`. Rewriting args.gn makes ninja
+      regenerate the build files, so nothing is written when args.gn is
+      unchanged."""
     args_gn_path = os.path.join(self.get_build_dir_path(), ARGS_GN_FILENAME)
 
     common.ensure_dir(self.get_build_dir_path())
-    common.delete_if_exists(args_gn_path)
 
     # Let users edit the current args.
     content = serialize_gn_args(self.get_gn_args())
@@ -469,7 +865,12 @@ class GenericBuilder(BinaryProvider):
         comment='Edit %s before building.' % ARGS_GN_FILENAME,
         should_edit=self.options.edit_mode)
 
+    if not self.is_gn_gen_needed(content):
+      logger.info('%s is unchanged. Skipping `gn gen`.', args_gn_path)
+      return
+
     # Write args to file and store.
+    common.delete_if_exists(args_gn_path)
     with open(args_gn_path, 'w') as f:
       f.write(content)
 
@@ -502,38 +903,114 @@ class GenericBuilder(BinaryProvider):
       needed in every build, yet the arguments might differ."""
     pass
 
+  def get_runhooks_env(self):
+    """Return the env that gclient runhooks is run with."""
+    return {}
+
+  def get_deps_fingerprint(self):
+    """Return the fingerprint of the inputs of the dependency steps: the
+      builder, the checked out SHA, DEPS and the env of gclient runhooks."""
+    _, sha = common.execute(
+        'git', 'rev-parse HEAD', self.get_main_repo_path(),
+        print_command=False, print_output=False)
+    return disk_cache.get_key(
+        self.__class__.__name__, sha.strip(),
+        get_file_sha1(
+            os.path.join(self.get_source_dir_path(), DEPS_FILENAME)),
+        self.get_runhooks_env())
+
+  def get_deps_stamp_path(self, step):
+    """Return the path of the stamp file of the step."""
+    return os.path.join(
+        DEPS_STAMP_DIR,
+        disk_cache.get_key(os.path.realpath(self.get_source_dir_path())),
+        step)
+
+  def run_deps_step(self, step, fn, fingerprint):
+    """Run fn unless it has already succeeded with the same fingerprint."""
+    stamp_path = self.get_deps_stamp_path(step)
+    if os.path.exists(stamp_path):
+      with open(stamp_path, 'r') as f:
+        if f.read() == fingerprint:
+          logger.info('Skipping %s because its inputs have not changed.', step)
+          return
+
+    # A step that fails half way leaves the checkout in an unknown state.
+    common.delete_if_exists(stamp_path)
+    fn()
+
+    common.ensure_dir(os.path.dirname(stamp_path))
+    with open(stamp_path, 'w') as f:
+      f.write(fingerprint)
+
   def setup_all_deps(self):
-    """Setup all dependencies."""
+    """Setup all dependencies. Steps whose inputs haven't changed since they
+      last succeeded are skipped."""
     if self.options.skip_deps:
       return
-    self.gclient_sync()
-    self.gclient_runhooks()
-    self.install_deps()
+    fingerprint = self.get_deps_fingerprint()
+    self.run_deps_step('gclient_sync', self.gclient_sync, fingerprint)
+    self.run_deps_step('gclient_runhooks', self.gclient_runhooks, fingerprint)
+    self.run_deps_step('install_deps', self.install_deps, fingerprint)
 
   def build(self):
     """Build the correct revision in the source directory."""
+    self.timings.clear()
     if not self.options.current:
-      git_checkout(
-          self.get_git_sha(), self.testcase.revision,
-          self.get_main_repo_path())
-
-    self.setup_all_deps()
-    self.gn_gen()
-
-    common.execute(
-        'ninja',
-        ("-w 'dupbuild=err' -C {build_dir} -j {goma_cores} -l {goma_load} "
-         '{targets}'.format(
-             build_dir=self.get_build_dir_path(),
-             goma_cores=compute_goma_cores(
-                 self.options.goma_threads, self.options.disable_goma),
-             goma_load=compute_goma_load(self.options.goma_load),
-             targets=' '.join(self.get_target_names()))),
-        # Unset the memory tools' envs. See:
-        # https://github.com/google/clusterfuzz-tools/issues/433
-        self.get_source_dir_path(),
-        capture_output=False,
-        stdout_transformer=output_transformer.Ninja())
+      with self.timed('checkout'):
+        git_checkout(
+            self.get_git_sha(), self.testcase.revision,
+            self.get_main_repo_path())
+
+    with self.timed('deps'):
+      self.setup_all_deps()
+    with self.timed('gn gen'):
+      self.gn_gen()
+
+    build_dir = self.get_build_dir_path()
+    ninja_log_path = os.path.join(build_dir, NINJA_LOG_FILENAME)
+    ninja_log_offset = get_file_size(ninja_log_path)
+    goma_stats_before = None
+    if not self.options.disable_goma:
+      goma_stats_before = get_goma_stats(get_goma_dir())
+    goma_cores = compute_goma_cores(
+        self.options.goma_threads, self.options.disable_goma)
+    goma_load = compute_goma_load(self.options.goma_load)
+    transformer = output_transformer.Ninja()
+
+    with self.timed('ninja'):
+      common.execute(
+          'ninja',
+          ("-w 'dupbuild=err' -C {build_dir} -j {goma_cores} -l {goma_load} "
+           '{targets}'.format(
+               build_dir=build_dir,
+               goma_cores=goma_cores,
+               goma_load=goma_load,
+               targets=' '.join(self.get_target_names()))),
+          # Unset the memory tools' envs. See:
+          # https://github.com/google/clusterfuzz-tools/issues/433
+          self.get_source_dir_path(),
+          capture_output=False,
+          stdout_transformer=transformer)
+
+    goma_fraction = None
+    if goma_stats_before:
+      goma_fraction = compute_goma_fraction(
+          goma_stats_before, get_goma_stats(get_goma_dir()))
+    steps = read_ninja_log_steps(ninja_log_path, ninja_log_offset)
+    self.build_summary = {
+        'timings': collections.OrderedDict(self.timings),
+        'ninja': transformer.get_summary(),
+        'goma_cores': goma_cores,
+        'goma_load': goma_load,
+        'goma_fraction': goma_fraction,
+        'slowest_steps': [
+            {'seconds': seconds, 'output': output}
+            for seconds, output in sorted(
+                steps, reverse=True)[:SLOWEST_STEPS_COUNT]
+        ],
+    }
+    self.log_build_summary()
 
 
 class PdfiumBuilder(GenericBuilder):
@@ -549,8 +1026,10 @@ class PdfiumBuilder(GenericBuilder):
   @common.memoize
   def get_git_sha(self):
     """Return git sha."""
-    chromium_sha = sha_from_revision(self.testcase.revision, 'chromium/src')
-    return get_third_party_sha(chromium_sha, 'pdfium_revision')
+    chromium_dir = get_local_chromium_dir()
+    chromium_sha = sha_from_revision(
+        self.testcase.revision, 'chromium/src', chromium_dir)
+    return get_third_party_sha(chromium_sha, 'pdfium_revision', chromium_dir)
 
 
 class ChromiumBuilder(GenericBuilder):
@@ -565,7 +1044,8 @@ class ChromiumBuilder(GenericBuilder):
   @common.memoize
   def get_git_sha(self):
     """Return git sha."""
-    return sha_from_revision(self.testcase.revision, 'chromium/src')
+    return sha_from_revision(
+        self.testcase.revision, 'chromium/src', self.get_source_dir_path())
 
   def install_deps(self):
     """Run all commands that only need to run once. This means the commands
@@ -596,6 +1076,16 @@ class LibfuzzerAndAflBuilder(ChromiumBuilder):
     """Get the binary name."""
     return self.get_target_names()[0]
 
+  def get_required_file_patterns(self):
+    """Return the target, its .dict and .options files, the shared libraries
+      (e.g. the sanitizer runtime) and the data that targets load at
+      startup. Other files are extracted with extract_files when needed."""
+    binary_name = self.get_binary_name()
+    return [
+        ARGS_GN_FILENAME, binary_name, '%s.dict' % binary_name,
+        '%s.options' % binary_name, '*.so', '*.so.*'
+    ] + RUNTIME_DATA_PATTERNS
+
 
 class V8Builder(GenericBuilder):
   """Builds a fresh v8 binary."""
@@ -613,10 +1103,13 @@ class V8Builder(GenericBuilder):
     # All the revisions will be v8's revisions. We can remove this condition
     # and its logic on 6 Dec 2017.
     if self.testcase.revision > 400000:
-      chromium_sha = sha_from_revision(self.testcase.revision, 'chromium/src')
-      return get_third_party_sha(chromium_sha, 'v8_revision')
+      chromium_dir = get_local_chromium_dir()
+      chromium_sha = sha_from_revision(
+          self.testcase.revision, 'chromium/src', chromium_dir)
+      return get_third_party_sha(chromium_sha, 'v8_revision', chromium_dir)
     else:
-      return sha_from_revision(self.testcase.revision, 'v8/v8')
+      return sha_from_revision(
+          self.testcase.revision, 'v8/v8', self.get_source_dir_path())
 
   def install_deps(self):
     """Run all commands that only need to run once. This means the commands
@@ -655,6 +1148,10 @@ class MsanMixin(object):
         self.get_source_dir_path(),
         self.get_gn_args().get('msan_track_origins'))
 
+  def get_runhooks_env(self):
+    """Return the env of gclient runhooks for msan."""
+    return get_msan_runhooks_env(self.get_gn_args().get('msan_track_origins'))
+
 
 class Lib32Mixin(object):
   """Mix lib32 setting."""
@@ -0,0 +1,175 @@
+"""A store of extracted builds that is shared by all testcases."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import logging
+import os
+
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+
+
+STORE_DIR = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, 'store')
+MAX_SIZE_ENV = 'CF_BUILDS_MAX_SIZE_GB'
+DEFAULT_MAX_SIZE_GB = 50
+TMP_DIR_PREFIX = '.tmp-'
+LOCK_FILE_SUFFIX = '.lock'
+SIZE_FILE_SUFFIX = '.size'
+
+# The lock files of the builds used by this process. Holding a shared lock is
+# a reference to the build, so it can't be evicted. The kernel drops the
+# references when the process exits, even if it crashes.
+LOCKS = {}
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_max_bytes():
+  """Return the disk budget of the store."""
+  size_gb = float(os.environ.get(MAX_SIZE_ENV, DEFAULT_MAX_SIZE_GB))
+  return int(size_gb * 1024 * 1024 * 1024)
+
+
+def get_path(key):
+  """Get the path of the extracted build."""
+  return os.path.join(STORE_DIR, key)
+
+
+def get_dir_size(path):
+  """Return the total size of the files under path."""
+  total_bytes = 0
+  for root, _, filenames in os.walk(path):
+    for filename in filenames:
+      total_bytes += os.lstat(os.path.join(root, filename)).st_size
+  return total_bytes
+
+
+def lock(key, operation):
+  """Lock the build. The lock file is kept open until the process exits."""
+  if key not in LOCKS:
+    common.ensure_dir(STORE_DIR)
+    LOCKS[key] = open(get_path(key) + LOCK_FILE_SUFFIX, 'a')
+  fcntl.flock(LOCKS[key], operation)
+
+
+def download(key, url, download_fn):
+  """Download the build into a tmp dir and move it into the store, so a
+    partially extracted build is never used."""
+  path = get_path(key)
+  tmp_path = os.path.join(STORE_DIR, TMP_DIR_PREFIX + key)
+  common.delete_if_exists(tmp_path)
+  download_fn(tmp_path, url)
+
+  with open(path + SIZE_FILE_SUFFIX, 'w') as f:
+    f.write(str(get_dir_size(tmp_path)))
+  os.rename(tmp_path, path)
+
+
+def link_build(url, view_path, download_fn):
+  """Make view_path a symlink to the extracted build of url. If the store
+    doesn't have the build, download_fn(dest, url) is called to extract it
+    into dest. The build is referenced until the process exits."""
+  key = disk_cache.get_key(url)
+  path = get_path(key)
+
+  lock(key, fcntl.LOCK_SH)
+  if not os.path.isdir(path):
+    # Only one process downloads a build. The others wait for it.
+    lock(key, fcntl.LOCK_UN)
+    lock(key, fcntl.LOCK_EX)
+    if not os.path.isdir(path):
+      download(key, url, download_fn)
+    else:
+      logger.info('Another process has downloaded the build.')
+    lock(key, fcntl.LOCK_SH)
+
+  # The modified time of the lock file marks the build as recently used.
+  os.utime(path + LOCK_FILE_SUFFIX, None)
+
+  if os.path.realpath(view_path) != os.path.realpath(path):
+    if os.path.islink(view_path):
+      os.remove(view_path)
+    os.symlink(path, view_path)
+
+  evict()
+  return path
+
+
+def get_entries():
+  """Return (mtime, size, key) of all builds, the least recently used
+    first."""
+  if not os.path.isdir(STORE_DIR):
+    return []
+
+  entries = []
+  for key in os.listdir(STORE_DIR):
+    path = get_path(key)
+    if key.startswith(TMP_DIR_PREFIX) or not os.path.isdir(path):
+      continue
+    try:
+      mtime = os.stat(path + LOCK_FILE_SUFFIX).st_mtime
+      with open(path + SIZE_FILE_SUFFIX, 'r') as f:
+        size = int(f.read())
+    except (IOError, OSError, ValueError):
+      mtime, size = 0, get_dir_size(path)
+    entries.append((mtime, size, key))
+  return sorted(entries)
+
+
+def try_lock_exclusively(key):
+  """Return the lock file if no process references the build, or None."""
+  lock_file = open(get_path(key) + LOCK_FILE_SUFFIX, 'a')
+  try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except IOError:
+    lock_file.close()
+    return None
+  return lock_file
+
+
+def delete_views(path):
+  """Delete the symlinks of the testcases that point to path."""
+  for filename in os.listdir(common.CLUSTERFUZZ_BUILDS_DIR):
+    view_path = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, filename)
+    if os.path.islink(view_path) and os.readlink(view_path) == path:
+      os.remove(view_path)
+
+
+def evict():
+  """Delete the least recently used builds that aren't referenced until the
+    store fits into its disk budget."""
+  max_bytes = get_max_bytes()
+  entries = get_entries()
+  total_bytes = sum(size for _, size, _ in entries)
+  for _, size, key in entries:
+    if total_bytes <= max_bytes:
+      break
+    if key in LOCKS:
+      continue
+
+    lock_file = try_lock_exclusively(key)
+    if not lock_file:
+      logger.debug('Build %s is in use. Not evicting it.', key)
+      continue
+
+    path = get_path(key)
+    logger.info('Evicting the build %s to save disk space.', path)
+    try:
+      delete_views(path)
+      common.delete_if_exists(path)
+      common.delete_if_exists(path + SIZE_FILE_SUFFIX)
+    finally:
+      lock_file.close()
+    total_bytes -= size
@@ -0,0 +1,42 @@
+"""Module for the 'cache' command.
+
+Shows or prunes the cache of ClusterFuzz responses."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from clusterfuzz import http_cache
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def format_stats(stats):
+  """Format the stats of each URL as lines."""
+  lines = []
+  for url, url_stats in stats.iteritems():
+    policy = http_cache.get_policy(url).kind if url else 'unreadable'
+    lines.append(
+        '%s (%s): %d entries, %d bytes, %d expired' % (
+            url, policy, url_stats['entries'], url_stats['bytes'],
+            url_stats['expired']))
+  return '\n'.join(lines) or 'The cache is empty.'
+
+
+def execute(action):
+  """Execute the cache command."""
+  if action == 'stats':
+    logger.info(format_stats(http_cache.get_stats()))
+  elif action == 'prune':
+    logger.info('Deleted %d cached responses.', http_cache.prune())
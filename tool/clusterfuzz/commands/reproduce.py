@@ -17,6 +17,7 @@ Locally reproduces a testcase given a ClusterFuzz ID."""
 
 import os
 import json
+from multiprocessing import pool
 import time
 import urllib
 import webbrowser
@@ -24,6 +25,7 @@ import logging
 import yaml
 
 from clusterfuzz import common
+from clusterfuzz import http_cache
 from clusterfuzz import stackdriver_logging
 from clusterfuzz import testcase
 from clusterfuzz import binary_providers
@@ -43,6 +45,8 @@ GOOGLE_OAUTH_URL = 'https://accounts.google.com/o/oauth2/v2/auth?%s' % (
         'response_type': 'code',
         'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'}))
 RETRY_COUNT = 5
+# The number of testcases that are downloaded at the same time.
+PREFETCH_THREADS = 4
 logger = logging.getLogger('clusterfuzz')
 
 
@@ -89,7 +93,7 @@ def send_request(url, data):
   header = common.get_stored_auth_header() or get_verification_header()
   response = None
   for _ in range(RETRY_COUNT):
-    response = common.post(
+    response = http_cache.post(
         url=url,
         headers={
             'Authorization': header,
@@ -113,7 +117,9 @@ def send_request(url, data):
         response.status_code, response.text,
         str(response.headers.get(CLUSTERFUZZ_AUTH_IDENTITY, '')))
 
-  common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
+  # A cached response doesn't have the refreshed access token.
+  if CLUSTERFUZZ_AUTH_HEADER in response.headers:
+    common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
   return response
 
 
@@ -138,6 +144,38 @@ def get_testcase_and_identity(testcase_id, force=False):
       raise e
 
 
+def prefetch_testcase(testcase_id, force):
+  """Download the information and the file of the testcase. Return
+    (testcase, identity), or the expected exception that stopped it."""
+  try:
+    current_testcase, identity = get_testcase_and_identity(testcase_id, force)
+    current_testcase.get_testcase_path()
+  except error.ExpectedException as e:
+    return e
+  return current_testcase, identity
+
+
+def prefetch_testcases(testcase_ids, force):
+  """Download the information and the files of the testcases concurrently.
+    Return the results of prefetch_testcase in the order of testcase_ids. The
+    first testcase is downloaded alone, so the user is asked to log in at most
+    once."""
+  if not testcase_ids:
+    return []
+
+  results = [prefetch_testcase(testcase_ids[0], force)]
+  if len(testcase_ids) > 1:
+    thread_pool = pool.ThreadPool(
+        min(PREFETCH_THREADS, len(testcase_ids) - 1))
+    try:
+      results.extend(thread_pool.map(
+          lambda testcase_id: prefetch_testcase(testcase_id, force),
+          testcase_ids[1:]))
+    finally:
+      thread_pool.terminate()
+  return results
+
+
 def parse_job_definition(job_definition, presets):
   """Reads in a job definition hash and parses it."""
 
@@ -257,10 +295,32 @@ def create_builder_class(build, definition):
   return type(name, tuple(types), {})
 
 
+def reproduce_testcase(current_testcase, definition, options):
+  """Build or download the binary and reproduce the testcase."""
+  warn_unreproducible_if_needed(current_testcase)
+
+  binary_provider = create_builder_class(options.build, definition)(
+      testcase=current_testcase,
+      definition=definition,
+      options=options)
+  binary_provider.build()
+
+  reproducer = definition.reproducer(
+      definition=definition,
+      binary_provider=binary_provider,
+      testcase=current_testcase,
+      sanitizer=definition.sanitizer,
+      options=options)
+  try:
+    return reproducer.reproduce(options.iterations)
+  finally:
+    warn_unreproducible_if_needed(current_testcase)
+
+
 @stackdriver_logging.log
 def execute(testcase_id, current, build, disable_goma, goma_threads, goma_load,
             iterations, disable_xvfb, target_args, edit_mode, skip_deps,
-            enable_debug, extra_log_params, force):
+            enable_debug, extra_log_params, force, parallel_iterations):
   """Execute the reproduce command."""
   options = common.Options(
       testcase_id=testcase_id,
@@ -275,7 +335,8 @@ def execute(testcase_id, current, build, disable_goma, goma_threads, goma_load,
       edit_mode=edit_mode,
       skip_deps=skip_deps,
       enable_debug=enable_debug,
-      extra_log_params=extra_log_params, force=force)
+      extra_log_params=extra_log_params, force=force,
+      parallel_iterations=parallel_iterations)
 
   logger.info('Reproducing testcase %s', testcase_id)
   logger.debug('%s', str(options))
@@ -292,21 +353,4 @@ def execute(testcase_id, current, build, disable_goma, goma_threads, goma_load,
   current_testcase.get_testcase_path()
   definition = get_definition(current_testcase.job_type, testcase_id, build)
 
-  warn_unreproducible_if_needed(current_testcase)
-
-  binary_provider = create_builder_class(build, definition)(
-      testcase=current_testcase,
-      definition=definition,
-      options=options)
-  binary_provider.build()
-
-  reproducer = definition.reproducer(
-      definition=definition,
-      binary_provider=binary_provider,
-      testcase=current_testcase,
-      sanitizer=definition.sanitizer,
-      options=options)
-  try:
-    reproducer.reproduce(iterations)
-  finally:
-    warn_unreproducible_if_needed(current_testcase)
+  reproduce_testcase(current_testcase, definition, options)
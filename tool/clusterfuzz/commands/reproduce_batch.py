@@ -0,0 +1,170 @@
+"""Module for the 'reproduce_batch' command.
+
+Locally reproduces several testcases given their ClusterFuzz IDs. Testcases
+that use the same build are reproduced back to back."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import time
+import traceback
+
+from clusterfuzz import common
+from clusterfuzz import stackdriver_logging
+from clusterfuzz.commands import reproduce
+from error import error
+
+
+REPRODUCED = 'Reproduced'
+RESULT_COLUMNS = ['Testcase', 'Job type', 'Revision', 'Result', 'Time']
+logger = logging.getLogger('clusterfuzz')
+
+Result = collections.namedtuple(
+    'Result', ['testcase_id', 'job_type', 'revision', 'result', 'seconds'])
+
+
+def get_group_key(current_testcase, build):
+  """Return the key of the build that the testcase needs. Downloaded builds
+    are identified by their URL. Local builds are identified by their
+    revision."""
+  if build == 'download':
+    return current_testcase.job_type, current_testcase.build_url
+  return current_testcase.job_type, current_testcase.revision
+
+
+def group_testcases(testcases, build):
+  """Group the testcases by the build they need. The groups are in the order
+    of their first testcase."""
+  groups = collections.OrderedDict()
+  for current_testcase in testcases:
+    groups.setdefault(
+        get_group_key(current_testcase, build), []).append(current_testcase)
+  return groups
+
+
+def get_testcases(testcase_ids, force, results):
+  """Download the information and the files of all testcases before building,
+    so the OAuth access token can't expire in between. A testcase that can't
+    be downloaded is added to results."""
+  testcases = []
+  identity = None
+  for testcase_id, prefetched in zip(
+      testcase_ids, reproduce.prefetch_testcases(testcase_ids, force)):
+    if isinstance(prefetched, error.ExpectedException):
+      logger.info(
+          common.colorize('%s: %s', common.BASH_YELLOW_MARKER),
+          prefetched.__class__.__name__, prefetched.message)
+      results.append(
+          Result(testcase_id, '', '', prefetched.__class__.__name__, 0))
+      continue
+    current_testcase, identity = prefetched
+    testcases.append(current_testcase)
+  return testcases, identity
+
+
+def reproduce_testcase(current_testcase, definition, options):
+  """Reproduce the testcase and return its result. Failing to reproduce a
+    testcase doesn't stop the batch."""
+  start_time = time.time()
+  try:
+    reproduce.reproduce_testcase(current_testcase, definition, options)
+    result = REPRODUCED
+  except error.ExpectedException as e:
+    logger.info(
+        common.colorize('%s: %s', common.BASH_YELLOW_MARKER),
+        e.__class__.__name__, e.message)
+    result = e.__class__.__name__
+  except Exception as e:  # pylint: disable=broad-except
+    logger.info(
+        common.colorize('%s: %s', common.BASH_YELLOW_MARKER),
+        e.__class__.__name__, e)
+    logger.debug(traceback.format_exc())
+    result = 'Failed: %s' % e.__class__.__name__
+
+  return Result(
+      current_testcase.id, current_testcase.job_type,
+      current_testcase.revision, result, time.time() - start_time)
+
+
+def format_results(results):
+  """Format the results as a table."""
+  rows = [RESULT_COLUMNS] + [
+      [str(r.testcase_id), r.job_type, str(r.revision), r.result,
+       '%.0fs' % r.seconds]
+      for r in results]
+  widths = [
+      max(len(row[i]) for row in rows) for i in range(len(RESULT_COLUMNS))]
+  return '\n'.join(
+      '  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+      for row in rows)
+
+
+@stackdriver_logging.log
+def execute(testcase_ids, current, build, disable_goma, goma_threads,
+            goma_load, iterations, disable_xvfb, target_args, edit_mode,
+            skip_deps, enable_debug, extra_log_params, force,
+            parallel_iterations):
+  """Execute the reproduce_batch command."""
+  options = common.Options(
+      testcase_id=None,
+      current=current,
+      build=build,
+      disable_goma=disable_goma,
+      goma_threads=goma_threads,
+      goma_load=goma_load,
+      iterations=iterations,
+      disable_xvfb=disable_xvfb,
+      target_args=target_args,
+      edit_mode=edit_mode,
+      skip_deps=skip_deps,
+      enable_debug=enable_debug,
+      extra_log_params=extra_log_params, force=force,
+      parallel_iterations=parallel_iterations)
+
+  logger.info('Reproducing testcases %s', ', '.join(testcase_ids))
+  logger.debug('%s', str(options))
+
+  common.ensure_important_dirs()
+
+  results = []
+  try:
+    testcases, identity = get_testcases(testcase_ids, force, results)
+    extra_log_params['identity'] = identity
+
+    groups = group_testcases(testcases, build)
+    for (job_type, _), group in groups.iteritems():
+      logger.info(
+          common.colorize('\nReproducing %s with the same build of %s.',
+                          common.BASH_GREEN_MARKER),
+          ', '.join(str(t.id) for t in group), job_type)
+      # The first testcase of a group builds or downloads. The others reuse
+      # its build.
+      try:
+        definition = reproduce.get_definition(job_type, group[0].id, build)
+      except error.ExpectedException as e:
+        for current_testcase in group:
+          results.append(Result(
+              current_testcase.id, job_type, current_testcase.revision,
+              e.__class__.__name__, 0))
+        continue
+
+      for current_testcase in group:
+        results.append(reproduce_testcase(
+            current_testcase, definition,
+            options._replace(testcase_id=str(current_testcase.id))))
+  finally:
+    extra_log_params['results'] = {
+        str(r.testcase_id): r.result for r in results}
+    logger.info('\n%s', format_results(results))
@@ -13,8 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import functools
 import os
+import select
 import sys
 import stat
 import subprocess
@@ -23,9 +25,11 @@ import time
 import signal
 import shutil
 import tempfile
+import threading
 
 import namedlist
-import requests_cache
+import psutil
+import requests
 from requests.packages.urllib3.util import retry
 from requests import adapters
 from requests import exceptions
@@ -49,7 +53,14 @@ BASH_MAGENTA_MARKER = '\033[35m'
 BASH_RESET_COLOR_MARKER = '\033[39m'
 
 NO_SUCH_PROCESS_ERRNO = 3
-DEFAULT_READ_BUFFER_LENGTH = 10
+# How long a killed process group may take to exit after SIGTERM (e.g. to dump
+# a shutdown stacktrace) and after SIGKILL. kill returns as soon as it exits.
+KILL_TERM_GRACE_PERIOD = 3
+KILL_GRACE_PERIOD = 1
+KILL_POLL_INTERVAL = 0.05
+# A read returns whatever is available up to this length, so a large buffer
+# doesn't delay short outputs like gdb's prompt.
+DEFAULT_READ_BUFFER_LENGTH = 64 * 1024
 
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 CLUSTERFUZZ_CACHE_DIR = os.path.join(CLUSTERFUZZ_DIR, 'cache')
@@ -60,7 +71,9 @@ CLUSTERFUZZ_BUILDS_DIR = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'builds')
 AUTH_HEADER_FILE = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'auth_header')
 DOMAIN_NAME = 'clusterfuzz.com'
 TERMINAL_WIDTH = get_terminal_size().columns
-HTTP_CACHE_TTL = 2 * 60
+# The number of keep-alive connections per host. It's at least the number of
+# threads that send requests at the same time.
+HTTP_POOL_SIZE = 10
 # See: https://github.com/google/clusterfuzz-tools/issues/433
 BLACKLISTED_ENVS = {
     'ASAN_OPTIONS': '',
@@ -84,7 +97,8 @@ Options = namedlist.namedlist(
     'Options',
     ['testcase_id', 'current', 'build', 'disable_goma', 'goma_threads',
      'goma_load', 'iterations', 'disable_xvfb', 'target_args', 'edit_mode',
-     'skip_deps', 'enable_debug', 'extra_log_params', 'force']
+     'skip_deps', 'enable_debug', 'extra_log_params', 'force',
+     'parallel_iterations']
 )
 
 
@@ -119,24 +133,82 @@ def memoize(func):
   return wrapper
 
 
+class HttpSessionManager(object):
+  """Own the HTTP session that the whole process shares. Its connections are
+    kept alive and reused. The session may be used by several threads at the
+    same time. Responses are cached by http_cache, not by the session."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.session = None
+    self.adapter = None
+    self.request_count = 0
+    self.cache_hit_count = 0
+
+  def create_session(self):
+    """Create the session."""
+    session = requests.Session()
+    self.adapter = adapters.HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        # backoff_factor is 0.5. Therefore, the max wait time is 16s.
+        max_retries=retry.Retry(
+            total=5, backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504]))
+    session.mount('https://', self.adapter)
+    session.hooks['response'].append(self.record_response)
+    return session
+
+  def get(self):
+    """Return the session. It's created on the first call."""
+    with self.lock:
+      if self.session is None:
+        self.session = self.create_session()
+      return self.session
+
+  def record_response(self, *unused_args, **unused_kwargs):
+    """Count the requests."""
+    with self.lock:
+      self.request_count += 1
+
+  def record_cache_hit(self):
+    """Count a response that http_cache returned without a request."""
+    with self.lock:
+      self.cache_hit_count += 1
+
+  def get_connection_count(self):
+    """Return the number of HTTPS connections that have been opened."""
+    if not self.adapter:
+      return 0
+    pools = self.adapter.poolmanager.pools
+    return sum(pools[key].num_connections for key in pools.keys())
+
+  def get_stats(self):
+    """Return the number of requests, cache hits and opened connections. The
+      requests that didn't open a connection reused one."""
+    return {
+        'requests': self.request_count,
+        'cache_hits': self.cache_hit_count,
+        'connections': self.get_connection_count(),
+    }
+
+  def close(self):
+    """Close the connections. The next get() creates a new session."""
+    with self.lock:
+      if self.session is None:
+        return
+      logger.debug('HTTP stats: %s', self.get_stats())
+      self.session.close()
+      self.session = None
+      self.adapter = None
+
+
+HTTP_SESSION_MANAGER = HttpSessionManager()
+
+
 def get_http():
-  """Get the http object."""
-  ensure_dir(CLUSTERFUZZ_TESTCASES_DIR)
-  http = requests_cache.CachedSession(
-      cache_name=os.path.join(CLUSTERFUZZ_TESTCASES_DIR, 'http_cache'),
-      backend='sqlite',
-      allowable_methods=('GET', 'POST'),
-      allowable_codes=[200],
-      expire_after=HTTP_CACHE_TTL)
-  http.mount(
-      'https://',
-      adapters.HTTPAdapter(
-          # backoff_factor is 0.5. Therefore, the max wait time is 16s.
-          retry.Retry(
-              total=5, backoff_factor=0.5,
-              status_forcelist=[500, 502, 503, 504]))
-  )
-  return http
+  """Get the http object that the process shares."""
+  return HTTP_SESSION_MANAGER.get()
 
 
 def post(url, **kwargs):
@@ -244,36 +316,92 @@ def get_stored_auth_header():
     return f.read()
 
 
-def wait_timeout(proc, timeout):
-  """If proc runs longer than <timeout> seconds, kill it."""
-  if not timeout:
-    return
+class Timeout(object):
+  """Kill proc in the background if it runs longer than <timeout> seconds.
+    stop() must be called once proc has exited."""
 
-  try:
-    for _ in range(0, timeout * 2):
-      time.sleep(0.5)
-      if proc.poll():
-        break
+  def __init__(self, proc, timeout):
+    self.proc = proc
+    self.timeout = timeout
+    self.stopped = threading.Event()
+    self.thread = None
+
+    if timeout:
+      self.thread = threading.Thread(target=self.watch)
+      self.thread.daemon = True
+      self.thread.start()
+
+  def watch(self):
+    """Wait until stop() is called or the timeout expires."""
+    if self.stopped.wait(self.timeout):
+      return
 
-  finally:
+    logger.debug('Timeout (%ss) is reached.', self.timeout)
     try:
-      kill(proc)
+      kill(self.proc)
     except:  # pylint: disable=bare-except
       pass
 
+  def stop(self):
+    """Stop watching proc."""
+    self.stopped.set()
+    if self.thread:
+      self.thread.join()
+
+
+def is_group_running(pgid):
+  """Return True if a process of the group hasn't exited. An exited process
+    stays in the group as a zombie until its parent reaps it, so zombies don't
+    count."""
+  try:
+    os.killpg(pgid, 0)
+  except OSError as e:
+    if e.errno == NO_SUCH_PROCESS_ERRNO:
+      return False
+    raise
+
+  for process in psutil.process_iter():
+    try:
+      if (os.getpgid(process.pid) == pgid and
+          process.status() != psutil.STATUS_ZOMBIE):
+        return True
+    except (OSError, psutil.Error):
+      continue
+  return False
+
 
-def kill(proc):
-  """Kill a process multiple times.
+def wait_group_exit(proc, grace_period):
+  """Wait up to <grace_period> seconds for all processes in the group of proc
+    to exit. Return True if they have. proc isn't reaped here because the
+    thread that waits for it would race with us for its return code."""
+  deadline = time.time() + grace_period
+  while True:
+    if not is_group_running(proc.pid):
+      return True
+
+    if time.time() >= deadline:
+      return False
+    time.sleep(KILL_POLL_INTERVAL)
+
+
+def kill(proc, term_grace_period=None, kill_grace_period=None):
+  """Kill the process group of proc with SIGTERM, and then with SIGKILL if it
+    doesn't exit within the grace period.
     See: https://github.com/google/clusterfuzz-tools/pull/301"""
+  if term_grace_period is None:
+    term_grace_period = KILL_TERM_GRACE_PERIOD
+  if kill_grace_period is None:
+    kill_grace_period = KILL_GRACE_PERIOD
+
   try:
-    for sig in [signal.SIGTERM, signal.SIGTERM,
-                signal.SIGKILL, signal.SIGKILL]:
+    for sig, grace_period in [(signal.SIGTERM, term_grace_period),
+                              (signal.SIGKILL, kill_grace_period)]:
       logger.debug('Killing pid=%s with %s', proc.pid, sig)
       # Process leader id is the group id.
       os.killpg(proc.pid, sig)
 
-      # Wait for any shutdown stacktrace to be dumped.
-      time.sleep(3)
+      if wait_group_exit(proc, grace_period):
+        return
 
     raise error.KillProcessFailedError(proc.args, proc.pid)
   except OSError as e:
@@ -416,6 +544,35 @@ def start_execute(
   return proc
 
 
+def read_pipes(proc, read_buffer_length):
+  """Yield (pipe, chunk) as soon as stdout or stderr of proc has output, until
+    both are closed. Both pipes are drained together, so the process can't
+    block on a full stderr while we wait for stdout.
+    See: https://github.com/google/clusterfuzz-tools/issues/278"""
+  pipes = {}
+  poller = select.poll()
+  for pipe in [proc.stdout, proc.stderr]:
+    if pipe:
+      pipes[pipe.fileno()] = pipe
+      poller.register(pipe.fileno(), select.POLLIN | select.POLLPRI)
+
+  while pipes:
+    try:
+      events = poller.poll()
+    except select.error as e:
+      if e.args[0] == errno.EINTR:
+        continue
+      raise
+
+    for fd, _ in events:
+      chunk = os.read(fd, read_buffer_length)
+      if chunk:
+        yield pipes[fd], chunk
+      else:
+        poller.unregister(fd)
+        del pipes[fd]
+
+
 def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
                  timeout=None, stdout_transformer=None,
                  stderr_transformer=None,
@@ -428,48 +585,49 @@ def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
     stderr_transformer = output_transformer.Identity()
 
   logger.debug('---------------------------------------')
-  wait_timeout(proc, timeout)
+  process_timeout = Timeout(proc, timeout)
 
-  output_chunks = []
   stdout_transformer.set_output(sys.stdout)
   stderr_transformer.set_output(sys.stderr)
-
-  # Stdout is printed as the process runs because some commands (e.g. ninja)
-  # might take a long time to run.
-  for chunk in iter(lambda: proc.stdout.read(read_buffer_length), b''):
+  stdout_chunks = []
+  stderr_chunks = []
+  outputs = {
+      proc.stdout: (stdout_transformer, stdout_chunks),
+      proc.stderr: (stderr_transformer, stderr_chunks)}
+
+  # Both outputs are printed as the process runs because some commands (e.g.
+  # ninja) might take a long time to run.
+  for pipe, chunk in read_pipes(proc, read_buffer_length):
+    transformer, chunks = outputs[pipe]
     if print_output:
       local_logging.send_output(chunk)
-      stdout_transformer.process(chunk)
-    if capture_output:
-      # According to: http://stackoverflow.com/questions/19926089, this is the
-      # fastest way to build strings.
-      output_chunks.append(chunk)
-
-  # We cannot read from stderr because it might cause a hang.
-  # Therefore, we use communicate() to get stderr instead.
-  # See: https://github.com/google/clusterfuzz-tools/issues/278
-  stdout_data, stderr_data = proc.communicate()
-  stdout_data = stdout_data or ''
-  stderr_data = stderr_data or ''
+      transformer.process(chunk)
+    # stderr is needed for CommandFailedError even if the output isn't
+    # captured. According to: http://stackoverflow.com/questions/19926089,
+    # this is the fastest way to build strings.
+    if capture_output or pipe is proc.stderr:
+      chunks.append(chunk)
+
+  proc.wait()
+  process_timeout.stop()
   kill(proc)
 
-  for (transformer, data) in [(stdout_transformer, stdout_data),
-                              (stderr_transformer, stderr_data)]:
-    if capture_output:
-      output_chunks.append(data)
-
-    if print_output:
-      local_logging.send_output(data)
-      transformer.process(data)
-      transformer.flush()
+  if print_output:
+    local_logging.flush_output()
+    stdout_transformer.flush()
+    stderr_transformer.flush()
 
+  stderr_data = ''.join(stderr_chunks)
   logger.debug('---------------------------------------')
   if proc.returncode != 0:
     logger.debug('| Return code is non-zero (%d).', proc.returncode)
     if exit_on_error:
       logger.debug('| Exit.')
       raise error.CommandFailedError(proc.args, proc.returncode, stderr_data)
-  return proc.returncode, ''.join(output_chunks)
+
+  if not capture_output:
+    return proc.returncode, ''
+  return proc.returncode, ''.join(stdout_chunks) + stderr_data
 
 
 def execute(binary, args, cwd, print_command=True, print_output=True,
@@ -0,0 +1,101 @@
+"""A size-bounded on-disk cache that survives across runs."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from clusterfuzz import common
+
+
+TMP_FILE_PREFIX = '.tmp-'
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_key(*parts):
+  """Hash parts into a key. parts must be JSON-serializable."""
+  return hashlib.sha256(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class DiskCache(object):
+  """Store JSON values as files under CLUSTERFUZZ_CACHE_DIR/<name>. The least
+    recently used entries are evicted when the total size exceeds max_bytes.
+    Writes are atomic, so several processes can share a cache."""
+
+  def __init__(self, name, max_bytes):
+    self.dir_path = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, name)
+    self.max_bytes = max_bytes
+
+  def get_path(self, key):
+    """Get the path of the entry."""
+    return os.path.join(self.dir_path, key)
+
+  def get(self, key):
+    """Return the value of key, or None if it isn't cached."""
+    path = self.get_path(key)
+    try:
+      with open(path, 'r') as f:
+        value = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+    # The modified time marks the entry as recently used.
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    return value
+
+  def set(self, key, value):
+    """Store value under key and evict old entries if needed."""
+    common.ensure_dir(self.dir_path)
+    handle, tmp_path = tempfile.mkstemp(
+        dir=self.dir_path, prefix=TMP_FILE_PREFIX)
+    with os.fdopen(handle, 'w') as f:
+      json.dump(value, f)
+    os.rename(tmp_path, self.get_path(key))
+    self.evict()
+
+  def get_entries(self):
+    """Return (mtime, size, path) of all entries, the oldest first."""
+    if not os.path.isdir(self.dir_path):
+      return []
+
+    entries = []
+    for filename in os.listdir(self.dir_path):
+      if filename.startswith(TMP_FILE_PREFIX):
+        continue
+      path = os.path.join(self.dir_path, filename)
+      try:
+        stats = os.stat(path)
+      except OSError:
+        # Another process has just evicted it.
+        continue
+      entries.append((stats.st_mtime, stats.st_size, path))
+    return sorted(entries)
+
+  def evict(self):
+    """Delete the least recently used entries until the cache fits."""
+    entries = self.get_entries()
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if total_bytes <= self.max_bytes:
+        break
+      logger.debug('Evicting %s from the cache.', path)
+      common.delete_if_exists(path)
+      total_bytes -= size
@@ -0,0 +1,177 @@
+"""Cache ClusterFuzz responses with a policy for each endpoint."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import collections
+import json
+import logging
+import os
+import re
+import time
+
+import requests
+from requests import structures
+from requests import utils
+
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+
+
+NEVER = 'never'
+TTL = 'ttl'
+IMMUTABLE = 'immutable'
+Policy = collections.namedtuple('Policy', ['kind', 'ttl'])
+# The first policy whose regex matches the URL is used.
+POLICIES = [
+    # Parsing the same stacktrace always gives the same signature.
+    (re.compile(r'^https://[^/]+/parse_stacktrace$'), Policy(IMMUTABLE, None)),
+    # A testcase rarely changes after it's created, e.g. when it's minimized.
+    (re.compile(r'^https://[^/]+/testcase-detail/refresh$'),
+     Policy(TTL, 30 * 60)),
+]
+DEFAULT_POLICY = Policy(NEVER, None)
+CACHE = disk_cache.DiskCache('http', 50 * 1024 * 1024)
+# The refreshed access token must not be replayed from the cache.
+UNCACHED_HEADERS = ['x-clusterfuzz-authorization', 'set-cookie']
+# The sqlite cache of requests_cache that was used before.
+LEGACY_CACHE_PATH = os.path.join(
+    common.CLUSTERFUZZ_TESTCASES_DIR, 'http_cache.sqlite')
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_policy(url):
+  """Return the cache policy of the URL."""
+  for regex, policy in POLICIES:
+    if regex.match(url):
+      return policy
+  return DEFAULT_POLICY
+
+
+def normalize_body(data):
+  """Return the request body in a canonical form, so the same JSON with a
+    different key order or spacing has the same key."""
+  if data is None:
+    return None
+  try:
+    return json.loads(data)
+  except (TypeError, ValueError):
+    return data
+
+
+def get_key(method, url, data):
+  """Return the cache key of the request. Headers, including the
+    authorization header, aren't part of it."""
+  return disk_cache.get_key(method, url, normalize_body(data))
+
+
+def is_expired(entry, now=None):
+  """Return True if the entry is expired under the current policy of its
+    URL."""
+  policy = get_policy(entry['url'])
+  if policy.kind == NEVER:
+    return True
+  if policy.kind == TTL:
+    return (now or time.time()) - entry['created_at'] > policy.ttl
+  return False
+
+
+def to_entry(url, response):
+  """Serialize the response."""
+  return {
+      'url': url,
+      'created_at': time.time(),
+      'status_code': response.status_code,
+      'headers': {
+          name: value for name, value in response.headers.iteritems()
+          if name.lower() not in UNCACHED_HEADERS},
+      # The body might not be UTF-8, so the bytes are stored as they are.
+      'content': base64.b64encode(response.content),
+  }
+
+
+def to_response(entry):
+  """Deserialize the response."""
+  response = requests.Response()
+  response.url = entry['url']
+  response.status_code = entry['status_code']
+  response.headers = structures.CaseInsensitiveDict(entry['headers'])
+  # pylint: disable=protected-access
+  response._content = base64.b64decode(entry['content'])
+  response.encoding = utils.get_encoding_from_headers(response.headers)
+  response.from_cache = True
+  return response
+
+
+def post(url, **kwargs):
+  """Make a post request. The response comes from the cache if the policy of
+    the URL allows it."""
+  if get_policy(url).kind == NEVER:
+    return common.post(url=url, **kwargs)
+
+  key = get_key('POST', url, kwargs.get('data'))
+  entry = CACHE.get(key)
+  if entry and not is_expired(entry):
+    logger.debug('Using the cached response of %s.', url)
+    common.HTTP_SESSION_MANAGER.record_cache_hit()
+    return to_response(entry)
+
+  response = common.post(url=url, **kwargs)
+  if response.status_code == 200:
+    CACHE.set(key, to_entry(url, response))
+  return response
+
+
+def read_entries():
+  """Return (path, size, entry) of all entries. An unreadable entry is
+    None."""
+  entries = []
+  for _, size, path in CACHE.get_entries():
+    try:
+      with open(path, 'r') as f:
+        entry = json.load(f)
+    except (IOError, OSError, ValueError):
+      entry = None
+    entries.append((path, size, entry))
+  return entries
+
+
+def get_stats():
+  """Return the number of entries, the bytes and the expired entries for each
+    URL in the cache."""
+  stats = collections.OrderedDict()
+  now = time.time()
+  for _, size, entry in read_entries():
+    url = entry['url'] if entry else None
+    url_stats = stats.setdefault(url, {'entries': 0, 'bytes': 0, 'expired': 0})
+    url_stats['entries'] += 1
+    url_stats['bytes'] += size
+    if not entry or is_expired(entry, now):
+      url_stats['expired'] += 1
+  return stats
+
+
+def prune():
+  """Delete the expired and unreadable entries, and the legacy cache. Return
+    the number of deleted entries."""
+  now = time.time()
+  count = 0
+  for path, _, entry in read_entries():
+    if not entry or is_expired(entry, now):
+      common.delete_if_exists(path)
+      count += 1
+  common.delete_if_exists(LEGACY_CACHE_PATH)
+  CACHE.evict()
+  return count
@@ -59,11 +59,25 @@ def start_loggers():
 
 
 def send_output(output_chunk):
-  """Send a chunk of command line output to a file."""
+  """Send a chunk of command line output to a file. The complete lines of the
+    chunk are logged as a single record. The incomplete last line is kept until
+    its end arrives."""
   global current_chunk
-  for x in output_chunk:
-    if x == '\n':
-      logger.debug(''.join(current_chunk))
-      current_chunk = []
-    else:
-      current_chunk.append(x)
+  index = output_chunk.rfind('\n')
+  if index == -1:
+    if output_chunk:
+      current_chunk.append(output_chunk)
+    return
+
+  current_chunk.append(output_chunk[:index])
+  logger.debug(''.join(current_chunk))
+  rest = output_chunk[index + 1:]
+  current_chunk = [rest] if rest else []
+
+
+def flush_output():
+  """Log the incomplete last line of the output, if any."""
+  global current_chunk
+  if current_chunk:
+    logger.debug(''.join(current_chunk))
+    current_chunk = []
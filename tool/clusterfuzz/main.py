@@ -23,67 +23,92 @@ from clusterfuzz import local_logging
 logger = logging.getLogger('clusterfuzz')
 
 
-def execute(argv=None):
-  """The main entry point."""
-  local_logging.start_loggers()
-  logger.info('Version: %s', common.get_version())
-  logger.info('Path: %s', __file__)
-
-  parser = argparse.ArgumentParser(description='ClusterFuzz tools')
-  subparsers = parser.add_subparsers(dest='command')
-
-  subparsers.add_parser('supported_job_types',
-                        help='List all supported job types')
-  reproduce = subparsers.add_parser('reproduce', help='Reproduce a crash.')
-  reproduce.add_argument('testcase_id', help='The testcase ID.')
-  reproduce.add_argument(
+def add_reproduce_arguments(parser):
+  """Add the arguments of reproducing testcases."""
+  parser.add_argument(
       '-c', '--current', action='store_true', default=False,
       help=('Use the current tree; On the other hand, without --current, '
             'the Chrome repository will be switched to the commit specified in '
             'the testcase.'))
-  reproduce.add_argument(
+  parser.add_argument(
       '-b', '--build', action='store', default=None,
       choices=['download', 'chromium', 'standalone'],
       help='Select which type of build to run the testcase against.')
-  reproduce.add_argument(
+  parser.add_argument(
       '--disable-goma', action='store_true', default=False,
       help='Disable GOMA when building binaries locally.')
-  reproduce.add_argument(
+  parser.add_argument(
       '-j', '--goma-threads', action='store', default=None, type=int,
       help='Manually specify the number of concurrent jobs for a ninja build.')
-  reproduce.add_argument(
+  parser.add_argument(
       '-f', '--force', action='store_true', default=False,
       help='Try to repro an unreproducible testcase found by AFL or libFuzzer.')
-  reproduce.add_argument(
+  parser.add_argument(
       '-l', '--goma-load', action='store', default=None, type=int,
       help='Manually specify maximum load average for a ninja build.')
-  reproduce.add_argument(
+  parser.add_argument(
       '-i', '--iterations', action='store', default=3, type=int,
       help='Specify the number of times to attempt reproduction.')
-  reproduce.add_argument(
+  parser.add_argument(
+      '--parallel-iterations', action='store', default=1, type=int,
+      help=('Specify the number of reproduction attempts to run at the same '
+            'time. Each attempt uses its own user-data-dir and tmp dir.'))
+  parser.add_argument(
       '-dx', '--disable-xvfb', action='store_true', default=False,
       help='Disable running testcases in a virtual frame buffer.')
-  reproduce.add_argument(
+  parser.add_argument(
       '--target-args', action='store', default='',
       help='Additional arguments for the target (e.g. chrome).')
-  reproduce.add_argument(
+  parser.add_argument(
       '--edit-mode', action='store_true', default=False,
       help='Edit args.gn before building and target arguments before running.')
-  reproduce.add_argument(
+  parser.add_argument(
       '--skip-deps', action='store_true', default=False,
       help=('Skip installing dependencies: '
             'gclient sync, gclient runhooks, install-build-deps.sh, and etc.'))
-  reproduce.add_argument(
+  parser.add_argument(
       '--enable-debug', action='store_true', default=False,
       help=(
           'Build Chrome with full debug symbols by injecting '
           '`sanitizer_keep_symbols = true` and `is_debug = true` to args.gn. '
           'Ready to debug with GDB.'))
 
+
+def execute(argv=None):
+  """The main entry point."""
+  local_logging.start_loggers()
+  logger.info('Version: %s', common.get_version())
+  logger.info('Path: %s', __file__)
+
+  parser = argparse.ArgumentParser(description='ClusterFuzz tools')
+  subparsers = parser.add_subparsers(dest='command')
+
+  subparsers.add_parser('supported_job_types',
+                        help='List all supported job types')
+  reproduce = subparsers.add_parser('reproduce', help='Reproduce a crash.')
+  reproduce.add_argument('testcase_id', help='The testcase ID.')
+  reproduce_batch = subparsers.add_parser(
+      'reproduce_batch',
+      help=('Reproduce several crashes. Testcases that use the same build are '
+            'reproduced one after another with that build.'))
+  reproduce_batch.add_argument(
+      'testcase_ids', nargs='+', help='The testcase IDs.')
+  add_reproduce_arguments(reproduce)
+  add_reproduce_arguments(reproduce_batch)
+  cache = subparsers.add_parser(
+      'cache', help='Show or prune the cache of ClusterFuzz responses.')
+  cache.add_argument(
+      'action', choices=['stats', 'prune'],
+      help=('stats shows the cached responses of each URL. prune deletes the '
+            'expired ones.'))
+
   args = parser.parse_args(argv)
   command = importlib.import_module('clusterfuzz.commands.%s' % args.command)
 
   arg_dict = {k: v for k, v in vars(args).items()}
   del arg_dict['command']
 
-  command.execute(**arg_dict)
+  try:
+    command.execute(**arg_dict)
+  finally:
+    common.HTTP_SESSION_MANAGER.close()
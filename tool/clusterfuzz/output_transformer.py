@@ -1,5 +1,11 @@
 """Transform the output before printing on screen."""
 
+import re
+import time
+
+
+NINJA_STATUS_REGEX = re.compile(r'^\[(\d+)/(\d+)\]')
+
 
 class Base(object):
   """Transform output and send to the output function."""
@@ -75,6 +81,49 @@ class Ninja(Base):
     self.previous_line_size = 0
     self.previous_failed = False
     self.lines = []
+    self.started_at = time.time()
+    self.last_status_at = None
+    self.finished_edges = 0
+    self.total_edges = 0
+
+  def record_progress(self, line):
+    """Record the progress in the status line, e.g. [3/100]."""
+    match = NINJA_STATUS_REGEX.match(line)
+    if not match:
+      return
+    self.last_status_at = time.time()
+    self.finished_edges = int(match.group(1))
+    self.total_edges = int(match.group(2))
+
+  def get_elapsed_seconds(self):
+    """Return the seconds from the start until the last status line."""
+    if self.last_status_at is None:
+      return 0
+    return self.last_status_at - self.started_at
+
+  def get_edges_per_second(self):
+    """Return how many edges finish per second, or None if it's unknown."""
+    elapsed_seconds = self.get_elapsed_seconds()
+    if not self.finished_edges or elapsed_seconds <= 0:
+      return None
+    return self.finished_edges / elapsed_seconds
+
+  def get_eta_seconds(self):
+    """Return the projected seconds until the build finishes, or None if it's
+      unknown."""
+    edges_per_second = self.get_edges_per_second()
+    if not edges_per_second:
+      return None
+    return (self.total_edges - self.finished_edges) / edges_per_second
+
+  def get_summary(self):
+    """Return the progress of the build."""
+    return {
+        'finished_edges': self.finished_edges,
+        'total_edges': self.total_edges,
+        'elapsed_seconds': self.get_elapsed_seconds(),
+        'edges_per_second': self.get_edges_per_second(),
+    }
 
   def process(self, string):
     """Parse raw string into lines."""
@@ -97,6 +146,10 @@ class Ninja(Base):
       return
 
     self.print_block(self.lines)
+    self.record_progress(line)
+    eta_seconds = self.get_eta_seconds()
+    if eta_seconds is not None:
+      line += ' (ETA %dm%02ds)' % divmod(int(eta_seconds), 60)
     self.lines = [line]
 
   def print_block(self, lines):
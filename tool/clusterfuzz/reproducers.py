@@ -13,14 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import copy
 import HTMLParser
 import json
 import logging
+from multiprocessing import pool
 import os
 import re
 import shutil
+import socket
 import subprocess
 import tempfile
+import threading
 import time
 
 import psutil
@@ -28,7 +33,11 @@ import xvfbwrapper
 
 from clusterfuzz import android
 from clusterfuzz import common
+from clusterfuzz import disk_cache
+from clusterfuzz import http_cache
 from clusterfuzz import output_transformer
+from clusterfuzz import stack_analyzer
+from clusterfuzz import symbolizer
 from error import error
 
 DISABLE_GL_DRAW_ARG = '--disable-gl-drawing-for-tests'
@@ -52,6 +61,19 @@ LAYOUT_HACK_CUTOFF_DATE_IN_SECONDS = time.mktime((2017, 8, 11, 0, 0, 0, 0, 0,
 MONKEY_THROTTLE_DELAY = 100
 NUM_MONKEY_EVENTS = 50
 ANDROID_TESTCASE_DIR = '/sdcard/clusterfuzz'
+SIGNATURE_CACHE = disk_cache.DiskCache('signatures', 10 * 1024 * 1024)
+PID_REGEX = re.compile(r'==[0-9]+==')
+X_SOCKET_PATH = '/tmp/.X11-unix/X%s'
+DISPLAY_READY_TIMEOUT = 10
+DISPLAY_POLL_INTERVAL = 0.05
+# A display is replaced after this many iterations, so state leaked by
+# previous runs of chrome (e.g. in the X server) doesn't pile up.
+MAX_DISPLAY_USES = 10
+# Gestures run once the windows of chrome are visible and no new window has
+# appeared for WINDOW_SETTLE_TIME seconds, or after WINDOW_WAIT_TIMEOUT seconds.
+WINDOW_WAIT_TIMEOUT = 30
+WINDOW_SETTLE_TIME = 1
+WINDOW_POLL_INTERVAL = 0.2
 
 logger = logging.getLogger('clusterfuzz')
 
@@ -161,6 +183,29 @@ def ensure_user_data_dir_if_needed(args, require_user_data_dir):
   return '%s %s=%s' % (args, USER_DATA_DIR_ARG, USER_DATA_DIR_PATH)
 
 
+def isolate_user_data_dir(args, user_data_dir_path):
+  """Point --user-data-dir (if any) at user_data_dir_path. This allows
+    several iterations to run at the same time."""
+  if USER_DATA_DIR_ARG not in args:
+    return args
+
+  return re.sub(
+      '%s=[^ ]+' % USER_DATA_DIR_ARG,
+      '%s=%s' % (USER_DATA_DIR_ARG, user_data_dir_path), args)
+
+
+def kill_quietly(proc):
+  """Kill proc if it is still running. The process might have exited by
+    itself, so any error is ignored."""
+  if not proc or proc.poll() is not None:
+    return
+
+  try:
+    common.kill(proc)
+  except:  # pylint: disable=bare-except
+    pass
+
+
 # TODO(#463): Remove on 11 Nov 2017.
 def update_testcase_path_in_layout_test(testcase_path, original_testcase_path,
                                         source_directory, testcase_created_at):
@@ -188,9 +233,48 @@ def update_for_gdb_if_needed(binary_path, args, timeout, should_enable_gdb):
   return 'gdb', args, None
 
 
+def normalize_stacktrace(raw_stacktrace):
+  """Remove what differs between two outputs of the same crash (e.g. pids
+    and blank lines)."""
+  lines = []
+  for line in raw_stacktrace.splitlines():
+    line = PID_REGEX.sub('==PID==', line.strip())
+    if line:
+      lines.append(line)
+  return '\n'.join(lines)
+
+
 def get_crash_signature(job_type, raw_stacktrace):
+  """Get crash signature from raw_stacktrace. The result is cached on disk,
+    so the same stacktrace is parsed only once across runs."""
+  key = disk_cache.get_key(job_type, normalize_stacktrace(raw_stacktrace))
+  cached = SIGNATURE_CACHE.get(key)
+  if cached:
+    return common.CrashSignature(
+        cached['crash_type'], cached['crash_state_lines'])
+
+  signature = parse_crash_signature(job_type, raw_stacktrace)
+  SIGNATURE_CACHE.set(key, {
+      'crash_type': signature.crash_type,
+      'crash_state_lines': signature.crash_state_lines
+  })
+  return signature
+
+
+def parse_crash_signature(job_type, raw_stacktrace):
+  """Parse crash signature from raw_stacktrace. The stacktrace is parsed
+    locally, and ClusterFuzz is only asked when the local parsing fails."""
+  signature = stack_analyzer.get_crash_signature(raw_stacktrace)
+  if signature:
+    return signature
+
+  logger.debug('Cannot parse the stacktrace locally. Asking ClusterFuzz.')
+  return get_crash_signature_from_server(job_type, raw_stacktrace)
+
+
+def get_crash_signature_from_server(job_type, raw_stacktrace):
   """Get crash signature from raw_stacktrace by asking ClusterFuzz."""
-  response = common.post(
+  response = http_cache.post(
       url='https://clusterfuzz.com/parse_stacktrace',
       data=json.dumps({
           'job': job_type,
@@ -203,34 +287,15 @@ def get_crash_signature(job_type, raw_stacktrace):
   return common.CrashSignature(crash_type, crash_state_lines)
 
 
-def symbolize(output, source_dir_path):
+def symbolize(output, print_output=True):
   """Symbolize a stacktrace."""
   output = output.strip()
   if not output:
-    # If no input, nothing to symbolize. Bail out, otherwise
-    # we hang inside symbolizer.
     return ''
 
-  asan_symbolizer_location = os.path.join(
-      source_dir_path,
-      os.path.join('tools', 'valgrind', 'asan', 'asan_symbolize.py'))
-  symbolizer_proxy_location = common.get_resource(0755,
-                                                  'asan_symbolize_proxy.py')
-
-  _, symbolized_out = common.execute(
-      asan_symbolizer_location,
-      '',
-      os.path.expanduser('~'),
-      env={
-          'LLVM_SYMBOLIZER_PATH': symbolizer_proxy_location,
-          'CHROMIUM_SRC': source_dir_path
-      },
-      capture_output=True,
-      exit_on_error=True,
-      stdout_transformer=output_transformer.Identity(),
-      stdin=common.StringStdin(output + '\0'),
-      redirect_stderr_to_stdout=True)
-  logger.info(symbolized_out)
+  symbolized_out = symbolizer.get_symbolizer().symbolize(output)
+  if print_output:
+    logger.info(symbolized_out)
   return symbolized_out
 
 
@@ -300,6 +365,12 @@ class BaseReproducer(object):
 
     self.gesture_start_time = (
         self.get_gesture_start_time() if self.gestures else None)
+    # The running process and whether its output is printed. Parallel
+    # iterations need to stop the process and avoid interleaving the output.
+    # Once stop_event is set, a new process is killed as soon as it starts.
+    self.process = None
+    self.print_output = True
+    self.stop_event = None
 
   def set_up_symbolizers_suppressions(self):
     """Sets up the symbolizer variables for an environment."""
@@ -337,21 +408,31 @@ class BaseReproducer(object):
     # Ensure the testcase is setup correctly at the right path.
     self.get_testcase_path()
 
-  def reproduce_crash(self):
-    """Reproduce the crash."""
-    # read_buffer_length needs to be 1, and stdin needs to be UserStdin.
-    # Otherwise, it wouldn't work well with gdb.
-    return common.execute(
+  def start_process(self):
+    """Start the binary. The process is killed right away if stop_event was
+      set before self.process was assigned, so it can't outlive a stopped
+      parallel reproduction."""
+    # stdin needs to be UserStdin. Otherwise, it wouldn't work with gdb.
+    self.process = common.start_execute(
         self.binary_path,
         self.args,
         self.build_directory,
         env=self.environment,
+        stdin=common.UserStdin(),
+        redirect_stderr_to_stdout=True)
+    if self.stop_event and self.stop_event.is_set():
+      kill_quietly(self.process)
+    return self.process
+
+  def reproduce_crash(self):
+    """Reproduce the crash."""
+    self.start_process()
+    return common.wait_execute(
+        self.process,
         exit_on_error=False,
         timeout=self.timeout,
         stdout_transformer=output_transformer.Identity(),
-        redirect_stderr_to_stdout=True,
-        stdin=common.UserStdin(),
-        read_buffer_length=1)
+        print_output=self.print_output)
 
   @common.memoize
   def get_testcase_path(self):
@@ -414,8 +495,54 @@ class BaseReproducer(object):
     self.reproduce_crash()
     return True
 
+  def clone_for_iteration(self, tmp_dir_path):
+    """Return a copy of this reproducer that runs with its own tmp dir and
+      user-data-dir under tmp_dir_path."""
+    clone = copy.copy(self)
+    clone.environment = dict(self.environment)
+    clone.environment['TMPDIR'] = tmp_dir_path
+    clone.args = isolate_user_data_dir(
+        self.args, os.path.join(tmp_dir_path, 'user-data-dir'))
+    clone.process = None
+    clone.print_output = False
+    return clone
+
+  def is_reproduced(self, new_signature):
+    """Log new_signature against the original one and return True if they are
+      similar."""
+    logger.info('New crash type: %s\n'
+                'New crash state:\n  %s\n\n'
+                'Original crash type: %s\n'
+                'Original crash state:\n  %s\n', new_signature.crash_type,
+                '\n  '.join(new_signature.crash_state_lines),
+                self.get_crash_signature().crash_type, '\n  '.join(
+                    self.get_crash_signature().crash_state_lines))
+
+    # The crash signature validation is intentionally forgiving.
+    if not is_similar(new_signature, self.get_crash_signature()):
+      return False
+
+    logger.info(
+        common.colorize(
+            'The stacktrace seems similar to the original stacktrace.\n'
+            "Since you've reproduced the crash correctly, there are some "
+            'tricks that might help you move faster:\n'
+            '- In case of fixing the crash, you can use `--current` to run '
+            'on tip-of-tree (or, in other words, avoid git-checkout).\n'
+            '- You can save time by using `--skip-deps` to avoid '
+            '`gclient sync`, `gclient runhooks`, and other dependency '
+            'installations in subsequential runs.\n'
+            '- You can debug with gdb using `--enable-debug`.\n'
+            '- You can modify args.gn and arguments using `--edit-mode`.',
+            common.BASH_GREEN_MARKER))
+    return True
+
   def reproduce_normal(self, iteration_max):
     """Reproduce normally."""
+    if self.options.parallel_iterations > 1:
+      return self.reproduce_parallel(
+          iteration_max, self.options.parallel_iterations)
+
     iterations = 1
     signatures = set()
     has_signature = False
@@ -429,29 +556,8 @@ class BaseReproducer(object):
       has_signature = (
           bool(new_signature.crash_type) or
           bool(new_signature.crash_state_lines))
-      logger.info('New crash type: %s\n'
-                  'New crash state:\n  %s\n\n'
-                  'Original crash type: %s\n'
-                  'Original crash state:\n  %s\n', new_signature.crash_type,
-                  '\n  '.join(new_signature.crash_state_lines),
-                  self.get_crash_signature().crash_type, '\n  '.join(
-                      self.get_crash_signature().crash_state_lines))
-
-      # The crash signature validation is intentionally forgiving.
-      if is_similar(new_signature, self.get_crash_signature()):
-        logger.info(
-            common.colorize(
-                'The stacktrace seems similar to the original stacktrace.\n'
-                "Since you've reproduced the crash correctly, there are some "
-                'tricks that might help you move faster:\n'
-                '- In case of fixing the crash, you can use `--current` to run '
-                'on tip-of-tree (or, in other words, avoid git-checkout).\n'
-                '- You can save time by using `--skip-deps` to avoid '
-                '`gclient sync`, `gclient runhooks`, and other dependency '
-                'installations in subsequential runs.\n'
-                '- You can debug with gdb using `--enable-debug`.\n'
-                '- You can modify args.gn and arguments using `--edit-mode`.',
-                common.BASH_GREEN_MARKER))
+
+      if self.is_reproduced(new_signature):
         return True
       else:
         logger.info("The stacktrace doesn't match the original stacktrace.")
@@ -465,6 +571,71 @@ class BaseReproducer(object):
     else:
       raise error.UnreproducibleError(iteration_max, signatures)
 
+  def reproduce_parallel(self, iteration_max, parallel_max):
+    """Reproduce with up to parallel_max iterations running at the same time.
+      The remaining iterations are stopped once one of them matches."""
+    # Compute the original signature once, before the threads need it.
+    self.get_crash_signature()
+
+    found = threading.Event()
+    lock = threading.Lock()
+    running_clones = {}
+
+    def run(iteration):
+      """Run a single iteration in its own tmp dir."""
+      if found.is_set():
+        return None
+
+      tmp_dir_path = tempfile.mkdtemp(dir=common.CLUSTERFUZZ_TMP_DIR)
+      clone = self.clone_for_iteration(tmp_dir_path)
+      clone.stop_event = found
+      with lock:
+        running_clones[iteration] = clone
+      try:
+        _, output = clone.reproduce_crash()
+      finally:
+        with lock:
+          running_clones.pop(iteration)
+        common.delete_if_exists(tmp_dir_path)
+
+      if found.is_set():
+        return None
+
+      new_signature = get_crash_signature(self.job_type, output)
+      new_signature.output = output
+      return iteration, new_signature
+
+    logger.info('Running %d iterations, %d at a time.', iteration_max,
+                parallel_max)
+    thread_pool = pool.ThreadPool(parallel_max)
+    signatures = set()
+    try:
+      for result in thread_pool.imap_unordered(
+          run, range(1, iteration_max + 1)):
+        if not result:
+          continue
+
+        iteration, new_signature = result
+        signatures.add(new_signature)
+        logger.info('Iteration %d finished.', iteration)
+        if self.is_reproduced(new_signature):
+          logger.info(new_signature.output)
+          return True
+        logger.info("The stacktrace doesn't match the original stacktrace.")
+    finally:
+      found.set()
+      with lock:
+        clones = running_clones.values()
+      for clone in clones:
+        kill_quietly(clone.process)
+      thread_pool.close()
+      thread_pool.join()
+
+    if any(s.crash_type or s.crash_state_lines for s in signatures):
+      raise error.DifferentStacktraceError(iteration_max, signatures)
+    else:
+      raise error.UnreproducibleError(iteration_max, signatures)
+
   # TODO(tanin): Remove iteration_max and use self.options.iterations.
   def reproduce(self, iteration_max):
     """Reproduces the crash and prints the stacktrace."""
@@ -485,45 +656,153 @@ class LibfuzzerJobReproducer(BaseReproducer):
     """Steps to run before building."""
     args = deserialize_libfuzzer_args(self.args)
     maybe_fix_dict_args(args, os.path.dirname(self.binary_path))
+    if args.get('dict'):
+      # The dict might not be named after the target.
+      self.binary_provider.extract_files([os.path.basename(args['dict'])])
     self.args = serialize_libfuzzer_args(args)
 
     super(LibfuzzerJobReproducer, self).pre_build_steps()
 
 
-class Xvfb(object):
-  """Run commands within a virtual display using blackbox window manager."""
+def is_x_server_ready(display_name):
+  """Return True if the X server of the display accepts connections."""
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(X_SOCKET_PATH % display_name.lstrip(':'))
+    return True
+  except socket.error:
+    return False
+  finally:
+    sock.close()
 
-  def __init__(self, disable=False):
-    self.disable_xvfb = disable
 
-  def __enter__(self):
-    if self.disable_xvfb:
-      return None
-    self.display = xvfbwrapper.Xvfb(width=1280, height=1024)
-    self.display.start()
-    for i in self.display.xvfb_cmd:
+def is_window_manager_ready(display_name):
+  """Return True if the window manager of the display is running. blackbox
+    sets the current desktop once it manages the screen."""
+  with open(os.devnull, 'w') as devnull:
+    try:
+      return subprocess.call(
+          ['xdotool', 'get_desktop'], stdout=devnull, stderr=devnull,
+          env={'DISPLAY': display_name}) == 0
+    except OSError:
+      # Without xdotool, we cannot tell. Waiting until the deadline would be
+      # slower than blackbox ever takes to start.
+      return True
+
+
+def wait_until(condition, timeout):
+  """Poll condition until it is true or timeout seconds have passed."""
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() >= deadline:
+      return False
+    time.sleep(DISPLAY_POLL_INTERVAL)
+  return True
+
+
+class Display(object):
+  """A virtual display with the blackbox window manager."""
+
+  def __init__(self):
+    self.xvfb = xvfbwrapper.Xvfb(width=1280, height=1024)
+    self.xvfb.start()
+    for i in self.xvfb.xvfb_cmd:
       if i.startswith(':'):
-        display_name = i
+        self.name = i
         break
+    self.uses = 0
+
     logger.info('Starting the blackbox window manager in a virtual display.')
     try:
       self.blackbox = subprocess.Popen(
           ['blackbox'], env={
-              'DISPLAY': display_name
+              'DISPLAY': self.name
           })
     except OSError, e:
+      self.xvfb.stop()
       if str(e) == '[Errno 2] No such file or directory':
         raise error.NotInstalledError('blackbox')
       raise
 
-    time.sleep(3)
-    return display_name
+    if not wait_until(lambda: is_x_server_ready(self.name),
+                      DISPLAY_READY_TIMEOUT):
+      logger.debug('The X server of %s is not ready.', self.name)
+    if not wait_until(lambda: is_window_manager_ready(self.name),
+                      DISPLAY_READY_TIMEOUT):
+      logger.debug('The window manager of %s is not ready.', self.name)
+
+  def is_alive(self):
+    """Return True if both Xvfb and blackbox are still running."""
+    return self.xvfb.proc.poll() is None and self.blackbox.poll() is None
+
+  def stop(self):
+    """Stop blackbox and Xvfb."""
+    self.blackbox.kill()
+    self.xvfb.stop()
+
+
+class DisplayPool(object):
+  """Keep the displays running between iterations. A display is used by one
+    iteration at a time and is recycled after MAX_DISPLAY_USES iterations or
+    when it dies."""
+
+  def __init__(self):
+    self.idle_displays = []
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    """Get an idle display or start a new one."""
+    with self.lock:
+      while self.idle_displays:
+        display = self.idle_displays.pop()
+        if display.is_alive():
+          return display
+        display.stop()
+    return Display()
+
+  def release(self, display):
+    """Return the display to the pool, or stop it if it shouldn't be reused."""
+    display.uses += 1
+    if display.uses >= MAX_DISPLAY_USES or not display.is_alive():
+      display.stop()
+      return
+
+    with self.lock:
+      self.idle_displays.append(display)
+
+  def stop(self):
+    """Stop all idle displays."""
+    with self.lock:
+      for display in self.idle_displays:
+        display.stop()
+      self.idle_displays = []
+
+
+@common.memoize
+def get_display_pool():
+  """Get the display pool shared by all iterations in this run."""
+  display_pool = DisplayPool()
+  atexit.register(display_pool.stop)
+  return display_pool
+
+
+class Xvfb(object):
+  """Run commands within a virtual display using blackbox window manager."""
+
+  def __init__(self, disable=False):
+    self.disable_xvfb = disable
+    self.display = None
+
+  def __enter__(self):
+    if self.disable_xvfb:
+      return None
+    self.display = get_display_pool().acquire()
+    return self.display.name
 
   def __exit__(self, unused_type, unused_value, unused_traceback):
     if self.disable_xvfb:
       return
-    self.blackbox.kill()
-    self.display.stop()
+    get_display_pool().release(self.display)
 
 
 class LinuxChromeJobReproducer(BaseReproducer):
@@ -561,11 +840,7 @@ class LinuxChromeJobReproducer(BaseReproducer):
     """Return visible windows belonging to a process."""
     pids = self.get_process_ids(process_id)
     if not pids:
-      return []
-
-    logger.info('Waiting for 30 seconds to ensure all windows appear: '
-                'pid=%s, display=%s', pids, display_name)
-    time.sleep(30)
+      return set()
 
     visible_windows = set()
     for pid in pids:
@@ -583,9 +858,35 @@ class LinuxChromeJobReproducer(BaseReproducer):
           continue
         visible_windows.add(line)
 
-    logger.info('Found windows: %s', ', '.join(list(visible_windows)))
     return visible_windows
 
+  def wait_for_windows(self, proc, display_name):
+    """Wait until the windows of a process are visible and no new window has
+      appeared for WINDOW_SETTLE_TIME seconds. Give up after
+      WINDOW_WAIT_TIMEOUT seconds or when the process exits."""
+    logger.info('Waiting for windows to appear: pid=%s, display=%s', proc.pid,
+                display_name)
+    deadline = time.time() + WINDOW_WAIT_TIMEOUT
+    windows = set()
+    changed_at = time.time()
+    while proc.poll() is None:
+      now = time.time()
+      if now >= deadline:
+        logger.debug('Not all windows might have appeared after %ss.',
+                     WINDOW_WAIT_TIMEOUT)
+        break
+
+      found_windows = self.find_windows_for_process(proc.pid, display_name)
+      if found_windows != windows:
+        windows = found_windows
+        changed_at = now
+      elif windows and now - changed_at >= WINDOW_SETTLE_TIME:
+        break
+      time.sleep(WINDOW_POLL_INTERVAL)
+
+    logger.info('Found windows: %s', ', '.join(sorted(windows)))
+    return windows
+
   def execute_gesture(self, gesture, window, display_name):
     """Executes a specific gesture."""
 
@@ -598,11 +899,15 @@ class LinuxChromeJobReproducer(BaseReproducer):
                            display_name)
 
   def run_gestures(self, proc, display_name):
-    """Executes all required gestures."""
-
-    time.sleep(self.gesture_start_time)
+    """Executes all required gestures once the windows are visible, but not
+      earlier than gesture_start_time seconds after the process started."""
+    started_at = time.time()
+    windows = self.wait_for_windows(proc, display_name)
+
+    remaining_time = self.gesture_start_time - (time.time() - started_at)
+    if remaining_time > 0:
+      time.sleep(remaining_time)
     logger.info('Running gestures...')
-    windows = self.find_windows_for_process(proc.pid, display_name)
     for _, window in enumerate(windows):
       logger.info('Run gestures on window %s', window)
       self.xdotool_command('windowactivate --sync %s' % window, display_name)
@@ -633,27 +938,18 @@ class LinuxChromeJobReproducer(BaseReproducer):
     with Xvfb(self.options.disable_xvfb) as display_name:
       self.environment['DISPLAY'] = display_name
 
-      # stdin needs to be UserStdin. Otherwise, it wouldn't work with gdb.
-      process = common.start_execute(
-          self.binary_path,
-          self.args,
-          self.build_directory,
-          env=self.environment,
-          stdin=common.UserStdin(),
-          redirect_stderr_to_stdout=True)
+      self.start_process()
 
       if self.gestures:
-        self.run_gestures(process, display_name)
+        self.run_gestures(self.process, display_name)
 
-      # read_buffer_length needs to be 1. Otherwise, it wouldn't work well with
-      # gdb.
       err, out = common.wait_execute(
-          process,
+          self.process,
           exit_on_error=False,
           timeout=self.timeout,
           stdout_transformer=output_transformer.Identity(),
-          read_buffer_length=1)
-      return err, symbolize(out, self.source_directory)
+          print_output=self.print_output)
+      return err, symbolize(out, print_output=self.print_output)
 
 
 class AndroidChromeReproducer(BaseReproducer):
@@ -663,6 +959,10 @@ class AndroidChromeReproducer(BaseReproducer):
     """Reproduce with GDB isn't supported in Android."""
     raise error.GdbNotSupportedOnAndroidError()
 
+  def reproduce_parallel(self, iteration_max, parallel_max):
+    """Parallel iterations aren't supported in Android."""
+    raise error.ParallelIterationsNotSupportedOnAndroidError()
+
   @common.memoize
   def get_device_id(self):
     """Get the android device."""
@@ -742,8 +1042,7 @@ class AndroidChromeReproducer(BaseReproducer):
                 self.binary_provider.get_unstripped_lib_dir_path(),
                 self.binary_provider.get_android_libclang_dir_path()
             ],
-            lib_tmp_dir_path=lib_tmp_dir_path),
-        source_dir_path=self.binary_provider.get_source_dir_path())
+            lib_tmp_dir_path=lib_tmp_dir_path))
     common.delete_if_exists(lib_tmp_dir_path)
     return ret_value, symbolized_output
 
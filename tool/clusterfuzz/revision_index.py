@@ -0,0 +1,155 @@
+"""Resolve commit positions to SHAs using the local git checkout."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import logging
+import os
+import re
+
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+
+
+INDEX_DIR = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'revision_index')
+HEAD_FILE_SUFFIX = '.head'
+# The index stores the binary SHA of commit position N at offset N * SHA_SIZE.
+# A missing commit position is all zeros.
+SHA_SIZE = 20
+EMPTY_SHA = '\0' * SHA_SIZE
+# The first ref that exists is indexed.
+INDEXED_REFS = ['origin/master', 'origin/main', 'HEAD']
+COMMIT_MARKER = '\0'
+COMMIT_POSITION_REGEX = re.compile(
+    r'^Cr-Commit-Position: refs/heads/(?:master|main)@\{#(\d+)\}$')
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_index_path(source_dir):
+  """Get the path of the index of the checkout."""
+  return os.path.join(
+      INDEX_DIR, disk_cache.get_key(os.path.realpath(source_dir)))
+
+
+def git(args, source_dir):
+  """Run a git command quietly and return its output, or None if it fails."""
+  returncode, output = common.execute(
+      'git', args, source_dir, print_command=False, print_output=False,
+      exit_on_error=False, stdin=common.BlockStdin())
+  if returncode != 0:
+    return None
+  return output
+
+
+def get_indexed_ref_sha(source_dir):
+  """Return the SHA of the ref to index."""
+  for ref in INDEXED_REFS:
+    output = git('rev-parse --verify -q %s' % ref, source_dir)
+    if output:
+      return output.strip()
+  return None
+
+
+def read_commit_positions(source_dir, revision_range):
+  """Yield (commit position, sha) of the commits in revision_range. The log
+    is streamed because the whole history of chromium is too big to keep in
+    memory."""
+  proc = common.start_execute(
+      'git', 'log --format=%%x00%%H%%n%%b %s' % revision_range, source_dir,
+      print_command=False, stdin=common.BlockStdin(),
+      redirect_stderr_to_stdout=True)
+  sha = None
+  for line in iter(proc.stdout.readline, ''):
+    line = line.rstrip('\n')
+    if line.startswith(COMMIT_MARKER):
+      sha = line[len(COMMIT_MARKER):]
+      continue
+
+    match = COMMIT_POSITION_REGEX.match(line)
+    if match and sha:
+      yield int(match.group(1)), sha
+      sha = None
+  proc.wait()
+
+
+def update_index(source_dir):
+  """Add the commits after the last indexed one to the index."""
+  head_sha = get_indexed_ref_sha(source_dir)
+  if not head_sha:
+    return
+
+  index_path = get_index_path(source_dir)
+  head_path = index_path + HEAD_FILE_SUFFIX
+  indexed_sha = None
+  if os.path.exists(index_path) and os.path.exists(head_path):
+    with open(head_path, 'r') as f:
+      indexed_sha = f.read().strip()
+  if indexed_sha == head_sha:
+    return
+
+  # If the ref was rewritten, the index is rebuilt.
+  if indexed_sha and git(
+      'merge-base --is-ancestor %s %s' % (indexed_sha, head_sha),
+      source_dir) is not None:
+    revision_range = '%s..%s' % (indexed_sha, head_sha)
+  else:
+    logger.info('Indexing the commit positions of %s. This only happens once.',
+                source_dir)
+    revision_range = head_sha
+    common.delete_if_exists(index_path)
+
+  common.ensure_dir(INDEX_DIR)
+  if not os.path.exists(index_path):
+    open(index_path, 'wb').close()
+  # Writing after the end of the file fills the gap with zeros.
+  with open(index_path, 'r+b') as f:
+    for position, sha in read_commit_positions(source_dir, revision_range):
+      f.seek(position * SHA_SIZE)
+      f.write(binascii.unhexlify(sha))
+
+  with open(head_path, 'w') as f:
+    f.write(head_sha)
+
+
+def read_sha(source_dir, position):
+  """Return the indexed SHA of the commit position, or None."""
+  try:
+    with open(get_index_path(source_dir), 'rb') as f:
+      f.seek(position * SHA_SIZE)
+      sha = f.read(SHA_SIZE)
+  except IOError:
+    return None
+
+  if len(sha) != SHA_SIZE or sha == EMPTY_SHA:
+    return None
+  return binascii.hexlify(sha)
+
+
+def get_sha(source_dir, position):
+  """Return the SHA of the commit position in the checkout, or None if the
+    checkout doesn't have it. The index is updated when the commit position
+    isn't in it, e.g. after a fetch."""
+  sha = read_sha(source_dir, position)
+  if sha:
+    return sha
+
+  update_index(source_dir)
+  return read_sha(source_dir, position)
+
+
+def get_file(source_dir, sha, path):
+  """Return the content of the file at the commit, or None if the checkout
+    doesn't have the commit."""
+  return git('show %s:%s' % (sha, path), source_dir)
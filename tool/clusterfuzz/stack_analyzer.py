@@ -0,0 +1,284 @@
+"""Derive crash signatures from sanitizer output without asking ClusterFuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from clusterfuzz import common
+
+
+CRASH_STATE_SIZE = 3
+NULL_DEREFERENCE_BOUNDARY = 4096
+KNOWN_ACCESS_SIZES = ['1', '2', '4', '8']
+
+ASAN_REGEX = re.compile(
+    r'.*ERROR: AddressSanitizer: ([A-Za-z-]+)(?: on (?:unknown )?address '
+    r'(0x[0-9a-fA-F]+))?')
+ASAN_ACCESS_REGEX = re.compile(r'^(READ|WRITE) of size ([0-9]+)')
+SEGV_ACCESS_REGEX = re.compile(
+    r'.*The signal is caused by a (READ|WRITE) memory access')
+MSAN_REGEX = re.compile(r'.*WARNING: MemorySanitizer: ([a-z-]+)')
+TSAN_REGEX = re.compile(r'.*WARNING: ThreadSanitizer: ([a-z -]+?)(?: \(|$)')
+TSAN_ACCESS_REGEX = re.compile(r'.*(Read|Write) of size ([0-9]+)')
+LSAN_REGEX = re.compile(r'.*ERROR: LeakSanitizer: detected memory leaks')
+LSAN_LEAK_REGEX = re.compile(r'^(Direct|Indirect) leak of')
+UBSAN_REGEX = re.compile(r'.*[^\s]+:[0-9]+:[0-9]+: runtime error: (.+)')
+
+# The order matters. The first matching regex decides the crash type.
+UBSAN_CRASH_TYPES = [
+    (r'control flow integrity check for type .+ failed during indirect '
+     r'function call', 'Incorrect-function-pointer-type'),
+    (r'control flow integrity check for type .+ failed during', 'Bad-cast'),
+    (r'(signed|unsigned) integer overflow', 'Integer-overflow'),
+    (r'negation of .+ cannot be represented', 'Integer-overflow'),
+    (r'division by zero', 'Divide-by-zero'),
+    (r'is out of bounds for type', 'Index-out-of-bounds'),
+    (r"not a valid value for type '(bool|BOOL)'", 'Invalid-bool-value'),
+    (r'not a valid value for type', 'Invalid-enum-value'),
+    (r'misaligned address', 'Misaligned-address'),
+    (r'null pointer', 'Null-dereference'),
+    (r'with insufficient space for an object', 'Object-size'),
+    (r'pointer index expression', 'Pointer-overflow'),
+    (r'shift exponent|left shift of', 'Shift-exponent'),
+    (r'outside the range of representable values', 'Float-cast-overflow'),
+    (r'through pointer to incorrect function type',
+     'Incorrect-function-pointer-type'),
+    (r'(downcast|upcast) of|does not point to an object of type', 'Bad-cast'),
+    (r'unreachable program point', 'Unreachable code'),
+    (r'non-positive value', 'Non-positive-vla-bound-value'),
+]
+
+# Frames from the sanitizer runtime, libc and logging don't tell us anything
+# about the crash. These are skipped in the crash state.
+IGNORED_FUNCTION_REGEXES = [re.compile(r) for r in [
+    r'^abort$', r'^exit$', r'^raise$', r'^_start$', r'^main$',
+    r'^(__libc_|__GI_|__cxa_|__cxxabi|__interceptor_|__asan|__msan|__tsan|'
+    r'__ubsan|__lsan|__sanitizer|__cfi_|___interceptor_)',
+    r'^(malloc|calloc|realloc|free|valloc|memalign|posix_memalign)$',
+    r'^(mem(chr|cmp|cpy|move|set)|str(n?cat|chr|n?cmp|n?cpy|len|str)|'
+    r'wcslen)$',
+    r'^operator (new|delete)',
+    r'^(std|__gnu_cxx|__sanitizer|__asan|__tsan|__msan|__ubsan)::',
+    r'^base::debug::', r'^logging::', r'^fuzzer::',
+]]
+IGNORED_FILE_REGEX = re.compile(r'(compiler-rt/lib|/libc\+\+|/libstdc\+\+)')
+FRAME_REGEX = re.compile(r'^\s*#([0-9]+)\s+(.+)$')
+ADDRESS_REGEX = re.compile(r'^0x[0-9a-fA-F]+$')
+LOCATION_REGEX = re.compile(
+    r'^(/.*|\(.*\+0x[0-9a-fA-F]+\)|<.*>|[^\s]+:[0-9]+(:[0-9]+)?)$')
+
+
+def capitalize(string):
+  """Capitalize the first char only, e.g. heap-use-after-free ->
+    Heap-use-after-free."""
+  return string[:1].upper() + string[1:]
+
+
+def strip_arguments(function):
+  """Strip the trailing argument list and qualifiers of a C++ function name,
+    e.g. `a::b(int, char*) const` -> `a::b`."""
+  function = re.sub(r'\s+const$', '', function.strip())
+  if not function.endswith(')'):
+    return function
+
+  depth = 0
+  for index in xrange(len(function) - 1, -1, -1):
+    if function[index] == ')':
+      depth += 1
+    elif function[index] == '(':
+      depth -= 1
+      if depth == 0:
+        return function[:index].strip()
+  return function
+
+
+def parse_frame(line):
+  """Parse a stack frame into (function, location). Return None if the line
+    isn't a frame. function is None if the frame isn't symbolized."""
+  match = FRAME_REGEX.match(line)
+  if not match:
+    return None
+
+  tokens = match.group(2).split()
+  if tokens and ADDRESS_REGEX.match(tokens[0]):
+    tokens = tokens[1:]
+  if tokens and tokens[0] == 'in':
+    tokens = tokens[1:]
+
+  locations = []
+  while tokens and LOCATION_REGEX.match(tokens[-1]):
+    locations.insert(0, tokens.pop())
+
+  function = strip_arguments(' '.join(tokens)) if tokens else None
+  if function in ['', '??']:
+    function = None
+  return function, ' '.join(locations)
+
+
+def is_ignored_frame(function, location):
+  """Return True if the frame shouldn't be part of a crash state."""
+  if not function:
+    return True
+  if IGNORED_FILE_REGEX.search(location):
+    return True
+  return any(r.search(function) for r in IGNORED_FUNCTION_REGEXES)
+
+
+def get_crash_state_lines(lines):
+  """Get the top frames of the first stack in lines."""
+  state = []
+  found_frame = False
+  for line in lines:
+    frame = parse_frame(line)
+    if not frame:
+      if found_frame:
+        break
+      continue
+
+    found_frame = True
+    function, location = frame
+    if is_ignored_frame(function, location) or function in state:
+      continue
+
+    state.append(function)
+    if len(state) == CRASH_STATE_SIZE:
+      break
+  return state
+
+
+def normalize_access_size(size):
+  """Sizes other than the common ones are shown as {*}."""
+  return size if size in KNOWN_ACCESS_SIZES else '{*}'
+
+
+def get_asan_crash_type(match, lines):
+  """Get the crash type of an ASan report."""
+  bug_type = match.group(1)
+  address = match.group(2)
+
+  if bug_type == 'SEGV':
+    if address and int(address, 16) < NULL_DEREFERENCE_BOUNDARY:
+      crash_type = 'Null-dereference'
+    else:
+      crash_type = 'UNKNOWN'
+    for line in lines:
+      access_match = SEGV_ACCESS_REGEX.match(line)
+      if access_match:
+        crash_type += ' %s' % access_match.group(1)
+        break
+    return crash_type
+
+  if bug_type == 'attempting':
+    return None
+
+  crash_type = capitalize(bug_type)
+  for line in lines:
+    access_match = ASAN_ACCESS_REGEX.match(line.strip())
+    if access_match:
+      crash_type += '\n%s %s' % (
+          access_match.group(1), normalize_access_size(access_match.group(2)))
+      break
+    if parse_frame(line):
+      break
+  return crash_type
+
+
+def get_asan_free_crash_type(line):
+  """Get the crash type of the free-related ASan errors."""
+  if 'attempting double-free' in line:
+    return 'Heap-double-free'
+  if 'attempting free on address which was not malloc()-ed' in line:
+    return 'Bad-free'
+  return None
+
+
+def get_tsan_crash_type(match, lines):
+  """Get the crash type of a TSan report."""
+  crash_type = capitalize(match.group(1).strip())
+  if crash_type != 'Data race':
+    return crash_type
+
+  for line in lines:
+    access_match = TSAN_ACCESS_REGEX.match(line)
+    if access_match:
+      crash_type += '\n%s %s' % (
+          access_match.group(1).upper(),
+          normalize_access_size(access_match.group(2)))
+      break
+  return crash_type
+
+
+def get_ubsan_crash_type(message):
+  """Get the crash type of an UBSan (or CFI) runtime error."""
+  for regex, crash_type in UBSAN_CRASH_TYPES:
+    if re.search(regex, message):
+      return crash_type
+  return None
+
+
+def get_lsan_crash_type(lines):
+  """Get the crash type of an LSan report and the lines of the leak stack."""
+  for index, line in enumerate(lines):
+    match = LSAN_LEAK_REGEX.match(line.strip())
+    if match:
+      return '%s-leak' % match.group(1), lines[index + 1:]
+  return None, []
+
+
+def find_crash(lines):
+  """Return (crash_type, stack_lines) of the first recognized report in lines.
+    crash_type is None if the report isn't recognized."""
+  for index, line in enumerate(lines):
+    rest = lines[index + 1:]
+
+    match = ASAN_REGEX.match(line)
+    if match:
+      crash_type = (
+          get_asan_free_crash_type(line) or get_asan_crash_type(match, rest))
+      return crash_type, rest
+
+    match = MSAN_REGEX.match(line)
+    if match:
+      return capitalize(match.group(1)), rest
+
+    match = TSAN_REGEX.match(line)
+    if match:
+      return get_tsan_crash_type(match, rest), rest
+
+    if LSAN_REGEX.match(line):
+      return get_lsan_crash_type(rest)
+
+    match = UBSAN_REGEX.match(line)
+    if match:
+      return get_ubsan_crash_type(match.group(1)), rest
+
+  return None, []
+
+
+def get_crash_signature(raw_stacktrace):
+  """Get the crash signature of raw_stacktrace. Return None if the stacktrace
+    isn't understood, in which case ClusterFuzz should be asked instead."""
+  if not raw_stacktrace.strip():
+    return common.CrashSignature('', [])
+
+  crash_type, stack_lines = find_crash(raw_stacktrace.splitlines())
+  if not crash_type:
+    return None
+
+  crash_state_lines = get_crash_state_lines(stack_lines)
+  if not crash_state_lines:
+    return None
+
+  return common.CrashSignature(
+      crash_type.replace('\n', ' '), crash_state_lines)
@@ -61,7 +61,10 @@ def send_log(params, stacktrace=None):
   else:
     prefix = 'started'
 
-  props = [str(params['testcase_id'])]
+  if 'testcase_ids' in params:
+    props = [','.join(str(i) for i in params['testcase_ids'])]
+  else:
+    props = [str(params['testcase_id'])]
 
   if params['current']:
     props.append('current')
@@ -0,0 +1,260 @@
+"""Symbolize stacktraces with long-lived llvm-symbolizer processes."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import logging
+import os
+import re
+import struct
+import subprocess
+import threading
+
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+from error import error
+
+
+# llvm-symbolizer's stdout is a pipe. Sending too many addresses at once would
+# fill the pipe and block both sides.
+BATCH_SIZE = 100
+UNKNOWN_FUNCTION = '??'
+UNKNOWN_LOCATION = '??:0:0'
+# e.g. `    #3 0x7f1 (/path/to/chrome+0x1234)`.
+UNSYMBOLIZED_FRAME_REGEX = re.compile(
+    r'^(\s*#[0-9]+\s+0x[0-9a-fA-F]+)\s+\(([^()+]+)\+(0x[0-9a-fA-F]+)\)\s*$')
+# Symbolized frames of each module, keyed by its build-id. The entry of a
+# chrome build holds every frame we have ever seen crash in it.
+FRAME_CACHE = disk_cache.DiskCache('frames', 100 * 1024 * 1024)
+
+ELF_MAGIC = '\x7fELF'
+ELF_CLASSES = {1: ('I', 'IIIIIIIIII'), 2: ('Q', 'IIQQQQIIQQ')}
+ELF_BYTE_ORDERS = {1: '<', 2: '>'}
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def align(size):
+  """Notes are padded to 4 bytes."""
+  return (size + 3) & ~3
+
+
+def read_build_id(f):
+  """Read the GNU build-id from the note sections of an ELF file."""
+  ident = f.read(16)
+  if len(ident) < 16 or not ident.startswith(ELF_MAGIC):
+    return None
+  word, section_format = ELF_CLASSES.get(ord(ident[4]), (None, None))
+  byte_order = ELF_BYTE_ORDERS.get(ord(ident[5]))
+  if not word or not byte_order:
+    return None
+
+  header_format = '%sHHI%s%s%sIHHHHHH' % (byte_order, word, word, word)
+  header = struct.unpack(
+      header_format, f.read(struct.calcsize(header_format)))
+  section_offset, section_size, section_count = (
+      header[5], header[10], header[11])
+
+  section_format = byte_order + section_format
+  for index in xrange(section_count):
+    f.seek(section_offset + index * section_size)
+    section = struct.unpack(
+        section_format, f.read(struct.calcsize(section_format)))
+    if section[1] != SHT_NOTE:
+      continue
+
+    f.seek(section[4])
+    notes = f.read(section[5])
+    position = 0
+    while position + 12 <= len(notes):
+      name_size, desc_size, note_type = struct.unpack(
+          byte_order + 'III', notes[position:position + 12])
+      name_start = position + 12
+      desc_start = name_start + align(name_size)
+      if (note_type == NT_GNU_BUILD_ID and
+          notes[name_start:name_start + name_size] == 'GNU\x00'):
+        return notes[desc_start:desc_start + desc_size].encode('hex')
+      position = desc_start + align(desc_size)
+  return None
+
+
+def get_build_id(path):
+  """Get the build-id of the module at path. Return None if the module isn't
+    readable or doesn't have one."""
+  try:
+    with open(path, 'rb') as f:
+      return read_build_id(f)
+  except (IOError, OSError, struct.error):
+    return None
+
+
+class LlvmSymbolizer(object):
+  """A llvm-symbolizer process that stays alive and keeps the symbols of a
+    module loaded between queries."""
+
+  def __init__(self, symbolizer_path, module):
+    self.module = module
+    with open(os.devnull, 'w') as devnull:
+      try:
+        self.proc = subprocess.Popen(
+            [symbolizer_path, '--functions=linkage', '--inlining=false',
+             '--demangle'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=devnull)
+      except OSError:
+        raise error.NotInstalledError(symbolizer_path)
+
+  def symbolize(self, offsets):
+    """Return a (function, location) for each offset."""
+    frames = []
+    for index in xrange(0, len(offsets), BATCH_SIZE):
+      batch = offsets[index:index + BATCH_SIZE]
+      self.proc.stdin.write(
+          ''.join('%s %s\n' % (self.module, offset) for offset in batch))
+      self.proc.stdin.flush()
+      frames.extend(self.read_frame() for _ in batch)
+    return frames
+
+  def read_frame(self):
+    """Read the answer of a single query. It is the function and the location
+      followed by an empty line."""
+    lines = []
+    while True:
+      line = self.proc.stdout.readline()
+      if not line:
+        raise Exception(
+            'llvm-symbolizer exited unexpectedly for %s.' % self.module)
+      line = line.rstrip('\n')
+      if not line:
+        break
+      lines.append(line)
+
+    function = lines[0] if lines else UNKNOWN_FUNCTION
+    location = lines[1] if len(lines) > 1 else UNKNOWN_LOCATION
+    return function, location
+
+  def close(self):
+    """Close stdin, so the process exits."""
+    try:
+      self.proc.stdin.close()
+      self.proc.wait()
+    except (IOError, OSError):
+      pass
+
+
+def format_frame(prefix, module, offset, function, location):
+  """Format a symbolized frame like asan_symbolize.py does."""
+  if function == UNKNOWN_FUNCTION:
+    return None
+  if location == UNKNOWN_LOCATION:
+    return '%s in %s (%s+%s)' % (prefix, function, module, offset)
+  return '%s in %s %s' % (prefix, function, location)
+
+
+class Symbolizer(object):
+  """Symbolize stacktraces. The llvm-symbolizer processes and the symbolized
+    frames are kept across calls, so each (module, offset) is only looked up
+    once. The frames are also stored in FRAME_CACHE, so the next runs on the
+    same build don't look them up at all."""
+
+  def __init__(self, symbolizer_path):
+    self.symbolizer_path = symbolizer_path
+    self.processes = {}
+    self.frames = {}
+    self.build_ids = {}
+    # Parallel iterations symbolize at the same time.
+    self.lock = threading.Lock()
+
+  def get_process(self, module):
+    """Get (or start) the llvm-symbolizer process of the module."""
+    if module not in self.processes:
+      self.processes[module] = LlvmSymbolizer(self.symbolizer_path, module)
+    return self.processes[module]
+
+  def get_build_id(self, module):
+    """Get the build-id of the module. Read the module once per run, and load
+      the frames symbolized by the previous runs when we do."""
+    if module not in self.build_ids:
+      build_id = get_build_id(module)
+      self.build_ids[module] = build_id
+      if build_id:
+        for offset, frame in (FRAME_CACHE.get(build_id) or {}).iteritems():
+          self.frames.setdefault((module, offset), tuple(frame))
+    return self.build_ids[module]
+
+  def save(self, module):
+    """Store all frames of the module in FRAME_CACHE."""
+    build_id = self.get_build_id(module)
+    if not build_id:
+      return
+    FRAME_CACHE.set(build_id, {
+        offset: list(frame)
+        for (frame_module, offset), frame in self.frames.iteritems()
+        if frame_module == module})
+
+  def lookup(self, offsets_by_module):
+    """Symbolize the offsets that haven't been symbolized yet."""
+    for module, offsets in offsets_by_module.iteritems():
+      self.get_build_id(module)
+      missing = sorted(set(
+          offset for offset in offsets if (module, offset) not in self.frames))
+      if not missing:
+        continue
+
+      logger.debug('Symbolizing %d addresses in %s.', len(missing), module)
+      frames = self.get_process(module).symbolize(missing)
+      for offset, frame in zip(missing, frames):
+        self.frames[(module, offset)] = frame
+      self.save(module)
+
+  def symbolize(self, output):
+    """Symbolize all unsymbolized frames in output."""
+    lines = output.splitlines()
+    matches = [UNSYMBOLIZED_FRAME_REGEX.match(line) for line in lines]
+
+    offsets_by_module = {}
+    for match in matches:
+      if match:
+        offsets_by_module.setdefault(match.group(2), []).append(match.group(3))
+
+    with self.lock:
+      self.lookup(offsets_by_module)
+
+    symbolized_lines = []
+    for line, match in zip(lines, matches):
+      if match:
+        prefix, module, offset = match.groups()
+        function, location = self.frames[(module, offset)]
+        line = format_frame(prefix, module, offset, function, location) or line
+      symbolized_lines.append(line)
+    return '\n'.join(symbolized_lines)
+
+  def close(self):
+    """Stop all llvm-symbolizer processes."""
+    with self.lock:
+      for process in self.processes.values():
+        process.close()
+      self.processes = {}
+
+
+@common.memoize
+def get_symbolizer():
+  """Get the symbolizer shared by all iterations in this run."""
+  symbolizer = Symbolizer(
+      common.get_resource(0755, 'resources', 'llvm-symbolizer'))
+  atexit.register(symbolizer.close)
+  return symbolizer
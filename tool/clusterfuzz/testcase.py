@@ -13,21 +13,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import hashlib
 import logging
 import os
 import re
 import shutil
 import tempfile
+import time
+import urllib
+import urlparse
 import zipfile
 
+from requests import exceptions
+
 from clusterfuzz import common
+from error import error
 
 
 CLUSTERFUZZ_TESTCASE_URL = (
     'https://%s/testcase-detail/download-testcase?id=%s' %
     (common.DOMAIN_NAME, '%s'))
 DOWNLOAD_TIMEOUT = 100
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRY_COUNT = 5
+DOWNLOAD_RETRY_SLEEP_TIME = 1  # Doubled after every attempt.
+DEFAULT_TESTCASE_FILENAME = 'testcase'
+CONTENT_DISPOSITION_FILENAME_REGEX = re.compile(
+    r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+# Google Cloud Storage sends the base64 MD5 in x-goog-hash.
+GOOG_HASH_MD5_REGEX = re.compile(r'md5=([^,]+)')
 TESTCASE_CACHE_TTL = 6 * 60 * 60  # The testcase file is cached for 6 hours.
+# Records the path of the downloaded testcase file. Its modified time is when
+# the file was downloaded.
+TESTCASE_PATH_STAMP_FILENAME = '.testcase_path'
 
 
 logger = logging.getLogger('clusterfuzz')
@@ -163,20 +182,87 @@ def get_package_and_main_class_names(stacktrace_lines):
   raise Exception('Cannot find the package and main class in the stacktrace.')
 
 
+def get_download_filename(response):
+  """Return the filename from Content-Disposition or the URL, like wget's
+    --content-disposition."""
+  match = CONTENT_DISPOSITION_FILENAME_REGEX.search(
+      response.headers.get('Content-Disposition', ''))
+  if match:
+    filename = urllib.unquote(match.group(1).strip())
+  else:
+    filename = urlparse.urlparse(response.url).path
+  filename = os.path.basename(filename)
+  if filename in ('', '.', '..'):
+    return DEFAULT_TESTCASE_FILENAME
+  return filename
+
+
+def get_expected_md5(response):
+  """Return the base64 MD5 of the content that the server sent, or None."""
+  if response.headers.get('Content-MD5'):
+    return response.headers['Content-MD5']
+  match = GOOG_HASH_MD5_REGEX.search(response.headers.get('x-goog-hash', ''))
+  if match:
+    return match.group(1)
+  return None
+
+
+def download_file(url, dest_dir, headers):
+  """Stream the file into dest_dir and verify its length and MD5. Return the
+    path of the file."""
+  response = common.get_http().get(
+      url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+  try:
+    response.raise_for_status()
+    path = os.path.join(dest_dir, get_download_filename(response))
+    md5 = hashlib.md5()
+    size = 0
+    with open(path, 'wb') as f:
+      for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        f.write(chunk)
+        md5.update(chunk)
+        size += len(chunk)
+  finally:
+    response.close()
+
+  # The length and hash are of the encoded content, which isn't what we read.
+  if response.headers.get('Content-Encoding', 'identity') != 'identity':
+    return path
+
+  expected_size = response.headers.get('Content-Length')
+  if expected_size is not None and int(expected_size) != size:
+    raise IOError(
+        'Got %d bytes instead of %s bytes.' % (size, expected_size))
+  expected_md5 = get_expected_md5(response)
+  if expected_md5 and base64.b64encode(md5.digest()) != expected_md5:
+    raise IOError('The MD5 of the file does not match %s.' % expected_md5)
+  return path
+
+
 def download_testcase(url):
-  """Download the testcase into dest_dir."""
+  """Download the testcase into a tmp dir and return its path. Failed
+    downloads are retried with an exponential backoff."""
   tmp_dir_path = tempfile.mkdtemp(dir=common.CLUSTERFUZZ_TMP_DIR)
   logger.info('Downloading testcase files...')
 
-  auth_header = common.get_stored_auth_header()
-  # Do not use curl because curl doesn't support downloading an empty file.
-  # See: https://github.com/google/clusterfuzz-tools/issues/326
-  args = (
-      '--no-verbose --waitretry=%s --retry-connrefused --content-disposition '
-      '--header="Authorization: %s" "%s"' %
-      (DOWNLOAD_TIMEOUT, auth_header, url))
-  common.execute('wget', args, tmp_dir_path)
-  return os.path.join(tmp_dir_path, os.listdir(tmp_dir_path)[0])
+  headers = {
+      'Authorization': common.get_stored_auth_header(),
+      'User-Agent': 'clusterfuzz-tools'
+  }
+  for i in range(DOWNLOAD_RETRY_COUNT + 1):
+    try:
+      return download_file(url, tmp_dir_path, headers)
+    except IOError as e:
+      # Client errors (e.g. 404) won't go away by retrying.
+      if (i == DOWNLOAD_RETRY_COUNT or
+          (isinstance(e, exceptions.HTTPError) and
+           e.response.status_code < 500)):
+        raise error.DownloadTestcaseError(url, str(e))
+      logger.warn(
+          'Failed to download %s: %s. Retrying %d/%d.',
+          url, e, i + 1, DOWNLOAD_RETRY_COUNT)
+      time.sleep(DOWNLOAD_RETRY_SLEEP_TIME * 2 ** i)
 
 
 def create(testcase_json, force=False):
@@ -273,13 +359,40 @@ class Testcase(object):
     self.testcase_dir_path = os.path.join(
         common.CLUSTERFUZZ_TESTCASES_DIR, str(self.id) + '_testcase')
 
+  def get_cached_testcase_path(self):
+    """Return the path of the testcase file if it was downloaded within
+      TESTCASE_CACHE_TTL, or None."""
+    stamp_path = os.path.join(
+        self.testcase_dir_path, TESTCASE_PATH_STAMP_FILENAME)
+    try:
+      if time.time() - os.path.getmtime(stamp_path) > TESTCASE_CACHE_TTL:
+        return None
+      with open(stamp_path, 'r') as f:
+        testcase_path = f.read()
+    except (IOError, OSError):
+      return None
+
+    if not os.path.exists(testcase_path):
+      return None
+    return testcase_path
+
   @common.memoize
   def get_testcase_path(self):
-    """Downloads & returns the location of the testcase file."""
+    """Downloads & returns the location of the testcase file. A recently
+      downloaded file is reused."""
+    testcase_path = self.get_cached_testcase_path()
+    if testcase_path:
+      logger.info('Using the downloaded testcase file: %s', testcase_path)
+      return testcase_path
+
     downloaded_file_path = download_testcase(CLUSTERFUZZ_TESTCASE_URL % self.id)
 
     common.delete_if_exists(self.testcase_dir_path)
     os.makedirs(self.testcase_dir_path)
 
-    return get_true_testcase_path(
+    testcase_path = get_true_testcase_path(
         self.testcase_dir_path, self.absolute_path, downloaded_file_path)
+    with open(os.path.join(
+        self.testcase_dir_path, TESTCASE_PATH_STAMP_FILENAME), 'w') as f:
+      f.write(testcase_path)
+    return testcase_path
@@ -15,6 +15,9 @@
 
 import os
 import json
+import stat
+import zipfile
+
 import mock
 
 from clusterfuzz import binary_providers
@@ -47,24 +50,74 @@ class ShaFromRevisionTest(helpers.ExtendedTestCase):
   """Tests the sha_from_revision method."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, ['urlfetch.fetch'])
-
-  def test_get_sha_from_response_body(self):
-    """Tests to ensure that the sha is grabbed from the response correctly"""
-
     self.mock.fetch.return_value = mock.Mock(body=json.dumps({
         'id': 12345,
         'git_sha': '1a2s3d4f',
         'crash_type': 'Bad Crash'}))
 
+  def test_get_sha_from_response_body(self):
+    """Tests to ensure that the sha is grabbed from the response correctly"""
+    result = binary_providers.sha_from_revision(123456, 'v8/v8')
+    self.assertEqual(result, '1a2s3d4f')
+
+  def test_cache(self):
+    """Tests fetching a revision only once."""
+    binary_providers.sha_from_revision(123456, 'v8/v8')
     result = binary_providers.sha_from_revision(123456, 'v8/v8')
+
+    self.assertEqual(result, '1a2s3d4f')
+    self.assertEqual(1, self.mock.fetch.call_count)
+
+    binary_providers.sha_from_revision(123456, 'chromium/src')
+    self.assertEqual(2, self.mock.fetch.call_count)
+
+  def test_local(self):
+    """Tests resolving the revision from the local checkout."""
+    helpers.patch(self, ['clusterfuzz.revision_index.get_sha'])
+    self.mock.get_sha.return_value = 'local_sha'
+
+    result = binary_providers.sha_from_revision(123456, 'v8/v8', '/src')
+
+    self.assertEqual(result, 'local_sha')
+    self.mock.get_sha.assert_called_once_with('/src', 123456)
+    self.assert_n_calls(0, [self.mock.fetch])
+
+  def test_local_missing(self):
+    """Tests falling back to cr-rev when the checkout lacks the revision."""
+    helpers.patch(self, ['clusterfuzz.revision_index.get_sha'])
+    self.mock.get_sha.return_value = None
+
+    result = binary_providers.sha_from_revision(123456, 'v8/v8', '/src')
+
     self.assertEqual(result, '1a2s3d4f')
+    self.assertEqual(1, self.mock.fetch.call_count)
+
+
+class GetLocalChromiumDirTest(helpers.ExtendedTestCase):
+  """Tests get_local_chromium_dir."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_not_set(self):
+    """Tests returning None without CHROMIUM_SRC."""
+    self.mock_os_environment({})
+    self.assertIsNone(binary_providers.get_local_chromium_dir())
+
+  def test_set(self):
+    """Tests returning CHROMIUM_SRC."""
+    os.makedirs('/chromium/src')
+    self.mock_os_environment({'CHROMIUM_SRC': '/chromium/src'})
+    self.assertEqual('/chromium/src', binary_providers.get_local_chromium_dir())
 
 
 class GetThirdPartyShaTest(helpers.ExtendedTestCase):
   """Tests the get_third_party_sha method."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, ['urlfetch.fetch'])
     self.mock.fetch.return_value = mock.Mock(
         body=('dmFycyA9IHsNCiAgJ3BkZml1bV9naXQnOiAnaHR0cHM6Ly9wZGZpdW0uZ29vZ'
@@ -81,6 +134,40 @@ class GetThirdPartyShaTest(helpers.ExtendedTestCase):
          '/DEPS?format=TEXT'))])
     self.assertEqual(result, '4093039d19f832173ec58cfd9f2e8ac393a76091')
 
+  def test_cache(self):
+    """Tests fetching DEPS of a commit only once."""
+    binary_providers.get_third_party_sha('chrome_sha', 'pdfium_revision')
+    result = binary_providers.get_third_party_sha(
+        'chrome_sha', 'pdfium_revision')
+
+    self.assertEqual(result, '4093039d19f832173ec58cfd9f2e8ac393a76091')
+    self.assertEqual(1, self.mock.fetch.call_count)
+
+  def test_local(self):
+    """Tests reading DEPS from the local checkout."""
+    helpers.patch(self, ['clusterfuzz.revision_index.get_file'])
+    self.mock.get_file.return_value = (
+        "vars = {\n  'pdfium_revision': 'abcd',\n}")
+
+    result = binary_providers.get_third_party_sha(
+        'chrome_sha', 'pdfium_revision', '/chromium')
+
+    self.assertEqual(result, 'abcd')
+    self.mock.get_file.assert_called_once_with(
+        '/chromium', 'chrome_sha', 'DEPS')
+    self.assert_n_calls(0, [self.mock.fetch])
+
+  def test_local_missing(self):
+    """Tests downloading DEPS when the checkout lacks the commit."""
+    helpers.patch(self, ['clusterfuzz.revision_index.get_file'])
+    self.mock.get_file.return_value = None
+
+    result = binary_providers.get_third_party_sha(
+        'chrome_sha', 'pdfium_revision', '/chromium')
+
+    self.assertEqual(result, '4093039d19f832173ec58cfd9f2e8ac393a76091')
+    self.assertEqual(1, self.mock.fetch.call_count)
+
 
 class DownloadBuildIfNeededTest(helpers.ExtendedTestCase):
   """Test download_build_if_needed."""
@@ -88,49 +175,252 @@ class DownloadBuildIfNeededTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.common.delete_if_exists',
-        'clusterfuzz.common.execute',
-        'clusterfuzz.common.gsutil',
-        'clusterfuzz.common.find_file',
-        'tempfile.mkdtemp',
-        'shutil.copytree',
+        'clusterfuzz.binary_providers.download_gs_file',
+        'clusterfuzz.binary_providers.extract_build',
         'os.path.exists'
     ])
 
     self.dest_path = '/fake/dest'
     self.build_url = 'https://storage.cloud.google.com/test/test2/abc.zip'
+    self.saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip')
 
   def test_already_download(self):
     """Tests the exit when build data is already returned."""
     self.mock.exists.return_value = True
     binary_providers.download_build_if_needed(
         self.dest_path, self.build_url)
-    self.assert_n_calls(0, [self.mock.execute])
+    self.assert_n_calls(
+        0, [self.mock.download_gs_file, self.mock.extract_build])
 
   def test_get_build_data(self):
-    """Tests extracting, moving and renaming the build data.."""
+    """Tests downloading and extracting the build data."""
     self.mock.exists.return_value = False
-    self.mock.mkdtemp.return_value = '/tmp/random'
-    self.mock.find_file.return_value = '/tmp/random/sub/args.gn'
 
-    binary_providers.download_build_if_needed(
-        self.dest_path, self.build_url)
+    self.assertEqual(
+        self.dest_path,
+        binary_providers.download_build_if_needed(
+            self.dest_path, self.build_url))
+
+    self.mock.download_gs_file.assert_called_once_with(
+        'gs://test/test2/abc.zip', self.saved_file)
+    self.mock.extract_build.assert_called_once_with(
+        self.saved_file, self.dest_path, None)
+    self.assert_exact_calls(
+        self.mock.delete_if_exists, [mock.call(self.saved_file)])
+
+  def test_extract_error(self):
+    """Tests deleting the partially extracted build."""
+    self.mock.exists.return_value = False
+    self.mock.extract_build.side_effect = Exception('extract')
+
+    with self.assertRaises(Exception):
+      binary_providers.download_build_if_needed(self.dest_path, self.build_url)
 
-    self.mock.execute.assert_called_once_with(
-        'unzip', '-q %s -d %s' % (
-            os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip'),
-            self.mock.mkdtemp.return_value),
-        cwd='.'
-    )
     self.assert_exact_calls(self.mock.delete_if_exists, [
-        mock.call(os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip')),
-        mock.call(self.mock.mkdtemp.return_value),
+        mock.call(self.dest_path), mock.call(self.saved_file)
+    ])
+
+
+class DownloadBuildLazilyTest(helpers.ExtendedTestCase):
+  """Test download_build_if_needed with patterns."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.download_gs_file',
+        'clusterfuzz.binary_providers.extract_build',
+    ])
+    self.saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip')
+    self.mock.download_gs_file.side_effect = (
+        lambda _, path: self.fs.CreateFile(path))
+    self.mock.extract_build.side_effect = (
+        lambda _, dest, __: os.makedirs(dest))
+
+  def test_keep_zip(self):
+    """Tests keeping the zip in the build dir."""
+    binary_providers.download_build_if_needed(
+        '/dest', 'https://storage.cloud.google.com/test/abc.zip', ['args.gn'])
+
+    self.mock.extract_build.assert_called_once_with(
+        self.saved_file, '/dest', ['args.gn'])
+    self.assertEqual(['.build.zip'], os.listdir('/dest'))
+    self.assertFalse(os.path.exists(self.saved_file))
+
+
+class DownloadGsFileTest(helpers.ExtendedTestCase):
+  """Test download_gs_file."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.gsutil',
+        'multiprocessing.cpu_count',
+    ])
+    self.mock.cpu_count.return_value = 16
+
+  def test_download(self):
+    """Test downloading with sliced downloads."""
+    binary_providers.download_gs_file('gs://test/abc.zip', '/dest/abc.zip')
+
+    self.assertEqual(1, self.mock.gsutil.call_count)
+    args, kwargs = self.mock.gsutil.call_args
+    self.assertEqual(
+        ('-o GSUtil:sliced_object_download_threshold=50M '
+         '-o GSUtil:check_hashes=if_fast_else_fail '
+         '-o GSUtil:sliced_object_download_max_components=16 '
+         'cp gs://test/abc.zip /dest/abc.zip',), args)
+    self.assertEqual('.', kwargs['cwd'])
+    self.assertTrue(kwargs['redirect_stderr_to_stdout'])
+    self.assertIsInstance(
+        kwargs['stdout_transformer'], output_transformer.Identity)
+
+
+class ExtractBuildFilesIfNeededTest(helpers.ExtendedTestCase):
+  """Test extract_build_files_if_needed."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.binary_providers.extract_build'])
+
+  def test_fully_extracted(self):
+    """Test doing nothing when the build has no zip."""
+    os.makedirs('/dest')
+    binary_providers.extract_build_files_if_needed('/dest', ['a'])
+    self.assert_n_calls(0, [self.mock.extract_build])
+
+  def test_lazy(self):
+    """Test extracting from the kept zip."""
+    self.fs.CreateFile('/dest/.build.zip')
+    binary_providers.extract_build_files_if_needed('/dest', ['a'])
+    self.mock.extract_build.assert_called_once_with(
+        '/dest/.build.zip', '/dest', ['a'])
+
+
+class ExtractBuildTest(helpers.ExtendedTestCase):
+  """Test extract_build."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.zip_path = '/build.zip'
+
+  def make_zip(self, members):
+    """Make a zip with (name, content, mode) members."""
+    with zipfile.ZipFile(self.zip_path, 'w') as zip_file:
+      for name, content, mode in members:
+        info = zipfile.ZipInfo(name)
+        info.external_attr = mode << 16
+        zip_file.writestr(info, content)
+
+  def test_sub_dir(self):
+    """Test extracting the dir of args.gn."""
+    self.make_zip([
+        ('linux-release/', '', stat.S_IFDIR | 0755),
+        ('linux-release/args.gn', 'is_asan = true', stat.S_IFREG | 0644),
+        ('linux-release/chrome', 'binary', stat.S_IFREG | 0755),
+        ('linux-release/lib/libc++.so', 'lib', stat.S_IFREG | 0644),
+        ('linux-release/chrome-link', 'chrome', stat.S_IFLNK | 0777),
+        ('README', 'readme', stat.S_IFREG | 0644),
+    ])
+
+    self.assertEqual(
+        '/dest/args.gn', binary_providers.extract_build(self.zip_path, '/dest'))
+
+    self.assertEqual(
+        ['args.gn', 'chrome', 'chrome-link', 'lib'],
+        sorted(os.listdir('/dest')))
+    with open('/dest/lib/libc++.so') as f:
+      self.assertEqual('lib', f.read())
+    self.assertEqual('chrome', os.readlink('/dest/chrome-link'))
+    self.assert_file_permissions('/dest/chrome', 755)
+    self.assert_file_permissions('/dest/args.gn', 644)
+
+  def test_top_dir(self):
+    """Test extracting a zip with args.gn in the top dir."""
+    self.make_zip([
+        ('args.gn', 'target_os = "android"', stat.S_IFREG | 0644),
+        ('apks/ChromePublic.apk', 'apk', stat.S_IFREG | 0644),
+    ])
+
+    binary_providers.extract_build(self.zip_path, '/dest')
+
+    self.assertEqual(['apks', 'args.gn'], sorted(os.listdir('/dest')))
+    with open('/dest/apks/ChromePublic.apk') as f:
+      self.assertEqual('apk', f.read())
+
+  def test_patterns(self):
+    """Test extracting only the files matching the patterns."""
+    self.make_zip([
+        ('out/args.gn', 'is_asan = true', stat.S_IFREG | 0644),
+        ('out/a_fuzzer', 'binary', stat.S_IFREG | 0755),
+        ('out/a_fuzzer.dict', 'dict', stat.S_IFREG | 0644),
+        ('out/a_fuzzer_seed_corpus.zip', 'corpus', stat.S_IFREG | 0644),
+        ('out/b_fuzzer', 'binary', stat.S_IFREG | 0755),
+        ('out/lib/libc++.so', 'lib', stat.S_IFREG | 0644),
     ])
-    self.mock.copytree.assert_called_once_with(
-        '/tmp/random/sub', self.dest_path)
-    self.mock.gsutil.assert_called_once_with(
-        'cp gs://test/test2/abc.zip .', common.CLUSTERFUZZ_CACHE_DIR)
-    self.mock.find_file.assert_called_once_with(
-        'args.gn', self.mock.mkdtemp.return_value)
+
+    binary_providers.extract_build(
+        self.zip_path, '/dest', ['args.gn', 'a_fuzzer', 'a_fuzzer.*', '*.so'])
+
+    self.assertEqual(
+        ['a_fuzzer', 'a_fuzzer.dict', 'args.gn', 'lib'],
+        sorted(os.listdir('/dest')))
+    self.assertEqual(['libc++.so'], os.listdir('/dest/lib'))
+
+    binary_providers.extract_build(self.zip_path, '/dest', ['b_fuzzer'])
+    self.assertTrue(os.path.exists('/dest/b_fuzzer'))
+
+  def test_fuzz_target_patterns(self):
+    """Test extracting a fuzz target lazily extracts only the files it needs
+      at startup."""
+    members = [
+        ('out/args.gn', 'is_asan = true', stat.S_IFREG | 0644),
+        ('out/a_fuzzer', 'binary', stat.S_IFREG | 0755),
+        ('out/a_fuzzer.dict', 'dict', stat.S_IFREG | 0644),
+        ('out/a_fuzzer.options', 'options', stat.S_IFREG | 0644),
+        ('out/a_fuzzer_seed_corpus.zip', 'corpus', stat.S_IFREG | 0644),
+        ('out/b_fuzzer', 'binary', stat.S_IFREG | 0755),
+        ('out/b_fuzzer.dict', 'dict', stat.S_IFREG | 0644),
+        ('out/chrome', 'binary', stat.S_IFREG | 0755),
+        ('out/icudtl.dat', 'icu', stat.S_IFREG | 0644),
+        ('out/snapshot_blob.bin', 'snapshot', stat.S_IFREG | 0644),
+        ('out/locales/en-US.pak', 'pak', stat.S_IFREG | 0644),
+        ('out/libclang_rt.asan.so', 'lib', stat.S_IFREG | 0644),
+    ]
+    self.make_zip(members)
+    helpers.patch(self, ['clusterfuzz.binary_providers.get_binary_name'])
+    self.mock.get_binary_name.return_value = 'a_fuzzer'
+    builder = binary_providers.LibfuzzerAndAflBuilder(
+        libs.make_testcase(stacktrace_lines='trace'), libs.make_definition(),
+        libs.make_options())
+
+    binary_providers.extract_build(
+        self.zip_path, '/dest', builder.get_required_file_patterns())
+
+    extracted = sorted(
+        os.path.relpath(os.path.join(root, filename), '/dest')
+        for root, _, filenames in os.walk('/dest') for filename in filenames)
+    self.assertEqual(
+        ['a_fuzzer', 'a_fuzzer.dict', 'a_fuzzer.options', 'args.gn',
+         'icudtl.dat', 'libclang_rt.asan.so', 'locales/en-US.pak',
+         'snapshot_blob.bin'],
+        extracted)
+    self.assertLess(len(extracted), len(members))
+
+  def test_skip_extracted(self):
+    """Test not extracting a file twice."""
+    self.make_zip([('args.gn', 'new', stat.S_IFREG | 0644)])
+    self.fs.CreateFile('/dest/args.gn', contents='old')
+
+    binary_providers.extract_build(self.zip_path, '/dest')
+
+    with open('/dest/args.gn') as f:
+      self.assertEqual('old', f.read())
+
+  def test_no_args_gn(self):
+    """Test raising an exception when the zip has no args.gn."""
+    self.make_zip([('chrome', 'binary', stat.S_IFREG | 0755)])
+
+    with self.assertRaises(Exception):
+      binary_providers.extract_build(self.zip_path, '/dest')
 
 
 class GetBinaryPathTest(helpers.ExtendedTestCase):
@@ -167,7 +457,8 @@ class DownloadedBinaryTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, [
-        'clusterfuzz.binary_providers.download_build_if_needed',
+        'clusterfuzz.build_store.link_build',
+        'clusterfuzz.binary_providers.extract_build_files_if_needed',
         'clusterfuzz.binary_providers.get_or_ask_for_source_location',
         'clusterfuzz.binary_providers.BinaryProvider.get_binary_path',
     ])
@@ -189,8 +480,32 @@ class DownloadedBinaryTest(helpers.ExtendedTestCase):
         common.CLUSTERFUZZ_BUILDS_DIR, '12345_downloaded_build')
 
     self.assertEqual(expected_path, self.provider.get_build_dir_path())
-    self.mock.download_build_if_needed.assert_called_once_with(
-        expected_path, self.testcase.build_url)
+    self.assertEqual(1, self.mock.link_build.call_count)
+    url, path, download_fn = self.mock.link_build.call_args[0]
+    self.assertEqual(self.testcase.build_url, url)
+    self.assertEqual(expected_path, path)
+    self.assertEqual(
+        binary_providers.download_build_if_needed, download_fn.func)
+    self.assertEqual({'patterns': None}, download_fn.keywords)
+    self.mock.extract_build_files_if_needed.assert_called_once_with(
+        expected_path, None)
+
+  def test_extract_files(self):
+    """Test extract_files."""
+    self.provider.extract_files(['a.dict'])
+    self.mock.extract_build_files_if_needed.assert_called_with(
+        os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '12345_downloaded_build'),
+        ['a.dict'])
+
+  def test_get_legacy_build_dir_path(self):
+    """Test using a build downloaded before the build store existed."""
+    self.setup_fake_filesystem()
+    expected_path = os.path.join(
+        common.CLUSTERFUZZ_BUILDS_DIR, '12345_downloaded_build')
+    os.makedirs(expected_path)
+
+    self.assertEqual(expected_path, self.provider.get_build_dir_path())
+    self.assert_n_calls(0, [self.mock.link_build])
 
   def test_get_binary_path(self):
     """Tests get_binary_path."""
@@ -261,18 +576,75 @@ class GenericBuilderGetBuildDirPathTest(helpers.ExtendedTestCase):
   """Test GenericBuilder.get_build_dir_path."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.binary_providers.GenericBuilder.get_source_dir_path',
+        'clusterfuzz.binary_providers.GenericBuilder.get_gn_args',
+        'clusterfuzz.binary_providers.evict_build_dirs',
     ])
+    self.mock.get_source_dir_path.return_value = '/path'
+    self.mock.get_gn_args.return_value = {'is_asan': 'true'}
+    self.mock_os_environ = self.mock_os_environment({})
     self.builder = binary_providers.GenericBuilder(
         libs.make_testcase(testcase_id='1234', revision='999'),
         libs.make_definition(), libs.make_options(current=False))
 
   def test_get(self):
     """Test get."""
-    self.mock.get_source_dir_path.return_value = '/path'
+    fingerprint = binary_providers.get_gn_args_fingerprint({'is_asan': 'true'})
+    expected_path = '/path/out/clusterfuzz_%s' % fingerprint
+
+    self.assertEqual(expected_path, self.builder.get_build_dir_path())
+    self.assertTrue(
+        os.path.exists(os.path.join(expected_path, '.clusterfuzz_last_used')))
+    self.mock.evict_build_dirs.assert_called_once_with(
+        '/path/out', expected_path, 3)
+
+
+class GetGnArgsFingerprintTest(helpers.ExtendedTestCase):
+  """Test get_gn_args_fingerprint."""
+
+  def test_fingerprint(self):
+    """Test the fingerprint only depends on the args."""
+    self.assertEqual(
+        binary_providers.get_gn_args_fingerprint({'a': '1', 'b': '2'}),
+        binary_providers.get_gn_args_fingerprint({'b': '2', 'a': '1'}))
+    self.assertNotEqual(
+        binary_providers.get_gn_args_fingerprint({'a': '1'}),
+        binary_providers.get_gn_args_fingerprint({'a': '2'}))
+    self.assertEqual(
+        16, len(binary_providers.get_gn_args_fingerprint({'a': '1'})))
+
+
+class EvictBuildDirsTest(helpers.ExtendedTestCase):
+  """Test evict_build_dirs."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    for name, mtime in [('clusterfuzz_a', 3), ('clusterfuzz_b', 1),
+                        ('clusterfuzz_c', 2), ('clusterfuzz_d', 0)]:
+      stamp_path = os.path.join('/out', name, '.clusterfuzz_last_used')
+      self.fs.CreateFile(stamp_path)
+      os.utime(stamp_path, (mtime, mtime))
+    # An out dir that wasn't made by us.
+    os.makedirs('/out/Release')
+    # A per-testcase out dir of an older version.
+    os.makedirs('/out/clusterfuzz_1234')
+    os.utime('/out/clusterfuzz_1234', (0, 0))
+
+  def test_evict(self):
+    """Test keeping the current and the most recently used out dirs, and
+      the ones that weren't made by get_build_dir_path."""
+    binary_providers.evict_build_dirs('/out', '/out/clusterfuzz_d', 2)
+
     self.assertEqual(
-        '/path/out/clusterfuzz_1234', self.builder.get_build_dir_path())
+        ['Release', 'clusterfuzz_1234', 'clusterfuzz_a', 'clusterfuzz_d'],
+        sorted(os.listdir('/out')))
+
+  def test_nothing_to_evict(self):
+    """Test not deleting anything when there are few out dirs."""
+    binary_providers.evict_build_dirs('/out', '/out/clusterfuzz_a', 6)
+    self.assertEqual(6, len(os.listdir('/out')))
 
 
 class GenericBuilderGetGnArgsTest(helpers.ExtendedTestCase):
@@ -342,6 +714,35 @@ class GenericBuilderGnGenTest(helpers.ExtendedTestCase):
     self.mock.edit_if_needed.assert_called_once_with(
         'a = b', prefix=mock.ANY, comment=mock.ANY, should_edit=True)
 
+  def test_unchanged(self):
+    """Ensure gn gen is skipped when args.gn is unchanged."""
+    self.fs.CreateFile('/test/build_dir/args.gn', contents='a = b')
+    self.fs.CreateFile('/test/build_dir/build.ninja')
+    self.fs.CreateFile('/test/build_dir/build.ninja.d')
+    os.utime('/test/build_dir/args.gn', (1, 1))
+
+    self.mock.get_build_dir_path.return_value = '/test/build_dir'
+    self.mock.get_gn_args.return_value = {'a': 'b'}
+
+    self.builder.gn_gen()
+
+    self.assertEqual(1, os.stat('/test/build_dir/args.gn').st_mtime)
+    self.assertEqual(0, self.mock.execute.call_count)
+
+  def test_not_generated(self):
+    """Ensure gn gen is run when the build files are missing."""
+    self.fs.CreateFile('/test/build_dir/args.gn', contents='a = b')
+    self.fs.CreateFile('/test/build_dir/build.ninja')
+
+    self.mock.get_build_dir_path.return_value = '/test/build_dir'
+    self.mock.get_gn_args.return_value = {'a': 'b'}
+    self.mock.get_source_dir_path.return_value = '/chrome/source/dir'
+
+    self.builder.gn_gen()
+
+    self.mock.execute.assert_called_once_with(
+        'gn', 'gen /test/build_dir', '/chrome/source/dir')
+
 
 class GenericBuilderInstallDepsTest(helpers.ExtendedTestCase):
   """Test gn_gen."""
@@ -395,7 +796,11 @@ class GenericBuilderSetupAllDepsTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.GenericBuilder.gclient_sync',
         'clusterfuzz.binary_providers.GenericBuilder.gclient_runhooks',
         'clusterfuzz.binary_providers.GenericBuilder.install_deps',
+        'clusterfuzz.binary_providers.GenericBuilder.get_deps_fingerprint',
+        'clusterfuzz.binary_providers.GenericBuilder.get_source_dir_path',
     ])
+    self.mock.get_deps_fingerprint.return_value = 'fingerprint'
+    self.mock.get_source_dir_path.return_value = '/src'
 
   def test_skip(self):
     """Test skip."""
@@ -418,6 +823,85 @@ class GenericBuilderSetupAllDepsTest(helpers.ExtendedTestCase):
     self.mock.gclient_runhooks.assert_called_once_with(builder)
     self.mock.install_deps.assert_called_once_with(builder)
 
+  def test_unchanged(self):
+    """Test skipping the steps when their inputs haven't changed."""
+    builder = binary_providers.GenericBuilder(
+        libs.make_testcase(), libs.make_definition(),
+        libs.make_options(skip_deps=False))
+    builder.setup_all_deps()
+    builder.setup_all_deps()
+    self.assert_n_calls(1, [
+        self.mock.gclient_sync,
+        self.mock.gclient_runhooks,
+        self.mock.install_deps])
+
+    self.mock.get_deps_fingerprint.return_value = 'another'
+    builder.setup_all_deps()
+    self.assert_n_calls(2, [
+        self.mock.gclient_sync,
+        self.mock.gclient_runhooks,
+        self.mock.install_deps])
+
+  def test_failed(self):
+    """Test re-running a step after it fails."""
+    builder = binary_providers.GenericBuilder(
+        libs.make_testcase(), libs.make_definition(),
+        libs.make_options(skip_deps=False))
+    builder.setup_all_deps()
+
+    self.mock.get_deps_fingerprint.return_value = 'another'
+    self.mock.gclient_runhooks.side_effect = Exception('failed')
+    with self.assertRaises(Exception):
+      builder.setup_all_deps()
+
+    self.mock.get_deps_fingerprint.return_value = 'fingerprint'
+    self.mock.gclient_runhooks.side_effect = None
+    builder.setup_all_deps()
+    self.assertEqual(3, self.mock.gclient_sync.call_count)
+    self.assertEqual(3, self.mock.gclient_runhooks.call_count)
+    self.assertEqual(1, self.mock.install_deps.call_count)
+
+
+class GenericBuilderGetDepsFingerprintTest(helpers.ExtendedTestCase):
+  """Test GenericBuilder.get_deps_fingerprint."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.GenericBuilder.get_source_dir_path',
+        'clusterfuzz.binary_providers.GenericBuilder.get_runhooks_env',
+        'clusterfuzz.common.execute',
+    ])
+    self.mock.get_source_dir_path.return_value = '/src'
+    self.mock.get_runhooks_env.return_value = {}
+    self.mock.execute.return_value = (0, 'sha\n')
+    self.fs.CreateFile('/src/DEPS', contents='deps')
+    self.builder = binary_providers.GenericBuilder(
+        libs.make_testcase(), libs.make_definition(), libs.make_options())
+
+  def test_inputs(self):
+    """Test the fingerprint changes with each of its inputs."""
+    fingerprint = self.builder.get_deps_fingerprint()
+    self.assertEqual(fingerprint, self.builder.get_deps_fingerprint())
+    self.mock.execute.assert_called_with(
+        'git', 'rev-parse HEAD', '/src', print_command=False,
+        print_output=False)
+
+    self.mock.execute.return_value = (0, 'another\n')
+    sha_fingerprint = self.builder.get_deps_fingerprint()
+
+    with open('/src/DEPS', 'w') as f:
+      f.write('another')
+    deps_fingerprint = self.builder.get_deps_fingerprint()
+
+    self.mock.get_runhooks_env.return_value = {'GYP_DEFINES': 'msan=1'}
+    env_fingerprint = self.builder.get_deps_fingerprint()
+
+    self.assertEqual(
+        4,
+        len(set([fingerprint, sha_fingerprint, deps_fingerprint,
+                 env_fingerprint])))
+
 
 class GenericBuilderGetTargetNameAndBinaryNameTest(helpers.ExtendedTestCase):
   """Test get_target_name and get_binary_name."""
@@ -449,9 +933,14 @@ class GenericBuilderBuildTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.GenericBuilder.get_source_dir_path',
         'clusterfuzz.binary_providers.compute_goma_cores',
         'clusterfuzz.binary_providers.compute_goma_load',
+        'clusterfuzz.binary_providers.get_goma_stats',
         'clusterfuzz.binary_providers.git_checkout',
+        'clusterfuzz.binary_providers.read_ninja_log_steps',
         'clusterfuzz.common.execute',
     ])
+    self.mock.get_goma_stats.side_effect = [(10, 5), (40, 15)]
+    self.mock.read_ninja_log_steps.return_value = [
+        (1.5, 'obj/a.o'), (7.0, 'obj/b.o')]
     self.builder = binary_providers.GenericBuilder(
         libs.make_testcase(revision=213), libs.make_definition(targets=['d8']),
         libs.make_options(current=False))
@@ -480,6 +969,83 @@ class GenericBuilderBuildTest(helpers.ExtendedTestCase):
     self.assertIsInstance(
         self.mock.execute.call_args[1]['stdout_transformer'],
         output_transformer.Ninja)
+    self.assertEqual(
+        ['checkout', 'deps', 'gn gen', 'ninja'], self.builder.timings.keys())
+    self.mock.read_ninja_log_steps.assert_called_once_with(
+        '/chrome/source/out/clusterfuzz_54321/.ninja_log', 0)
+    summary = self.builder.build_summary
+    self.assertEqual(
+        ['checkout', 'deps', 'gn gen', 'ninja'], summary['timings'].keys())
+    self.assertEqual(0.75, summary['goma_fraction'])
+    self.assertEqual(120, summary['goma_cores'])
+    self.assertEqual(8, summary['goma_load'])
+    self.assertEqual(
+        [{'seconds': 7.0, 'output': 'obj/b.o'},
+         {'seconds': 1.5, 'output': 'obj/a.o'}],
+        summary['slowest_steps'])
+
+
+class ReadNinjaLogStepsTest(helpers.ExtendedTestCase):
+  """Test read_ninja_log_steps."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.old_content = '# ninja log v5\n0\t100\t0\thash0\told.o\n'
+    self.fs.CreateFile(
+        '/out/.ninja_log',
+        contents=(self.old_content +
+                  '0\t2500\t0\thash1\ta.o\n'
+                  '0\t2500\t0\thash1\ta.h\n'
+                  '100\t600\t0\thash2\tb.o\n'))
+
+  def test_read(self):
+    """Test reading the steps after the offset."""
+    self.assertEqual(
+        [(2.5, 'a.o'), (0.5, 'b.o')],
+        binary_providers.read_ninja_log_steps(
+            '/out/.ninja_log', len(self.old_content)))
+
+  def test_recompacted(self):
+    """Test reading the whole log when it shrank."""
+    self.assertEqual(
+        [(0.1, 'old.o'), (2.5, 'a.o'), (0.5, 'b.o')],
+        binary_providers.read_ninja_log_steps('/out/.ninja_log', 10000))
+
+  def test_no_log(self):
+    """Test no ninja log."""
+    self.assertEqual(
+        [], binary_providers.read_ninja_log_steps('/out/none', 0))
+
+
+class GetGomaStatsTest(helpers.ExtendedTestCase):
+  """Test get_goma_stats and compute_goma_fraction."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_stats(self):
+    """Test parsing the stats."""
+    self.mock.execute.return_value = (0, (
+        'request: total=20 success=20 failure=0\n'
+        '  goma: finished=15 aborted=0 retry=0 fail=0\n'
+        '  local: run=5 killed=0 finished=5\n'))
+    self.assertEqual((15, 5), binary_providers.get_goma_stats('/goma'))
+    self.mock.execute.assert_called_once_with(
+        'python', 'goma_ctl.py stat', '/goma', print_command=False,
+        print_output=False, exit_on_error=False)
+
+  def test_no_stats(self):
+    """Test goma not reporting the stats."""
+    self.mock.execute.return_value = (1, 'error')
+    self.assertIsNone(binary_providers.get_goma_stats('/goma'))
+
+  def test_fraction(self):
+    """Test computing the fraction."""
+    self.assertEqual(
+        0.5, binary_providers.compute_goma_fraction((10, 10), (20, 20)))
+    self.assertIsNone(
+        binary_providers.compute_goma_fraction((10, 10), (10, 10)))
+    self.assertIsNone(binary_providers.compute_goma_fraction(None, (1, 1)))
 
 
 class DeserializeGnArgsTest(helpers.ExtendedTestCase):
@@ -584,7 +1150,9 @@ class PdfiumBuilderGetGitShaTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.binary_providers.sha_from_revision',
-        'clusterfuzz.binary_providers.get_third_party_sha'])
+        'clusterfuzz.binary_providers.get_third_party_sha',
+        'clusterfuzz.binary_providers.get_local_chromium_dir'])
+    self.mock.get_local_chromium_dir.return_value = '/chromium'
     self.builder = binary_providers.PdfiumBuilder(
         libs.make_testcase(revision=1234), libs.make_definition(),
         libs.make_options())
@@ -595,9 +1163,10 @@ class PdfiumBuilderGetGitShaTest(helpers.ExtendedTestCase):
     self.mock.get_third_party_sha.return_value = 'pdfium_sha'
 
     self.assertEqual('pdfium_sha', self.builder.get_git_sha())
-    self.mock.sha_from_revision.assert_called_once_with(1234, 'chromium/src')
+    self.mock.sha_from_revision.assert_called_once_with(
+        1234, 'chromium/src', '/chromium')
     self.mock.get_third_party_sha.assert_called_once_with(
-        'sha', 'pdfium_revision')
+        'sha', 'pdfium_revision', '/chromium')
 
 
 class ChromiumBuilderTest(helpers.ExtendedTestCase):
@@ -620,7 +1189,8 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
     """Test get_git_sha."""
     self.mock.sha_from_revision.return_value = 'sha'
     self.assertEqual('sha', self.builder.get_git_sha())
-    self.mock.sha_from_revision.assert_called_once_with(1234, 'chromium/src')
+    self.mock.sha_from_revision.assert_called_once_with(
+        1234, 'chromium/src', '/src')
 
   def test_install_deps(self):
     """Test install_deps."""
@@ -646,10 +1216,12 @@ class V8BuilderTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.GenericBuilder.get_source_dir_path',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.get_third_party_sha',
+        'clusterfuzz.binary_providers.get_local_chromium_dir',
         'clusterfuzz.binary_providers.install_build_deps',
         'clusterfuzz.common.execute',
     ])
     self.mock.get_source_dir_path.return_value = '/src'
+    self.mock.get_local_chromium_dir.return_value = '/chromium'
     self.builder = binary_providers.V8Builder(
         libs.make_testcase(revision=1234), libs.make_definition(),
         libs.make_options())
@@ -658,7 +1230,7 @@ class V8BuilderTest(helpers.ExtendedTestCase):
     """Test get_git_sha for standalone."""
     self.mock.sha_from_revision.return_value = 'sha'
     self.assertEqual('sha', self.builder.get_git_sha())
-    self.mock.sha_from_revision.assert_called_once_with(1234, 'v8/v8')
+    self.mock.sha_from_revision.assert_called_once_with(1234, 'v8/v8', '/src')
 
   def test_get_git_sha_from_chromium(self):
     """Test get_git_sha for standalone."""
@@ -666,8 +1238,10 @@ class V8BuilderTest(helpers.ExtendedTestCase):
     self.mock.sha_from_revision.return_value = 'sha'
     self.mock.get_third_party_sha.return_value = 'third_party_sha'
     self.assertEqual('third_party_sha', self.builder.get_git_sha())
-    self.mock.sha_from_revision.assert_called_once_with(400001, 'chromium/src')
-    self.mock.get_third_party_sha.assert_called_once_with('sha', 'v8_revision')
+    self.mock.sha_from_revision.assert_called_once_with(
+        400001, 'chromium/src', '/chromium')
+    self.mock.get_third_party_sha.assert_called_once_with(
+        'sha', 'v8_revision', '/chromium')
 
   def test_install_deps(self):
     """Test install_deps."""
@@ -740,6 +1314,14 @@ class MsanMixinTest(helpers.ExtendedTestCase):
     # It's important that the super class's gclient_runhooks isn't invoked.
     self.assertEqual(0, self.mock.gclient_runhooks.call_count)
 
+  def test_get_runhooks_env(self):
+    """Test the env of gclient runhooks is part of the deps fingerprint."""
+    self.mock.get_gn_args.return_value = {'msan_track_origins': '1'}
+    self.assertEqual(
+        {'GYP_DEFINES': ('msan=1 msan_track_origins=1 '
+                         'use_prebuilt_instrumented_libraries=1')},
+        self.builder.get_runhooks_env())
+
 
 class Lib32MixinTest(helpers.ExtendedTestCase):
   """Tests ChromiumBuilder32Bit."""
@@ -1012,6 +1594,13 @@ class LibfuzzerAndAflBuilderTest(helpers.ExtendedTestCase):
     self.assertEqual('target', self.builder.get_binary_name())
     self.mock.get_binary_name.assert_called_once_with('trace', False)
 
+  def test_get_required_file_patterns(self):
+    """Test get_required_file_patterns."""
+    self.assertEqual(
+        ['args.gn', 'target', 'target.dict', 'target.options', '*.so',
+         '*.so.*', 'icudtl.dat', '*_blob.bin', '*.pak'],
+        self.builder.get_required_file_patterns())
+
 
 class GetBinaryNameTest(helpers.ExtendedTestCase):
   """Test get_binary_name."""
@@ -1156,43 +1745,41 @@ class GetClankShaTest(helpers.ExtendedTestCase):
   """Tests get_clank_sha."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.gsutil'])
+    helpers.patch(self, ['clusterfuzz.binary_providers.download_gs_file'])
     self.setup_fake_filesystem()
 
   def test_get(self):
     """Tests get_clank_sha."""
     self.path = None
-    def write_tmp_file(cmd, cwd):  # pylint: disable=unused-argument
-      _, _, self.path = cmd.split(' ')
+    def write_tmp_file(unused_url, path):
+      self.path = path
       with open(self.path, 'w') as f:
         f.write(
             'vars = {\n'
             '  "clank_revision": "aaffADB098",\n'
             '  "chromium_revision": "487843",\n'
             '}\n')
-    self.mock.gsutil.side_effect = write_tmp_file
+    self.mock.download_gs_file.side_effect = write_tmp_file
 
     self.assertEqual('aaffADB098', binary_providers.get_clank_sha('url/12345'))
-    self.mock.gsutil.assert_called_once_with(
-        'cp url/12345 %s' % self.path, cwd='.')
+    self.mock.download_gs_file.assert_called_once_with('url/12345', self.path)
 
   def test_error(self):
     """Tests get_clank_sha."""
     self.path = None
-    def write_tmp_file(cmd, cwd):  # pylint: disable=unused-argument
-      _, _, self.path = cmd.split(' ')
+    def write_tmp_file(unused_url, path):
+      self.path = path
       with open(self.path, 'w') as f:
         f.write(
             'vars = {\n'
             '  "chromium_revision": "487843",\n'
             '}\n')
-    self.mock.gsutil.side_effect = write_tmp_file
+    self.mock.download_gs_file.side_effect = write_tmp_file
 
     with self.assertRaises(Exception):
       binary_providers.get_clank_sha('url/12345')
 
-    self.mock.gsutil.assert_called_once_with(
-        'cp url/12345 %s' % self.path, cwd='.')
+    self.mock.download_gs_file.assert_called_once_with('url/12345', self.path)
 
 
 class CheckGclientManagedTest(helpers.ExtendedTestCase):
@@ -0,0 +1,149 @@
+"""Test the build_store module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import os
+
+import mock
+
+from clusterfuzz import build_store
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+from test_libs import helpers
+
+
+def fake_download(dest, url):
+  """Extract a fake build into dest."""
+  os.makedirs(dest)
+  with open(os.path.join(dest, 'binary'), 'w') as f:
+    f.write(url)
+
+
+class GetMaxBytesTest(helpers.ExtendedTestCase):
+  """Test get_max_bytes."""
+
+  def test_default(self):
+    """Test the default budget."""
+    self.mock_os_environment({})
+    self.assertEqual(50 * 1024 * 1024 * 1024, build_store.get_max_bytes())
+
+  def test_env(self):
+    """Test setting the budget with the env."""
+    self.mock_os_environment({'CF_BUILDS_MAX_SIZE_GB': '0.5'})
+    self.assertEqual(512 * 1024 * 1024, build_store.get_max_bytes())
+
+
+class LinkBuildTest(helpers.ExtendedTestCase):
+  """Test link_build."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.build_store.evict',
+        'fcntl.flock',
+    ])
+    self.download = mock.Mock(side_effect=fake_download)
+    self.key = disk_cache.get_key('url')
+    self.path = build_store.get_path(self.key)
+    self.view_path = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1_build')
+    os.makedirs(common.CLUSTERFUZZ_BUILDS_DIR)
+    build_store.LOCKS.clear()
+    self.addCleanup(build_store.LOCKS.clear)
+
+  def test_download(self):
+    """Test downloading a build that isn't in the store."""
+    self.assertEqual(
+        self.path,
+        build_store.link_build('url', self.view_path, self.download))
+
+    self.download.assert_called_once_with(
+        os.path.join(build_store.STORE_DIR, '.tmp-' + self.key), 'url')
+    self.assertEqual(self.path, os.readlink(self.view_path))
+    with open(os.path.join(self.view_path, 'binary')) as f:
+      self.assertEqual('url', f.read())
+    with open(self.path + '.size') as f:
+      self.assertEqual('3', f.read())
+    lock_file = build_store.LOCKS[self.key]
+    self.assert_exact_calls(self.mock.flock, [
+        mock.call(lock_file, fcntl.LOCK_SH),
+        mock.call(lock_file, fcntl.LOCK_UN),
+        mock.call(lock_file, fcntl.LOCK_EX),
+        mock.call(lock_file, fcntl.LOCK_SH)
+    ])
+    self.mock.evict.assert_called_once_with()
+
+  def test_share(self):
+    """Test sharing a build between testcases."""
+    other_view_path = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '2_build')
+    build_store.link_build('url', self.view_path, self.download)
+    build_store.link_build('url', other_view_path, self.download)
+
+    self.assertEqual(1, self.download.call_count)
+    self.assertEqual(self.path, os.readlink(self.view_path))
+    self.assertEqual(self.path, os.readlink(other_view_path))
+
+  def test_replace_stale_view(self):
+    """Test replacing a view that points to an evicted build."""
+    os.symlink('/evicted', self.view_path)
+
+    build_store.link_build('url', self.view_path, self.download)
+
+    self.assertEqual(self.path, os.readlink(self.view_path))
+
+
+class EvictTest(helpers.ExtendedTestCase):
+  """Test evict."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.build_store.get_max_bytes',
+        'clusterfuzz.build_store.try_lock_exclusively',
+    ])
+    self.mock.get_max_bytes.return_value = 10
+    os.makedirs(common.CLUSTERFUZZ_BUILDS_DIR)
+    build_store.LOCKS.clear()
+    self.addCleanup(build_store.LOCKS.clear)
+
+    for key, mtime in [('a', 1), ('b', 2), ('c', 3)]:
+      path = build_store.get_path(key)
+      self.fs.CreateFile(os.path.join(path, 'binary'), contents='123456')
+      self.fs.CreateFile(path + '.size', contents='6')
+      self.fs.CreateFile(path + '.lock')
+      os.utime(path + '.lock', (mtime, mtime))
+      os.symlink(path, os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, key))
+
+  def test_evict_least_recently_used(self):
+    """Test evicting the least recently used builds and their views."""
+    build_store.evict()
+
+    self.assertFalse(os.path.exists(build_store.get_path('a')))
+    self.assertFalse(os.path.exists(build_store.get_path('b')))
+    self.assertTrue(os.path.exists(build_store.get_path('c')))
+    self.assertEqual(
+        ['c', 'store'], sorted(os.listdir(common.CLUSTERFUZZ_BUILDS_DIR)))
+
+  def test_skip_referenced(self):
+    """Test not evicting builds that are in use."""
+    build_store.LOCKS['a'] = mock.Mock()
+    self.mock.try_lock_exclusively.side_effect = [None, mock.Mock()]
+
+    build_store.evict()
+
+    self.assertTrue(os.path.exists(build_store.get_path('a')))
+    self.assertTrue(os.path.exists(build_store.get_path('b')))
+    self.assertFalse(os.path.exists(build_store.get_path('c')))
+    self.assert_exact_calls(
+        self.mock.try_lock_exclusively, [mock.call('b'), mock.call('c')])
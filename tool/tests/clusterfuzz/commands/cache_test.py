@@ -0,0 +1,64 @@
+"""Test the module for the 'cache' command"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+from clusterfuzz.commands import cache
+from test_libs import helpers
+
+
+class FormatStatsTest(helpers.ExtendedTestCase):
+  """Test format_stats."""
+
+  def test_format(self):
+    """Test formatting the stats of each URL."""
+    stats = collections.OrderedDict([
+        ('https://clusterfuzz.com/parse_stacktrace',
+         {'entries': 2, 'bytes': 100, 'expired': 0}),
+        (None, {'entries': 1, 'bytes': 5, 'expired': 1}),
+    ])
+    self.assertEqual(
+        'https://clusterfuzz.com/parse_stacktrace (immutable): 2 entries, '
+        '100 bytes, 0 expired\n'
+        'None (unreadable): 1 entries, 5 bytes, 1 expired',
+        cache.format_stats(stats))
+
+  def test_empty(self):
+    """Test formatting an empty cache."""
+    self.assertEqual('The cache is empty.', cache.format_stats({}))
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Test execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.http_cache.get_stats',
+        'clusterfuzz.http_cache.prune',
+    ])
+    self.mock.get_stats.return_value = {}
+    self.mock.prune.return_value = 3
+
+  def test_stats(self):
+    """Test showing the stats."""
+    cache.execute('stats')
+    self.mock.get_stats.assert_called_once_with()
+    self.assertEqual(0, self.mock.prune.call_count)
+
+  def test_prune(self):
+    """Test pruning."""
+    cache.execute('prune')
+    self.mock.prune.assert_called_once_with()
+    self.assertEqual(0, self.mock.get_stats.call_count)
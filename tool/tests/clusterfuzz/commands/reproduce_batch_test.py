@@ -0,0 +1,147 @@
+"""Test the module for the 'reproduce_batch' command"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import reproduce_batch
+from error import error
+from tests import libs
+from test_libs import helpers
+
+
+def make_testcase(testcase_id, job_type, revision, build_url):
+  """Make a mock testcase."""
+  return mock.Mock(
+      id=testcase_id, job_type=job_type, revision=revision,
+      build_url=build_url)
+
+
+class GroupTestcasesTest(helpers.ExtendedTestCase):
+  """Test group_testcases."""
+
+  def setUp(self):
+    self.testcases = [
+        make_testcase('1', 'linux_asan_d8', 100, 'url_a'),
+        make_testcase('2', 'linux_asan_chrome', 100, 'url_b'),
+        make_testcase('3', 'linux_asan_d8', 100, 'url_c'),
+        make_testcase('4', 'linux_asan_d8', 200, 'url_a'),
+    ]
+
+  def test_local(self):
+    """Test grouping by revision when building locally."""
+    groups = reproduce_batch.group_testcases(self.testcases, 'chromium')
+    self.assertEqual(
+        [('linux_asan_d8', 100), ('linux_asan_chrome', 100),
+         ('linux_asan_d8', 200)],
+        groups.keys())
+    self.assertEqual(
+        [self.testcases[0], self.testcases[2]],
+        groups[('linux_asan_d8', 100)])
+
+  def test_download(self):
+    """Test grouping by build url when downloading."""
+    groups = reproduce_batch.group_testcases(self.testcases, 'download')
+    self.assertEqual(
+        [('linux_asan_d8', 'url_a'), ('linux_asan_chrome', 'url_b'),
+         ('linux_asan_d8', 'url_c')],
+        groups.keys())
+    self.assertEqual(
+        [self.testcases[0], self.testcases[3]],
+        groups[('linux_asan_d8', 'url_a')])
+
+
+class FormatResultsTest(helpers.ExtendedTestCase):
+  """Test format_results."""
+
+  def test_format(self):
+    """Test formatting the table."""
+    self.assertEqual(
+        'Testcase  Job type  Revision  Result                  Time\n'
+        '1234      linux_d8  100       Reproduced              12s\n'
+        '5678                          InvalidTestcaseIdError  0s',
+        reproduce_batch.format_results([
+            reproduce_batch.Result('1234', 'linux_d8', 100, 'Reproduced', 12),
+            reproduce_batch.Result(
+                '5678', '', '', 'InvalidTestcaseIdError', 0)]))
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Test execute."""
+
+  def setUp(self):
+    self.suppress_logging_methods()
+    helpers.patch(self, [
+        'clusterfuzz.common.ensure_important_dirs',
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_testcase_and_identity',
+        'clusterfuzz.commands.reproduce.reproduce_testcase',
+    ])
+    self.testcases = {
+        '1': make_testcase('1', 'linux_asan_d8', 100, 'url'),
+        '2': make_testcase('2', 'linux_asan_chrome', 100, 'url'),
+        '3': make_testcase('3', 'linux_asan_d8', 100, 'url'),
+    }
+
+    def get_testcase_and_identity(testcase_id, unused_force):
+      if testcase_id not in self.testcases:
+        raise error.InvalidTestcaseIdError(testcase_id)
+      return self.testcases[testcase_id], 'identity@something'
+
+    self.mock.get_testcase_and_identity.side_effect = get_testcase_and_identity
+    self.definitions = {
+        'linux_asan_d8': mock.Mock(), 'linux_asan_chrome': mock.Mock()}
+    self.mock.get_definition.side_effect = (
+        lambda job_type, testcase_id, build: self.definitions[job_type])
+
+    def reproduce_testcase(current_testcase, unused_definition, unused_options):
+      if current_testcase.id == '3':
+        raise error.UnreproducibleError(3, [])
+      return True
+
+    self.mock.reproduce_testcase.side_effect = reproduce_testcase
+    options = libs.make_options()
+    self.params = {
+        key: getattr(options, key) for key in [
+            'current', 'build', 'disable_goma', 'goma_threads', 'goma_load',
+            'iterations', 'disable_xvfb', 'target_args', 'edit_mode',
+            'skip_deps', 'enable_debug', 'force', 'parallel_iterations']}
+
+  def test_execute(self):
+    """Test reproducing the testcases of the same build back to back."""
+    with mock.patch(
+        'clusterfuzz.commands.reproduce_batch.format_results') as formatter:
+      reproduce_batch.execute(
+          testcase_ids=['1', '2', '3', '4'], **self.params)
+
+    for current_testcase in self.testcases.values():
+      current_testcase.get_testcase_path.assert_called_once_with()
+    self.assertEqual(
+        ['1', '3', '2'],
+        [c[0][0].id for c in self.mock.reproduce_testcase.call_args_list])
+    self.assertEqual(
+        [self.definitions['linux_asan_d8'], self.definitions['linux_asan_d8'],
+         self.definitions['linux_asan_chrome']],
+        [c[0][1] for c in self.mock.reproduce_testcase.call_args_list])
+    self.assertEqual(
+        ['1', '3', '2'],
+        [c[0][2].testcase_id
+         for c in self.mock.reproduce_testcase.call_args_list])
+    self.assertEqual(2, self.mock.get_definition.call_count)
+
+    results = formatter.call_args[0][0]
+    self.assertEqual(
+        [('4', 'InvalidTestcaseIdError'), ('1', 'Reproduced'),
+         ('3', 'UnreproducibleError'), ('2', 'Reproduced')],
+        [(r.testcase_id, r.result) for r in results])
@@ -148,7 +148,7 @@ class SendRequestTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.get_stored_auth_header',
         'clusterfuzz.common.store_auth_header',
         'clusterfuzz.commands.reproduce.get_verification_header',
-        'clusterfuzz.common.post',
+        'clusterfuzz.http_cache.post',
         'time.sleep'
     ])
 
@@ -255,6 +255,17 @@ class SendRequestTest(helpers.ExtendedTestCase):
     ])
     self.assertEqual(200, response.status_code)
 
+  def test_cached_response(self):
+    """Tests not storing the auth header when the response is cached."""
+    self.mock.get_stored_auth_header.return_value = 'Bearer 12345'
+    self.mock.post.return_value = mock.Mock(
+        status_code=200, text='{}', headers={})
+
+    response = reproduce.send_request('url', 'data')
+
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(0, self.mock.store_auth_header.call_count)
+
   def test_incorrect_authorization(self):
     """Ensures that when auth is incorrect the right exception is thrown"""
 
@@ -358,6 +369,44 @@ class GetTestcaseAndIdentityTest(helpers.ExtendedTestCase):
         reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, '{"testcaseId": "12345"}')
 
 
+class PrefetchTestcasesTest(helpers.ExtendedTestCase):
+  """Tests prefetch_testcases."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_testcase_and_identity',
+    ])
+    self.testcases = {
+        testcase_id: mock.Mock(id=testcase_id) for testcase_id in '123'}
+
+    def get_testcase_and_identity(testcase_id, unused_force):
+      if testcase_id not in self.testcases:
+        raise error.InvalidTestcaseIdError(testcase_id)
+      return self.testcases[testcase_id], 'identity'
+
+    self.mock.get_testcase_and_identity.side_effect = get_testcase_and_identity
+
+  def test_prefetch(self):
+    """Test prefetching in the order of the testcase ids."""
+    results = reproduce.prefetch_testcases(['3', '4', '1', '2'], True)
+
+    self.assertEqual(
+        [(self.testcases['3'], 'identity')], results[:1])
+    self.assertIsInstance(results[1], error.InvalidTestcaseIdError)
+    self.assertEqual(
+        [(self.testcases['1'], 'identity'), (self.testcases['2'], 'identity')],
+        results[2:])
+    self.assertEqual(
+        mock.call('3', True),
+        self.mock.get_testcase_and_identity.call_args_list[0])
+    for current_testcase in self.testcases.values():
+      current_testcase.get_testcase_path.assert_called_once_with()
+
+  def test_empty(self):
+    """Test no testcases."""
+    self.assertEqual([], reproduce.prefetch_testcases([], False))
+
+
 class GetVerificationHeaderTest(helpers.ExtendedTestCase):
   """Tests the get_verification_header method"""
 
@@ -13,12 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cStringIO
 import subprocess
 import os
 import random
 import signal
 import stat
+import sys
+import threading
+import time
 
 import mock
 from requests import exceptions
@@ -110,7 +112,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.check_binary',
         'clusterfuzz.common.kill',
-        'clusterfuzz.common.wait_timeout',
+        'clusterfuzz.common.Timeout',
         'logging.config.dictConfig',
         'logging.getLogger',
         'os.environ.copy',
@@ -123,14 +125,22 @@ class ExecuteTest(helpers.ExtendedTestCase):
     from clusterfuzz import local_logging
     local_logging.start_loggers()
     self.stdout = 'Line 1\nLine 2\nLine 3\n'
-    self.residue_stdout = 'residue'
     self.stderr = 'Err 1\nErr 2\nErr 3'
 
+  def make_pipe(self, data):
+    """Make a pipe that outputs data and then is closed."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, data)
+    os.close(write_fd)
+    pipe = os.fdopen(read_fd, 'r')
+    self.addCleanup(pipe.close)
+    return pipe
+
   def build_popen_mock(self, code):
     """Builds the mocked Popen object."""
     return mock.MagicMock(
-        stdout=cStringIO.StringIO(self.stdout),
-        stderr=cStringIO.StringIO(self.stderr),
+        stdout=self.make_pipe(self.stdout),
+        stderr=self.make_pipe(self.stderr),
         returncode=code)
 
   def run_execute(self, print_cmd, print_out, exit_on_err):
@@ -149,8 +159,6 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.mock.kill.reset_mock()
     self.mock.Popen.reset_mock()
     self.mock.Popen.return_value = self.build_popen_mock(code)
-    self.mock.Popen.return_value.communicate.return_value = (
-        self.residue_stdout, self.stderr)
     self.mock.Popen.return_value.args = 'cmd'
     will_exit = exit_on_err and code != 0
 
@@ -166,11 +174,10 @@ class ExecuteTest(helpers.ExtendedTestCase):
       return_code, returned_lines = self.run_execute(
           print_cmd, print_out, exit_on_err)
       self.assertEqual(return_code, code)
-      self.assertEqual(
-          returned_lines, self.stdout + self.residue_stdout + self.stderr)
+      self.assertEqual(returned_lines, self.stdout + self.stderr)
 
     self.mock.kill.assert_called_once_with(self.mock.Popen.return_value)
-    self.mock.Popen.return_value.communicate.assert_called_once_with()
+    self.mock.Popen.return_value.wait.assert_called_once_with()
     self.mock.Popen.assert_called_once_with(
         'cmd',
         shell=True,
@@ -201,6 +208,21 @@ class ExecuteTest(helpers.ExtendedTestCase):
           self.run_popen_assertions(
               return_code, print_cmd, print_out, exit_on_error)
 
+  def test_not_capture_output(self):
+    """Test stderr is still reported when the output isn't captured."""
+    self.mock.Popen.return_value = self.build_popen_mock(1)
+    self.mock.Popen.return_value.args = 'cmd'
+
+    with self.assertRaises(error.CommandFailedError) as cm:
+      common.execute('cmd', '', '~/working/directory', capture_output=False)
+    self.assertEqual(self.stderr, cm.exception.extras['stderr'])
+
+    self.mock.Popen.return_value = self.build_popen_mock(1)
+    self.assertEqual(
+        (1, ''),
+        common.execute('cmd', '', '~/working/directory', capture_output=False,
+                       exit_on_error=False))
+
   def test_check_binary_fail(self):
     """Test check_binary fail."""
     self.mock.check_binary.side_effect = error.NotInstalledError('cmd')
@@ -215,6 +237,38 @@ class ExecuteTest(helpers.ExtendedTestCase):
         cm.exception.message)
 
 
+class ExecuteThroughputTest(helpers.ExtendedTestCase):
+  """Benchmark execute with a real process writing several MB of output."""
+
+  def setUp(self):
+    # A mock would record every logged line.
+    patcher = mock.patch.object(
+        common.local_logging, 'logger', mock.Mock(debug=lambda *_: None))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_throughput(self):
+    """Test all output is read, even when the process fills stderr first."""
+    stdout_size = 4 * 1024 * 1024
+    stderr_size = 1024 * 1024
+    script = (
+        'import sys; sys.stderr.write("e\\n" * %d); '
+        'sys.stdout.write("o\\n" * %d)' % (stderr_size / 2, stdout_size / 2))
+
+    start = time.time()
+    return_code, output = common.execute(
+        sys.executable, "-c '%s'" % script, '.', print_command=False,
+        stdout_transformer=common.output_transformer.Hidden(n=stdout_size),
+        stderr_transformer=common.output_transformer.Hidden(n=stderr_size))
+    elapsed = time.time() - start
+
+    self.assertEqual(0, return_code)
+    self.assertEqual('o\n' * (stdout_size / 2) + 'e\n' * (stderr_size / 2),
+                     output)
+    self.assertLess(
+        elapsed, 30, 'Reading %d bytes took %.1fs.' % (len(output), elapsed))
+
+
 class CheckBinaryTest(helpers.ExtendedTestCase):
   """Test check_binary."""
 
@@ -357,50 +411,134 @@ class DefinitionTest(helpers.ExtendedTestCase):
           require_user_data_dir=False, revision_url=None)
 
 
-class WaitTimeoutTest(helpers.ExtendedTestCase):
-  """Tests the wait_timeout method."""
+class TimeoutTest(helpers.ExtendedTestCase):
+  """Tests Timeout."""
 
   def setUp(self):
-    helpers.patch(self, ['time.sleep', 'clusterfuzz.common.kill'])
+    helpers.patch(self, ['clusterfuzz.common.kill'])
     self.proc = mock.Mock()
 
   def test_no_timeout(self):
     """Test no timeout."""
-    common.wait_timeout(self.proc, None)
-    self.assertEqual(0, self.mock.sleep.call_count)
-    self.assertEqual(0, self.proc.poll.call_count)
+    timeout = common.Timeout(self.proc, None)
+    timeout.stop()
 
-  def test_die_before(self):
-    """Tests when the process exits without needing to be killed."""
-    self.proc.poll.side_effect = [None, None, None, 1]
+    self.assertIsNone(timeout.thread)
+    self.assertEqual(0, self.mock.kill.call_count)
 
-    common.wait_timeout(self.proc, 5)
+  def test_stop_before(self):
+    """Tests when the process exits without needing to be killed."""
+    start = time.time()
+    timeout = common.Timeout(self.proc, 60)
+    timeout.stop()
 
-    self.mock.kill.assert_called_once_with(self.proc)
-    self.assert_exact_calls(self.mock.sleep, [mock.call(0.5)] * 4)
+    self.assertLess(time.time() - start, 30)
+    self.assertFalse(timeout.thread.is_alive())
+    self.assertEqual(0, self.mock.kill.call_count)
 
   def test_timeout(self):
     """Tests when the process must be killed."""
-    self.proc.poll.return_value = None
-
-    common.wait_timeout(self.proc, 5)
+    timeout = common.Timeout(self.proc, 0.01)
+    timeout.thread.join()
+    timeout.stop()
 
     self.mock.kill.assert_called_once_with(self.proc)
-    self.assert_exact_calls(
-        self.mock.sleep, [mock.call(0.5)] * 10)
 
   def test_ignore_kill_error(self):
     """Tests ignoring error from killing."""
     self.mock.kill.side_effect = Exception()
-    common.wait_timeout(self.proc, 5)
+    timeout = common.Timeout(self.proc, 0.01)
+    timeout.thread.join()
+    timeout.stop()
     self.mock.kill.assert_called_once_with(self.proc)
 
 
+class IsGroupRunningTest(helpers.ExtendedTestCase):
+  """Tests is_group_running."""
+
+  def setUp(self):
+    helpers.patch(self, ['os.getpgid', 'os.killpg', 'psutil.process_iter'])
+    self.processes = {
+        1234: mock.Mock(pid=1234, status=mock.Mock(return_value='zombie')),
+        1235: mock.Mock(pid=1235, status=mock.Mock(return_value='sleeping')),
+        1236: mock.Mock(pid=1236, status=mock.Mock(return_value='running')),
+    }
+    self.mock.process_iter.side_effect = lambda: self.processes.values()
+    self.mock.getpgid.side_effect = (
+        lambda pid: {1234: 1234, 1235: 1234, 1236: 1}[pid])
+
+  def test_running(self):
+    """Test a group with a running process."""
+    self.assertTrue(common.is_group_running(1234))
+    self.mock.killpg.assert_called_once_with(1234, 0)
+
+  def test_zombies(self):
+    """Test a group with only zombies has exited."""
+    del self.processes[1235]
+    self.assertFalse(common.is_group_running(1234))
+
+  def test_process_gone(self):
+    """Test ignoring a process that exits while it's checked."""
+    self.mock.getpgid.side_effect = OSError()
+    self.assertFalse(common.is_group_running(1234))
+
+  def test_no_group(self):
+    """Test a group without any process."""
+    no_process_error = OSError()
+    no_process_error.errno = common.NO_SUCH_PROCESS_ERRNO
+    self.mock.killpg.side_effect = no_process_error
+
+    self.assertFalse(common.is_group_running(1234))
+    self.assertEqual(0, self.mock.process_iter.call_count)
+
+  def test_other_error(self):
+    """Test raising other OSError."""
+    err = OSError()
+    err.errno = 1
+    self.mock.killpg.side_effect = err
+
+    with self.assertRaises(OSError):
+      common.is_group_running(1234)
+
+
+class WaitGroupExitTest(helpers.ExtendedTestCase):
+  """Tests wait_group_exit."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.is_group_running',
+        'time.sleep',
+        'time.time',
+    ])
+    self.proc = mock.Mock(pid=1234)
+    self.mock.time.side_effect = [100, 100, 101, 102]
+    self.mock.is_group_running.return_value = True
+
+  def test_exit(self):
+    """Test returning as soon as the group exits, without reaping proc."""
+    self.mock.is_group_running.side_effect = [True, False]
+
+    self.assertTrue(common.wait_group_exit(self.proc, 2))
+
+    self.assert_exact_calls(
+        self.mock.is_group_running, [mock.call(1234)] * 2)
+    self.assert_exact_calls(
+        self.mock.sleep, [mock.call(common.KILL_POLL_INTERVAL)])
+    self.assertEqual(0, self.proc.poll.call_count)
+    self.assertEqual(0, self.proc.wait.call_count)
+
+  def test_not_exit(self):
+    """Test giving up after the grace period."""
+    self.assertFalse(common.wait_group_exit(self.proc, 2))
+    self.assertEqual(3, self.mock.is_group_running.call_count)
+    self.assertEqual(2, self.mock.sleep.call_count)
+
+
 class KillTest(helpers.ExtendedTestCase):
   """Test kill method."""
 
   def setUp(self):
-    helpers.patch(self, ['time.sleep', 'os.killpg'])
+    helpers.patch(self, ['clusterfuzz.common.wait_group_exit', 'os.killpg'])
     self.proc = mock.Mock()
     self.proc.args = 'cmd'
     self.proc.pid = 1234
@@ -408,20 +546,38 @@ class KillTest(helpers.ExtendedTestCase):
     self.no_process_error = OSError()
     self.no_process_error.errno = common.NO_SUCH_PROCESS_ERRNO
 
-  def test_succeed(self):
-    """Test killing successfully."""
-    self.mock.killpg.side_effect = [None, None, None, self.no_process_error]
+  def test_already_exited(self):
+    """Test the process group has already exited."""
+    self.mock.killpg.side_effect = self.no_process_error
+    common.kill(self.proc)
+
+    self.assert_exact_calls(
+        self.mock.killpg, [mock.call(1234, signal.SIGTERM)])
+    self.assertEqual(0, self.mock.wait_group_exit.call_count)
+
+  def test_exit_on_sigterm(self):
+    """Test returning as soon as the process exits on SIGTERM."""
+    self.mock.wait_group_exit.return_value = True
     common.kill(self.proc)
 
+    self.assert_exact_calls(
+        self.mock.killpg, [mock.call(1234, signal.SIGTERM)])
+    self.assert_exact_calls(self.mock.wait_group_exit, [
+        mock.call(self.proc, common.KILL_TERM_GRACE_PERIOD)])
+
+  def test_exit_on_sigkill(self):
+    """Test escalating to SIGKILL with the given grace periods."""
+    self.mock.wait_group_exit.side_effect = [False, True]
+    common.kill(self.proc, term_grace_period=0.5, kill_grace_period=0.1)
+
     self.assert_exact_calls(self.mock.killpg, [
-        mock.call(1234, signal.SIGTERM), mock.call(1234, signal.SIGTERM),
-        mock.call(1234, signal.SIGKILL), mock.call(1234, signal.SIGKILL)
-    ])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(3)] * 3)
+        mock.call(1234, signal.SIGTERM), mock.call(1234, signal.SIGKILL)])
+    self.assert_exact_calls(self.mock.wait_group_exit, [
+        mock.call(self.proc, 0.5), mock.call(self.proc, 0.1)])
 
   def test_fail(self):
     """Test failing to kill."""
-    self.mock.killpg.side_effect = [None, None, None, None]
+    self.mock.wait_group_exit.return_value = False
 
     with self.assertRaises(error.KillProcessFailedError) as cm:
       common.kill(self.proc)
@@ -431,10 +587,8 @@ class KillTest(helpers.ExtendedTestCase):
         cm.exception.message)
 
     self.assert_exact_calls(self.mock.killpg, [
-        mock.call(1234, signal.SIGTERM), mock.call(1234, signal.SIGTERM),
-        mock.call(1234, signal.SIGKILL), mock.call(1234, signal.SIGKILL)
+        mock.call(1234, signal.SIGTERM), mock.call(1234, signal.SIGKILL)
     ])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(3)] * 4)
 
   def test_other_error(self):
     """Test raising other OSError."""
@@ -448,6 +602,21 @@ class KillTest(helpers.ExtendedTestCase):
     self.assertEqual(4, cm.exception.errno)
 
 
+class KillProcessTest(helpers.ExtendedTestCase):
+  """Test kill with a real process."""
+
+  def test_kill(self):
+    """Test a process that exits on SIGTERM is killed without waiting for the
+      grace period."""
+    proc = subprocess.Popen(['sleep', '60'], preexec_fn=os.setsid)
+
+    start = time.time()
+    common.kill(proc)
+
+    self.assertLess(time.time() - start, common.KILL_TERM_GRACE_PERIOD)
+    self.assertEqual(-signal.SIGTERM, proc.poll())
+
+
 class DeleteIfExistsTest(helpers.ExtendedTestCase):
   """Tests the delete_if_exists method."""
 
@@ -719,11 +888,13 @@ class PostTest(helpers.ExtendedTestCase):
   def setUp(self):
     self.setup_fake_filesystem()
     helpers.patch(self, [
-        'requests_cache.CachedSession',
+        'requests.Session',
         'time.sleep'
     ])
-    self.http = mock.Mock()
-    self.mock.CachedSession.return_value = self.http
+    self.http = mock.MagicMock()
+    self.mock.Session.return_value = self.http
+    common.HTTP_SESSION_MANAGER.close()
+    self.addCleanup(common.HTTP_SESSION_MANAGER.close)
 
   def test_post(self):
     """Test post."""
@@ -733,14 +904,13 @@ class PostTest(helpers.ExtendedTestCase):
         common.post(
             url='a', headers={'c': 'd'}, data={'e': 'f'}, random='thing'))
 
-    self.assertTrue(os.path.exists(common.CLUSTERFUZZ_TESTCASES_DIR))
-    self.assertEqual(1, self.mock.CachedSession.call_count)
+    self.assertEqual(1, self.mock.Session.call_count)
     self.assertEqual(1, self.http.mount.call_count)
     self.http.post.assert_called_once_with(
         url='a', headers={'c': 'd'}, data={'e': 'f'}, random='thing')
 
   def test_retry(self):
-    """Test retrying."""
+    """Test retrying with the same session."""
     self.http.post.side_effect = (
         [exceptions.ConnectionError()] * common.RETRY_COUNT +
         ['Something'])
@@ -750,9 +920,8 @@ class PostTest(helpers.ExtendedTestCase):
         common.post(
             url='a', headers={'c': 'd'}, data={'e': 'f'}, random='thing'))
 
-    self.assertTrue(os.path.exists(common.CLUSTERFUZZ_TESTCASES_DIR))
-    self.assertEqual(common.RETRY_COUNT + 1, self.mock.CachedSession.call_count)
-    self.assertEqual(common.RETRY_COUNT + 1, self.http.mount.call_count)
+    self.assertEqual(1, self.mock.Session.call_count)
+    self.assertEqual(1, self.http.mount.call_count)
     self.assert_exact_calls(
         self.http.post,
         [
@@ -770,9 +939,8 @@ class PostTest(helpers.ExtendedTestCase):
       common.post(
           url='a', headers={'c': 'd'}, data={'e': 'f'}, random='thing')
 
-    self.assertTrue(os.path.exists(common.CLUSTERFUZZ_TESTCASES_DIR))
-    self.assertEqual(common.RETRY_COUNT + 1, self.mock.CachedSession.call_count)
-    self.assertEqual(common.RETRY_COUNT + 1, self.http.mount.call_count)
+    self.assertEqual(1, self.mock.Session.call_count)
+    self.assertEqual(1, self.http.mount.call_count)
     self.assert_exact_calls(
         self.http.post,
         [
@@ -782,6 +950,57 @@ class PostTest(helpers.ExtendedTestCase):
     )
 
 
+class HttpSessionManagerTest(helpers.ExtendedTestCase):
+  """Test HttpSessionManager."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['requests.Session'])
+    self.mock.Session.side_effect = lambda *_: mock.MagicMock()
+    self.manager = common.HttpSessionManager()
+
+  def test_lifecycle(self):
+    """Test sharing the session until it's closed."""
+    session = self.manager.get()
+    self.assertIs(session, self.manager.get())
+    self.assertEqual(1, self.mock.Session.call_count)
+    session.mount.assert_called_once_with('https://', self.manager.adapter)
+    # pylint: disable=protected-access
+    self.assertEqual(common.HTTP_POOL_SIZE, self.manager.adapter._pool_maxsize)
+    # pylint: enable=protected-access
+    session.hooks['response'].append.assert_called_once_with(
+        self.manager.record_response)
+
+    self.manager.close()
+    session.close.assert_called_once_with()
+    self.assertIsNot(session, self.manager.get())
+
+  def test_threads(self):
+    """Test creating a single session for concurrent callers."""
+    sessions = []
+    threads = [
+        threading.Thread(target=lambda: sessions.append(self.manager.get()))
+        for _ in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(1, self.mock.Session.call_count)
+    self.assertEqual(1, len(set(id(session) for session in sessions)))
+
+  def test_stats(self):
+    """Test counting the requests and the cache hits."""
+    self.manager.get()
+    self.manager.record_response(mock.Mock())
+    self.manager.record_response(mock.Mock())
+    self.manager.record_cache_hit()
+
+    self.assertEqual(
+        {'requests': 2, 'cache_hits': 1, 'connections': 0},
+        self.manager.get_stats())
+
+
 class EnsureImportantDirsTest(helpers.ExtendedTestCase):
   """Tests ensure_important_dirs."""
 
@@ -0,0 +1,72 @@
+"""Test the disk_cache module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from clusterfuzz import common
+from clusterfuzz import disk_cache
+from test_libs import helpers
+
+
+class GetKeyTest(helpers.ExtendedTestCase):
+  """Test get_key."""
+
+  def test_get_key(self):
+    """Test the key depends on all parts."""
+    self.assertEqual(
+        disk_cache.get_key('a', {'b': 1}), disk_cache.get_key('a', {'b': 1}))
+    self.assertNotEqual(
+        disk_cache.get_key('a', 'b'), disk_cache.get_key('a', 'c'))
+
+
+class DiskCacheTest(helpers.ExtendedTestCase):
+  """Test DiskCache."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.cache = disk_cache.DiskCache('test', 30)
+
+  def test_get_missing(self):
+    """Test getting a key that isn't cached."""
+    self.assertIsNone(self.cache.get('missing'))
+
+  def test_set_and_get(self):
+    """Test storing and reading a value."""
+    self.cache.set('key', {'a': ['b']})
+
+    self.assertEqual({'a': ['b']}, self.cache.get('key'))
+    self.assertEqual(
+        os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'test', 'key'),
+        self.cache.get_path('key'))
+    self.assertEqual(['key'], os.listdir(self.cache.dir_path))
+
+  def test_corrupted(self):
+    """Test reading a corrupted entry."""
+    self.fs.CreateFile(self.cache.get_path('key'), contents='{')
+    self.assertIsNone(self.cache.get('key'))
+
+  def test_evict_least_recently_used(self):
+    """Test evicting the least recently used entries."""
+    self.cache.set('a', '1234567890')
+    self.cache.set('b', '1234567890')
+    os.utime(self.cache.get_path('a'), (1, 1))
+    os.utime(self.cache.get_path('b'), (2, 2))
+    self.cache.get('a')
+
+    self.cache.set('c', '1234567890')
+
+    self.assertIsNone(self.cache.get('b'))
+    self.assertEqual('1234567890', self.cache.get('a'))
+    self.assertEqual('1234567890', self.cache.get('c'))
@@ -0,0 +1,192 @@
+"""Test the http_cache module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import requests
+
+from clusterfuzz import http_cache
+from test_libs import helpers
+
+
+PARSE_URL = 'https://clusterfuzz.com/parse_stacktrace'
+REFRESH_URL = 'https://clusterfuzz.com/testcase-detail/refresh'
+OTHER_URL = 'https://clusterfuzz.com/other'
+
+
+def make_response(status_code, content, headers=None):
+  """Make a response."""
+  response = requests.Response()
+  response.status_code = status_code
+  response._content = content  # pylint: disable=protected-access
+  response.headers.update(headers or {})
+  return response
+
+
+class GetPolicyTest(helpers.ExtendedTestCase):
+  """Test get_policy."""
+
+  def test_policies(self):
+    """Test the policy of each endpoint."""
+    self.assertEqual(
+        http_cache.IMMUTABLE, http_cache.get_policy(PARSE_URL).kind)
+    self.assertEqual(http_cache.TTL, http_cache.get_policy(REFRESH_URL).kind)
+    self.assertEqual(http_cache.NEVER, http_cache.get_policy(OTHER_URL).kind)
+    self.assertEqual(
+        http_cache.NEVER, http_cache.get_policy(PARSE_URL + '/more').kind)
+
+
+class GetKeyTest(helpers.ExtendedTestCase):
+  """Test get_key."""
+
+  def test_normalize_json(self):
+    """Test the same JSON with a different format has the same key."""
+    self.assertEqual(
+        http_cache.get_key('POST', PARSE_URL, '{"a": 1, "b": 2}'),
+        http_cache.get_key('POST', PARSE_URL, '{"b":2,"a":1}'))
+    self.assertNotEqual(
+        http_cache.get_key('POST', PARSE_URL, '{"a": 1}'),
+        http_cache.get_key('POST', PARSE_URL, '{"a": 2}'))
+    self.assertNotEqual(
+        http_cache.get_key('POST', PARSE_URL, '{"a": 1}'),
+        http_cache.get_key('POST', REFRESH_URL, '{"a": 1}'))
+
+  def test_not_json(self):
+    """Test bodies that aren't JSON."""
+    self.assertEqual(
+        http_cache.get_key('POST', PARSE_URL, 'abc'),
+        http_cache.get_key('POST', PARSE_URL, 'abc'))
+    self.assertNotEqual(
+        http_cache.get_key('POST', PARSE_URL, 'abc'),
+        http_cache.get_key('POST', PARSE_URL, None))
+
+
+class PostTest(helpers.ExtendedTestCase):
+  """Test post."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.common.HttpSessionManager.record_cache_hit',
+        'clusterfuzz.common.post',
+        'time.time',
+    ])
+    self.mock.time.return_value = 1000
+    self.mock.post.side_effect = lambda url, **kwargs: make_response(
+        200, '{"crash_type": "%s"}' % url,
+        {'Content-Type': 'application/json',
+         'x-clusterfuzz-authorization': 'Bearer token'})
+
+  def test_immutable(self):
+    """Test reusing the response regardless of the auth header."""
+    response = http_cache.post(
+        url=PARSE_URL, data='{"job": "a"}', headers={'Authorization': '1'})
+    self.assertFalse(getattr(response, 'from_cache', False))
+
+    self.mock.time.return_value = 1000000
+    response = http_cache.post(
+        url=PARSE_URL, data='{ "job":"a" }', headers={'Authorization': '2'})
+
+    self.assertEqual(1, self.mock.post.call_count)
+    self.assertEqual(1, self.mock.record_cache_hit.call_count)
+    self.assertTrue(response.from_cache)
+    self.assertEqual(200, response.status_code)
+    self.assertEqual({'crash_type': PARSE_URL}, json.loads(response.text))
+    self.assertEqual('application/json', response.headers['content-type'])
+    self.assertNotIn('x-clusterfuzz-authorization', response.headers)
+
+  def test_binary(self):
+    """Test caching a body that isn't UTF-8."""
+    self.mock.post.side_effect = None
+    self.mock.post.return_value = make_response(
+        200, '\xff\xfe', {'Content-Type': 'text/plain; charset=latin-1'})
+    http_cache.post(url=PARSE_URL, data='a')
+
+    response = http_cache.post(url=PARSE_URL, data='a')
+
+    self.assertEqual(1, self.mock.post.call_count)
+    self.assertEqual('\xff\xfe', response.content)
+    self.assertEqual(u'\xff\xfe', response.text)
+
+  def test_ttl(self):
+    """Test refetching the response after its TTL."""
+    http_cache.post(url=REFRESH_URL, data='{"testcaseId": 1}')
+    self.mock.time.return_value = 1000 + http_cache.get_policy(REFRESH_URL).ttl
+    self.assertTrue(
+        http_cache.post(url=REFRESH_URL, data='{"testcaseId": 1}').from_cache)
+
+    self.mock.time.return_value += 1
+    http_cache.post(url=REFRESH_URL, data='{"testcaseId": 1}')
+    self.assertEqual(2, self.mock.post.call_count)
+
+  def test_never(self):
+    """Test not caching an endpoint without a policy."""
+    http_cache.post(url=OTHER_URL, data='a')
+    http_cache.post(url=OTHER_URL, data='a')
+
+    self.assertEqual(2, self.mock.post.call_count)
+    self.assertEqual([], http_cache.CACHE.get_entries())
+
+  def test_error(self):
+    """Test not caching an error."""
+    self.mock.post.side_effect = None
+    self.mock.post.return_value = make_response(500, 'error')
+    http_cache.post(url=PARSE_URL, data='a')
+    http_cache.post(url=PARSE_URL, data='a')
+
+    self.assertEqual(2, self.mock.post.call_count)
+    self.assertEqual([], http_cache.CACHE.get_entries())
+
+
+class PruneTest(helpers.ExtendedTestCase):
+  """Test get_stats and prune."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 1000
+    for key, url in [('a', PARSE_URL), ('b', REFRESH_URL),
+                     ('c', REFRESH_URL), ('d', OTHER_URL)]:
+      http_cache.CACHE.set(
+          key, http_cache.to_entry(url, make_response(200, 'content')))
+    self.mock.time.return_value = 2000
+    http_cache.CACHE.set(
+        'c', http_cache.to_entry(REFRESH_URL, make_response(200, 'content')))
+    self.fs.CreateFile(http_cache.CACHE.get_path('e'), contents='{')
+    self.fs.CreateFile(http_cache.LEGACY_CACHE_PATH, contents='sqlite')
+    self.mock.time.return_value = (
+        1000 + http_cache.get_policy(REFRESH_URL).ttl + 1)
+
+  def test_stats(self):
+    """Test counting the entries of each URL."""
+    stats = http_cache.get_stats()
+
+    self.assertEqual(
+        set([PARSE_URL, REFRESH_URL, OTHER_URL, None]), set(stats.keys()))
+    self.assertEqual(1, stats[PARSE_URL]['entries'])
+    self.assertEqual(0, stats[PARSE_URL]['expired'])
+    self.assertEqual(2, stats[REFRESH_URL]['entries'])
+    self.assertEqual(1, stats[REFRESH_URL]['expired'])
+    self.assertEqual(1, stats[OTHER_URL]['expired'])
+    self.assertEqual({'entries': 1, 'bytes': 1, 'expired': 1}, stats[None])
+
+  def test_prune(self):
+    """Test deleting the expired, unreadable and uncacheable entries."""
+    self.assertEqual(3, http_cache.prune())
+
+    self.assertEqual(
+        ['a', 'c'], sorted(os.listdir(http_cache.CACHE.dir_path)))
+    self.assertFalse(os.path.exists(http_cache.LEGACY_CACHE_PATH))
@@ -30,3 +30,39 @@ class StartLoggersTest(helpers.ExtendedTestCase):
     self.mock.getLogger.assert_called_once_with('clusterfuzz')
     self.assertTrue(os.path.exists(local_logging.LOG_DIR))
     self.mock.doRollover.assert_called_once_with(rotating_handler)
+
+
+class SendOutputTest(helpers.ExtendedTestCase):
+  """Test send_output and flush_output."""
+
+  def setUp(self):
+    self.lines = []
+    self.logger = mock.Mock()
+    self.logger.debug = self.lines.append
+    patcher = mock.patch.object(local_logging, 'logger', self.logger)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    local_logging.current_chunk = []
+
+  def test_send_output(self):
+    """Test complete lines are logged together and the rest waits."""
+    local_logging.send_output('a')
+    local_logging.send_output('')
+    local_logging.send_output('b\nc\n\nd')
+    local_logging.send_output('e\n')
+    local_logging.send_output('f')
+    self.assertEqual(['ab\nc\n', 'de'], self.lines)
+
+    local_logging.flush_output()
+    local_logging.flush_output()
+    self.assertEqual(['ab\nc\n', 'de', 'f'], self.lines)
+
+  def test_one_write_per_chunk(self):
+    """Test a chunk of many lines is written to the handler once."""
+    for _ in range(3):
+      local_logging.send_output('[1/2] CXX obj/chrome/a.o\n' * 2500)
+
+    self.assertEqual(3, len(self.lines))
+    self.assertEqual(
+        '[1/2] CXX obj/chrome/a.o\n' * 2499 + '[1/2] CXX obj/chrome/a.o',
+        self.lines[0])
@@ -26,6 +26,8 @@ class MainTest(unittest.TestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.execute',
+        ('batch_execute', 'clusterfuzz.commands.reproduce_batch.execute'),
+        ('cache_execute', 'clusterfuzz.commands.cache.execute'),
         'clusterfuzz.local_logging.start_loggers'
     ])
 
@@ -36,7 +38,7 @@ class MainTest(unittest.TestCase):
         ['reproduce', '1234', '--build', 'chromium', '--disable-xvfb', '-j',
          '25', '--current', '--disable-goma', '-i', '500', '--target-args',
          '--test --test2', '--edit-mode', '--skip-deps', '--enable-debug',
-         '-l', '20'])
+         '-l', '20', '--parallel-iterations', '8'])
 
     self.mock.start_loggers.assert_has_calls([mock.call()])
     self.mock.execute.assert_has_calls([
@@ -44,10 +46,27 @@ class MainTest(unittest.TestCase):
                   goma_threads=None, testcase_id='1234', iterations=3,
                   disable_xvfb=False, target_args='', edit_mode=False,
                   skip_deps=False, enable_debug=False, goma_load=None,
-                  force=False),
+                  force=False, parallel_iterations=1),
         mock.call(build='chromium', current=True, disable_goma=True,
                   goma_threads=25, testcase_id='1234', iterations=500,
                   disable_xvfb=True, target_args='--test --test2',
                   edit_mode=True, skip_deps=True, enable_debug=True,
-                  goma_load=20, force=False),
+                  goma_load=20, force=False, parallel_iterations=8),
     ])
+
+  def test_parse_reproduce_batch(self):
+    """Test parse reproduce_batch command."""
+    main.execute(['reproduce_batch', '1234', '5678', '-b', 'download'])
+
+    self.mock.batch_execute.assert_called_once_with(
+        build='download', current=False, disable_goma=False,
+        goma_threads=None, testcase_ids=['1234', '5678'], iterations=3,
+        disable_xvfb=False, target_args='', edit_mode=False, skip_deps=False,
+        enable_debug=False, goma_load=None, force=False,
+        parallel_iterations=1)
+
+  def test_parse_cache(self):
+    """Test parse cache command."""
+    main.execute(['cache', 'prune'])
+
+    self.mock.cache_execute.assert_called_once_with(action='prune')
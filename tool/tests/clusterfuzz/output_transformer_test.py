@@ -41,6 +41,10 @@ class IdentityTest(helpers.ExtendedTestCase):
 class NinjaTest(helpers.ExtendedTestCase):
   """Test Ninja."""
 
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 0
+
   def test_long_chunk(self):
     """Test long chunk."""
     self._test_print(33)
@@ -75,3 +79,40 @@ class NinjaTest(helpers.ExtendedTestCase):
          '[4/100] ddd\n'),
         self.output.getvalue())
     self.output.close()
+
+
+class NinjaProgressTest(helpers.ExtendedTestCase):
+  """Test the progress that Ninja records."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
+    self.output = StringIO.StringIO()
+    self.transformer = output_transformer.Ninja()
+    self.transformer.set_output(self.output)
+
+  def test_no_status(self):
+    """Test the progress is unknown before the first status line."""
+    self.transformer.process('ninja: Entering directory\n')
+    self.assertIsNone(self.transformer.get_eta_seconds())
+    self.assertEqual(
+        {'finished_edges': 0, 'total_edges': 0, 'elapsed_seconds': 0,
+         'edges_per_second': None},
+        self.transformer.get_summary())
+
+  def test_progress(self):
+    """Test edges per second and the ETA."""
+    self.mock.time.return_value = 110
+    self.transformer.process('[20/100] aaa\n')
+    self.mock.time.return_value = 120
+    self.transformer.process('[40/100] bbb\n')
+    self.transformer.flush()
+
+    self.assertEqual(2, self.transformer.get_edges_per_second())
+    self.assertEqual(30, self.transformer.get_eta_seconds())
+    self.assertEqual(
+        {'finished_edges': 40, 'total_edges': 100, 'elapsed_seconds': 20,
+         'edges_per_second': 2},
+        self.transformer.get_summary())
+    self.assertIn('[20/100] aaa (ETA 0m40s)', self.output.getvalue())
+    self.assertIn('[40/100] bbb (ETA 0m30s)', self.output.getvalue())
@@ -15,10 +15,11 @@
 
 import os
 import json
+import socket
+import threading
 import mock
 
 from clusterfuzz import common
-from clusterfuzz import output_transformer
 from clusterfuzz import reproducers
 from error import error
 from tests import libs
@@ -220,19 +221,25 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
         libs.make_options(target_args='--test'))
     reproducer.setup_args()
     reproducer.reproduce_crash()
-    self.assert_exact_calls(self.mock.execute, [
+    self.assert_exact_calls(self.mock.start_execute, [
         mock.call(
             '/chrome/source/folder/d8',
             '--repro --test %s' % self.testcase_path,
             '/chrome/source/folder',
             env={'ASAN_OPTIONS': 'test-asan'},
+            stdin=self.mock.UserStdin.return_value,
+            redirect_stderr_to_stdout=True)
+    ])
+    self.assert_exact_calls(self.mock.wait_execute, [
+        mock.call(
+            self.mock.start_execute.return_value,
             exit_on_error=False,
             timeout=30,
             stdout_transformer=mock.ANY,
-            redirect_stderr_to_stdout=True,
-            stdin=self.mock.UserStdin.return_value,
-            read_buffer_length=1)
+            print_output=True)
     ])
+    self.assertEqual(
+        self.mock.start_execute.return_value, reproducer.process)
 
   def test_base_with_env_args(self):
     """Test base's reproduce_crash with environment args."""
@@ -260,20 +267,26 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
         libs.make_options(target_args='--test'))
     reproducer.setup_args()
     reproducer.reproduce_crash()
-    self.assert_exact_calls(self.mock.execute, [
+    self.assert_exact_calls(self.mock.start_execute, [
         mock.call(
             '/chrome/source/folder/d8',
             '--app-dir=%s --testcase=%s --test' %
             (self.app_directory, self.testcase_path),
             '/chrome/source/folder',
             env={'ASAN_OPTIONS': 'test-asan'},
+            stdin=self.mock.UserStdin.return_value,
+            redirect_stderr_to_stdout=True)
+    ])
+    self.assert_exact_calls(self.mock.wait_execute, [
+        mock.call(
+            self.mock.start_execute.return_value,
             exit_on_error=False,
             timeout=30,
             stdout_transformer=mock.ANY,
-            redirect_stderr_to_stdout=True,
-            stdin=self.mock.UserStdin.return_value,
-            read_buffer_length=1)
+            print_output=True)
     ])
+    self.assertEqual(
+        self.mock.start_execute.return_value, reproducer.process)
 
   def test_chromium(self):
     """Test chromium's reproduce_crash."""
@@ -324,11 +337,45 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             exit_on_error=False,
             timeout=30,
             stdout_transformer=mock.ANY,
-            read_buffer_length=1)
+            print_output=True)
     ])
     self.assert_exact_calls(self.mock.run_gestures, [
         mock.call(reproducer, self.mock.start_execute.return_value, ':display')
     ])
+    self.mock.symbolize.assert_called_once_with('lines', print_output=True)
+
+
+class StartProcessTest(helpers.ExtendedTestCase):
+  """Tests the start_process method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.start_execute',
+        'clusterfuzz.common.UserStdin',
+        'clusterfuzz.reproducers.kill_quietly',
+    ])
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+
+  def test_start(self):
+    """Test starting the process."""
+    self.reproducer.stop_event = threading.Event()
+
+    self.assertEqual(
+        self.mock.start_execute.return_value,
+        self.reproducer.start_process())
+    self.assertEqual(
+        self.mock.start_execute.return_value, self.reproducer.process)
+    self.assertEqual(0, self.mock.kill_quietly.call_count)
+
+  def test_stopped(self):
+    """Test killing the process if the reproduction has been stopped."""
+    self.reproducer.stop_event = threading.Event()
+    self.reproducer.stop_event.set()
+
+    self.reproducer.start_process()
+
+    self.mock.kill_quietly.assert_called_once_with(
+        self.mock.start_execute.return_value)
 
 
 class SetupArgsTest(helpers.ExtendedTestCase):
@@ -467,7 +514,7 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.get_process_ids',
-        'clusterfuzz.common.execute', 'time.sleep'
+        'clusterfuzz.common.execute'
     ])
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
 
@@ -476,7 +523,8 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
 
     self.mock.get_process_ids.return_value = []
 
-    self.reproducer.find_windows_for_process(1234, ':45434')
+    result = self.reproducer.find_windows_for_process(1234, ':45434')
+    self.assertEqual(result, set())
     self.assert_n_calls(0, [self.mock.execute])
 
   def test_dedup_pids(self):
@@ -488,7 +536,52 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
 
     result = self.reproducer.find_windows_for_process(1234, ':45434')
     self.assertEqual(result, set(['234', '567', '890', '123', '345']))
-    self.assert_exact_calls(self.mock.sleep, [mock.call(30)])
+
+
+class WaitForWindowsTest(helpers.ExtendedTestCase):
+  """Tests the wait_for_windows method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        ('clusterfuzz.reproducers.LinuxChromeJobReproducer.find_windows_for'
+         '_process'), 'time.sleep', 'time.time'
+    ])
+    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
+    self.proc = mock.Mock(pid=1234)
+    self.proc.poll.return_value = None
+
+  def test_settled(self):
+    """Tests returning once no new window appears."""
+    self.mock.time.side_effect = [0, 0, 0.5, 1, 2, 3.5]
+    self.mock.find_windows_for_process.side_effect = [
+        set(), set(['1']), set(['1', '2']), set(['1', '2'])
+    ]
+
+    windows = self.reproducer.wait_for_windows(self.proc, ':display')
+
+    self.assertEqual(windows, set(['1', '2']))
+    self.assert_n_calls(4, [self.mock.find_windows_for_process])
+    self.assert_exact_calls(self.mock.sleep, [mock.call(0.2)] * 3)
+
+  def test_timeout(self):
+    """Tests giving up after WINDOW_WAIT_TIMEOUT seconds."""
+    self.mock.time.side_effect = [0, 0, 10, 30]
+    self.mock.find_windows_for_process.return_value = set()
+
+    windows = self.reproducer.wait_for_windows(self.proc, ':display')
+
+    self.assertEqual(windows, set())
+    self.assert_n_calls(1, [self.mock.find_windows_for_process])
+
+  def test_process_exited(self):
+    """Tests returning when the process exits."""
+    self.mock.time.side_effect = [0, 0]
+    self.proc.poll.return_value = 1
+
+    windows = self.reproducer.wait_for_windows(self.proc, ':display')
+
+    self.assertEqual(windows, set())
+    self.assert_n_calls(0, [self.mock.find_windows_for_process])
 
 
 class GetProcessIdsTest(helpers.ExtendedTestCase):
@@ -536,17 +629,16 @@ class RunGesturesTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, [
-        'time.sleep',
+        'time.sleep', 'time.time',
         ('clusterfuzz.reproducers.LinuxChromeJobReproducer.get_gesture_start_'
          'time'),
-        ('clusterfuzz.reproducers.LinuxChromeJobReproducer.find_windows_for'
-         '_process'),
+        'clusterfuzz.reproducers.LinuxChromeJobReproducer.wait_for_windows',
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.xdotool_command',
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.execute_gesture'
     ])
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
     self.mock.get_gesture_start_time.return_value = 5
-    self.mock.find_windows_for_process.return_value = ['123']
+    self.mock.wait_for_windows.return_value = set(['123'])
     self.reproducer.gestures = [
         'windowsize,2', 'type,\'ValeM1khbW4Gt!\'', 'Trigger:2'
     ]
@@ -554,13 +646,26 @@ class RunGesturesTest(helpers.ExtendedTestCase):
 
   def test_execute_gestures(self):
     """Tests executing the gestures."""
+    self.mock.time.side_effect = [100, 102]
+    proc = mock.Mock(pid=1234)
 
-    self.reproducer.run_gestures(mock.Mock(pid=1234), ':display')
+    self.reproducer.run_gestures(proc, ':display')
 
+    self.assert_exact_calls(self.mock.wait_for_windows,
+                            [mock.call(self.reproducer, proc, ':display')])
     self.assert_exact_calls(
         self.mock.xdotool_command,
         [mock.call(self.reproducer, 'windowactivate --sync 123', ':display')])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(5)])
+    self.assert_exact_calls(self.mock.sleep, [mock.call(3)])
+
+  def test_windows_appear_late(self):
+    """Tests not sleeping when the windows appear after the start time."""
+    self.mock.time.side_effect = [100, 108]
+
+    self.reproducer.run_gestures(mock.Mock(pid=1234), ':display')
+
+    self.assert_n_calls(0, [self.mock.sleep])
+    self.assert_n_calls(1, [self.mock.xdotool_command])
 
 
 class GetGestureStartTimeTest(helpers.ExtendedTestCase):
@@ -604,83 +709,210 @@ class ExecuteGestureTest(helpers.ExtendedTestCase):
     ])
 
 
-class XvfbTest(helpers.ExtendedTestCase):
-  """Used to test the Xvfb context manager."""
+class IsXServerReadyTest(helpers.ExtendedTestCase):
+  """Tests is_x_server_ready."""
 
   def setUp(self):
-    helpers.patch(self, ['xvfbwrapper.Xvfb', 'subprocess.Popen', 'time.sleep'])
+    # socket.socket cannot be autospec'ed.
+    patcher = mock.patch('socket.socket')
+    self.sock = patcher.start().return_value
+    self.addCleanup(patcher.stop)
 
-  def test_correct_oserror_exception(self):
-    """Ensures the correct exception is raised when Xvfb is not found."""
+  def test_ready(self):
+    """Test connecting to the X socket."""
+    self.assertTrue(reproducers.is_x_server_ready(':12'))
+    self.sock.connect.assert_called_once_with('/tmp/.X11-unix/X12')
+    self.sock.close.assert_called_once_with()
+
+  def test_not_ready(self):
+    """Test the X socket refusing connections."""
+    self.sock.connect.side_effect = socket.error
+    self.assertFalse(reproducers.is_x_server_ready(':12'))
+    self.sock.close.assert_called_once_with()
+
+
+class IsWindowManagerReadyTest(helpers.ExtendedTestCase):
+  """Tests is_window_manager_ready."""
+
+  def setUp(self):
+    helpers.patch(self, ['subprocess.call'])
+
+  def test_ready(self):
+    """Test blackbox has set the current desktop."""
+    self.mock.call.return_value = 0
+    self.assertTrue(reproducers.is_window_manager_ready(':12'))
+    self.assertEqual(
+        (['xdotool', 'get_desktop'],), self.mock.call.call_args[0])
+    self.assertEqual({'DISPLAY': ':12'}, self.mock.call.call_args[1]['env'])
 
-    def _raise_with_message(*_unused, **_kwunused):
-      del _unused, _kwunused  #Not used by this method
-      raise OSError('[Errno 2] No such file or directory')
+  def test_not_ready(self):
+    """Test blackbox isn't running yet."""
+    self.mock.call.return_value = 1
+    self.assertFalse(reproducers.is_window_manager_ready(':12'))
 
-    self.mock.Popen.side_effect = _raise_with_message
+  def test_no_xdotool(self):
+    """Test not waiting when xdotool isn't installed."""
+    self.mock.call.side_effect = OSError
+    self.assertTrue(reproducers.is_window_manager_ready(':12'))
+
+
+class WaitUntilTest(helpers.ExtendedTestCase):
+  """Tests wait_until."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.sleep', 'time.time'])
+    self.mock.time.side_effect = [100, 100, 101, 102]
+    self.condition = mock.Mock()
+
+  def test_true(self):
+    """Test returning as soon as the condition is true."""
+    self.condition.side_effect = [False, True]
+    self.assertTrue(reproducers.wait_until(self.condition, 2))
+    self.assert_exact_calls(
+        self.mock.sleep, [mock.call(reproducers.DISPLAY_POLL_INTERVAL)])
+
+  def test_timeout(self):
+    """Test giving up after the timeout."""
+    self.condition.return_value = False
+    self.assertFalse(reproducers.wait_until(self.condition, 2))
+    self.assertEqual(2, self.mock.sleep.call_count)
+
+
+class DisplayTest(helpers.ExtendedTestCase):
+  """Tests Display."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.reproducers.wait_until',
+        'subprocess.Popen',
+        'xvfbwrapper.Xvfb',
+    ])
     self.mock.Xvfb.return_value = mock.Mock(
         xvfb_cmd=['not_display', ':display'])
 
+  def test_correct_oserror_exception(self):
+    """Ensures the correct exception is raised when blackbox is not found."""
+    self.mock.Popen.side_effect = OSError('[Errno 2] No such file or directory')
+
     with self.assertRaises(error.NotInstalledError):
-      with reproducers.Xvfb(False) as display_name:
-        self.assertNotEqual(display_name, ':display')
+      reproducers.Display()
 
-    self.assert_n_calls(0, [
-        self.mock.Popen.return_value.kill, self.mock.sleep,
-        self.mock.Xvfb.return_value.stop
-    ])
+    self.mock.Xvfb.return_value.stop.assert_called_once_with()
+    self.assertEqual(0, self.mock.wait_until.call_count)
 
   def test_incorrect_oserror_exception(self):
     """Ensures OSError raises when message is not Errno 2."""
-
     self.mock.Popen.side_effect = OSError
-    self.mock.Xvfb.return_value = mock.Mock(
-        xvfb_cmd=['not_display', ':display'])
 
     with self.assertRaises(OSError):
-      with reproducers.Xvfb(False) as display_name:
-        self.assertNotEqual(display_name, ':display')
+      reproducers.Display()
 
-    self.assert_n_calls(0, [
-        self.mock.Popen.return_value.kill, self.mock.sleep,
-        self.mock.Xvfb.return_value.stop
-    ])
+    self.mock.Xvfb.return_value.stop.assert_called_once_with()
 
-  def test_start_stop_blackbox(self):
-    """Tests that the context manager starts/stops xvfbwrapper and blackbox."""
-
-    self.mock.Xvfb.return_value = mock.Mock(
-        xvfb_cmd=['not_display', ':display'])
-
-    with reproducers.Xvfb(False) as display_name:
-      self.assertEqual(display_name, ':display')
+  def test_start_stop(self):
+    """Tests starting Xvfb and blackbox, and waiting until they're ready."""
+    self.mock.wait_until.return_value = True
+    display = reproducers.Display()
 
+    self.assertEqual(':display', display.name)
     self.assert_exact_calls(self.mock.Xvfb,
                             [mock.call(width=1280, height=1024)])
     self.assert_exact_calls(self.mock.Xvfb.return_value.start, [mock.call()])
-    self.assert_exact_calls(self.mock.Xvfb.return_value.stop,
-                            [mock.call.stop()])
     self.assert_exact_calls(
         self.mock.Popen, [mock.call(['blackbox'], env={
             'DISPLAY': ':display'
         })])
+    self.assertEqual(2, self.mock.wait_until.call_count)
+
+    display.stop()
     self.assert_exact_calls(self.mock.Popen.return_value.kill, [mock.call()])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(3)])
+    self.assert_exact_calls(self.mock.Xvfb.return_value.stop, [mock.call()])
 
-  def test_no_blackbox(self):
-    """Tests that the manager doesnt start blackbox when disabled."""
+  def test_is_alive(self):
+    """Tests a display dies with either Xvfb or blackbox."""
+    display = reproducers.Display()
+    self.mock.Xvfb.return_value.proc.poll.return_value = None
+    self.mock.Popen.return_value.poll.return_value = None
+    self.assertTrue(display.is_alive())
 
-    self.mock.Xvfb.return_value = mock.Mock(
-        xvfb_cmd=['not_display', ':display'])
+    self.mock.Popen.return_value.poll.return_value = 0
+    self.assertFalse(display.is_alive())
+
+
+class DisplayPoolTest(helpers.ExtendedTestCase):
+  """Tests DisplayPool."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.reproducers.Display'])
+    self.mock.Display.side_effect = (
+        lambda: mock.Mock(uses=0, **{'is_alive.return_value': True}))
+    self.pool = reproducers.DisplayPool()
+
+  def test_reuse(self):
+    """Test a released display is handed out again."""
+    display = self.pool.acquire()
+    other_display = self.pool.acquire()
+    self.assertIsNot(display, other_display)
+
+    self.pool.release(display)
+    self.assertIs(display, self.pool.acquire())
+    self.assertEqual(2, self.mock.Display.call_count)
+    self.assertEqual(0, display.stop.call_count)
+
+  def test_recycle(self):
+    """Test a display is stopped after MAX_DISPLAY_USES iterations."""
+    display = self.pool.acquire()
+    for _ in xrange(reproducers.MAX_DISPLAY_USES - 1):
+      self.pool.release(display)
+      self.assertIs(display, self.pool.acquire())
+
+    self.pool.release(display)
+    display.stop.assert_called_once_with()
+    self.assertIsNot(display, self.pool.acquire())
+
+  def test_dead(self):
+    """Test a dead display isn't handed out."""
+    display = self.pool.acquire()
+    self.pool.release(display)
+    display.is_alive.return_value = False
+
+    self.assertIsNot(display, self.pool.acquire())
+    display.stop.assert_called_once_with()
+
+  def test_stop(self):
+    """Test stopping the idle displays."""
+    display = self.pool.acquire()
+    self.pool.release(display)
+    self.pool.stop()
+
+    display.stop.assert_called_once_with()
+    self.assertEqual([], self.pool.idle_displays)
 
+
+class XvfbTest(helpers.ExtendedTestCase):
+  """Used to test the Xvfb context manager."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.reproducers.get_display_pool'])
+    self.pool = self.mock.get_display_pool.return_value
+    self.pool.acquire.return_value = mock.Mock()
+    self.pool.acquire.return_value.name = ':display'
+
+  def test_acquire_release(self):
+    """Tests that the context manager borrows a display from the pool."""
+    with reproducers.Xvfb(False) as display_name:
+      self.assertEqual(display_name, ':display')
+      self.assertEqual(0, self.pool.release.call_count)
+
+    self.pool.acquire.assert_called_once_with()
+    self.pool.release.assert_called_once_with(self.pool.acquire.return_value)
+
+  def test_no_blackbox(self):
+    """Tests that the manager doesnt start blackbox when disabled."""
     with reproducers.Xvfb(True) as display_name:
       self.assertEqual(display_name, None)
 
-    self.assert_n_calls(0, [
-        self.mock.Xvfb, self.mock.Xvfb.return_value.start,
-        self.mock.Xvfb.return_value.stop, self.mock.Popen,
-        self.mock.Popen.return_value.kill, self.mock.sleep
-    ])
+    self.assertEqual(0, self.mock.get_display_pool.call_count)
 
 
 class ReproduceTest(helpers.ExtendedTestCase):
@@ -762,6 +994,153 @@ class ReproduceNormalTest(helpers.ExtendedTestCase):
     ])
 
 
+class ReproduceParallelTest(helpers.ExtendedTestCase):
+  """Tests the reproduce_parallel method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.delete_if_exists',
+        'clusterfuzz.reproducers.get_crash_signature',
+        'clusterfuzz.reproducers.kill_quietly',
+        'tempfile.mkdtemp',
+    ])
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+    self.reproducer.options = libs.make_options(parallel_iterations=2)
+    self.reproducer.get_crash_signature = lambda: common.CrashSignature(
+        'original', ['state'])
+    self.mock.mkdtemp.return_value = '/tmp/iteration'
+    self.outputs = []
+
+    def reproduce_crash(clone):
+      """Record the clone's args and env."""
+      self.assertIsNotNone(clone.stop_event)
+      self.outputs.append((clone.args, clone.environment['TMPDIR']))
+      return 0, 'output'
+
+    patcher = mock.patch.object(
+        reproducers.BaseReproducer, 'reproduce_crash', autospec=True,
+        side_effect=reproduce_crash)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_reproduced(self):
+    """Test stopping once the signature matches."""
+    self.mock.get_crash_signature.return_value = common.CrashSignature(
+        'original', ['state'])
+
+    self.assertTrue(self.reproducer.reproduce_normal(1))
+    self.assertEqual(
+        [('--always-opt', '/tmp/iteration')], self.outputs)
+    self.mock.delete_if_exists.assert_called_once_with('/tmp/iteration')
+
+  def test_different_stacktrace(self):
+    """Test raising DifferentStacktraceError with all signatures."""
+    self.mock.get_crash_signature.return_value = common.CrashSignature(
+        'wrong type', ['incorrect'])
+
+    with self.assertRaises(error.DifferentStacktraceError) as cm:
+      self.reproducer.reproduce_normal(4)
+
+    self.assertEqual(4, len(self.outputs))
+    self.assertEqual(
+        [{'type': 'wrong type', 'state': ('incorrect',), 'output': 'output'}],
+        cm.exception.extras['signatures'])
+
+  def test_no_stacktrace(self):
+    """Test raising UnreproducibleError."""
+    self.mock.get_crash_signature.return_value = common.CrashSignature('', [])
+
+    with self.assertRaises(error.UnreproducibleError):
+      self.reproducer.reproduce_normal(3)
+    self.assertEqual(3, len(self.outputs))
+
+
+class CloneForIterationTest(helpers.ExtendedTestCase):
+  """Tests the clone_for_iteration method."""
+
+  def test_clone(self):
+    """Test the clone doesn't share state with the original."""
+    reproducer = create_reproducer(reproducers.BaseReproducer)
+    reproducer.args = '--a --user-data-dir=/tmp/clusterfuzz-user-data-dir'
+    reproducer.environment = {'ASAN_OPTIONS': 'a=b'}
+
+    clone = reproducer.clone_for_iteration('/tmp/1')
+
+    self.assertEqual(
+        '--a --user-data-dir=/tmp/1/user-data-dir', clone.args)
+    self.assertEqual(
+        {'ASAN_OPTIONS': 'a=b', 'TMPDIR': '/tmp/1'}, clone.environment)
+    self.assertEqual({'ASAN_OPTIONS': 'a=b'}, reproducer.environment)
+    self.assertFalse(clone.print_output)
+    self.assertTrue(reproducer.print_output)
+
+
+class IsolateUserDataDirTest(helpers.ExtendedTestCase):
+  """Tests isolate_user_data_dir."""
+
+  def test_no_user_data_dir(self):
+    """Test args without --user-data-dir."""
+    self.assertEqual('--a', reproducers.isolate_user_data_dir('--a', '/tmp/1'))
+
+  def test_replace(self):
+    """Test replacing --user-data-dir."""
+    self.assertEqual(
+        '--user-data-dir=/tmp/1 --a',
+        reproducers.isolate_user_data_dir('--user-data-dir=/old --a', '/tmp/1'))
+
+
+class KillQuietlyTest(helpers.ExtendedTestCase):
+  """Tests kill_quietly."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.kill'])
+
+  def test_exited(self):
+    """Test not killing an exited process."""
+    proc = mock.Mock()
+    proc.poll.return_value = 0
+    reproducers.kill_quietly(proc)
+    reproducers.kill_quietly(None)
+    self.assertEqual(0, self.mock.kill.call_count)
+
+  def test_kill(self):
+    """Test killing and ignoring the error."""
+    proc = mock.Mock()
+    proc.poll.return_value = None
+    self.mock.kill.side_effect = OSError()
+    reproducers.kill_quietly(proc)
+    self.mock.kill.assert_called_once_with(proc)
+
+
+class NormalizeStacktraceTest(helpers.ExtendedTestCase):
+  """Tests normalize_stacktrace."""
+
+  def test_normalize(self):
+    """Test removing pids and blank lines."""
+    self.assertEqual(
+        '==PID==ERROR\n#0 a',
+        reproducers.normalize_stacktrace('\n==123==ERROR  \n\n  #0 a\n'))
+
+
+class ParseCrashSignatureTest(helpers.ExtendedTestCase):
+  """Tests parse_crash_signature."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.http_cache.post',
+        'clusterfuzz.stack_analyzer.get_crash_signature',
+    ])
+
+  def test_local(self):
+    """Test parsing the stacktrace locally."""
+    signature = common.CrashSignature('type', ['state'])
+    self.mock.get_crash_signature.return_value = signature
+
+    self.assertEqual(
+        signature, reproducers.parse_crash_signature('job', 'stacktrace'))
+    self.assertEqual(0, self.mock.post.call_count)
+
+
 class ReproduceDebugTest(helpers.ExtendedTestCase):
   """Tests the reproduce_debug method."""
 
@@ -781,44 +1160,33 @@ class SymbolizeTest(helpers.ExtendedTestCase):
   """Tests the symbolize method."""
 
   def setUp(self):
-    self.setup_fake_filesystem()
-    helpers.patch(self, [
-        'clusterfuzz.common.execute',
-        'clusterfuzz.common.get_resource',
-        'clusterfuzz.common.StringStdin',
-    ])
-    self.mock.get_resource.return_value = 'asan_sym_proxy.py'
-    self.mock.execute.return_value = (0, 'symbolized')
+    helpers.patch(self, ['clusterfuzz.symbolizer.get_symbolizer'])
+    self.symbolizer = self.mock.get_symbolizer.return_value
+    self.symbolizer.symbolize.return_value = 'symbolized'
 
   def test_symbolize_no_output(self):
     """Test to ensure no symbolization is done with no output."""
-    result = reproducers.symbolize('', 'source')
+    result = reproducers.symbolize(' \n')
 
-    self.assert_exact_calls(self.mock.execute, [])
+    self.assertEqual(0, self.mock.get_symbolizer.call_count)
     self.assertEqual(result, '')
 
   def test_symbolize_output(self):
     """Test to ensure the correct symbolization call are made."""
-    result = reproducers.symbolize('output_lines', '/path/to/chromium')
-
-    self.mock.execute.assert_called_once_with(
-        '/path/to/chromium/tools/valgrind/asan/asan_symbolize.py',
-        '',
-        os.path.expanduser('~'),
-        env={
-            'LLVM_SYMBOLIZER_PATH': 'asan_sym_proxy.py',
-            'CHROMIUM_SRC': '/path/to/chromium'
-        },
-        stdout_transformer=mock.ANY,
-        capture_output=True,
-        exit_on_error=True,
-        stdin=self.mock.StringStdin.return_value,
-        redirect_stderr_to_stdout=True)
-    self.assertIsInstance(self.mock.execute.call_args[1]['stdout_transformer'],
-                          output_transformer.Identity)
-    self.mock.StringStdin.assert_called_once_with('output_lines\0')
+    result = reproducers.symbolize(' output_lines\n')
+
+    self.symbolizer.symbolize.assert_called_once_with('output_lines')
     self.assertEqual(result, 'symbolized')
 
+  def test_symbolize_quietly(self):
+    """Test not logging the output when print_output is False."""
+    helpers.patch(self, ['logging.Logger.info'])
+
+    result = reproducers.symbolize(' output_lines\n', print_output=False)
+
+    self.assertEqual(result, 'symbolized')
+    self.assertEqual(0, self.mock.info.call_count)
+
 
 class StripHtmlTest(helpers.ExtendedTestCase):
   """Test strip_html."""
@@ -860,6 +1228,16 @@ class LibfuzzerJobReproducerPreBuildStepsTest(helpers.ExtendedTestCase):
 
     self.assertEqual('-aaa=bbb -ccc=ddd -dict=/fake/build_dir/fuzzer.dict'
                      ' --test /fake/testcase_dir/testcase', reproducer.args)
+    reproducer.binary_provider.extract_files.assert_called_once_with(
+        ['fuzzer.dict'])
+
+  def test_no_dict(self):
+    """Test not extracting a dict when there is none."""
+    reproducer = create_reproducer(reproducers.LibfuzzerJobReproducer)
+    reproducer.args = '-aaa=bbb'
+    reproducer.pre_build_steps()
+
+    self.assert_n_calls(0, [reproducer.binary_provider.extract_files])
 
 
 class DeserializeLibfuzzerArgsTest(helpers.ExtendedTestCase):
@@ -1080,7 +1458,8 @@ class GetCrashSignatureTest(helpers.ExtendedTestCase):
   """Test get_crash_signature."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.post'])
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.http_cache.post'])
 
   def test_get(self):
     """Test get."""
@@ -1099,6 +1478,23 @@ class GetCrashSignatureTest(helpers.ExtendedTestCase):
             'stacktrace': 'raw_stacktrace'
         }))
 
+  def test_cache(self):
+    """Test parsing once and reading from the cache after."""
+    helpers.patch(self, ['clusterfuzz.reproducers.parse_crash_signature'])
+    self.mock.parse_crash_signature.return_value = common.CrashSignature(
+        'type', ['state'])
+
+    first = reproducers.get_crash_signature('job', '==1== a\n\n  b')
+    second = reproducers.get_crash_signature('job', '==2== a\nb\n')
+    third = reproducers.get_crash_signature('job', 'another')
+
+    for signature in [first, second, third]:
+      self.assertEqual(common.CrashSignature('type', ['state']), signature)
+    self.assert_exact_calls(self.mock.parse_crash_signature, [
+        mock.call('job', '==1== a\n\n  b'),
+        mock.call('job', 'another')
+    ])
+
 
 class AndroidChromeReproducerTest(helpers.ExtendedTestCase):
   """Tests methods in AndroidChromeReproducer."""
@@ -1120,6 +1516,11 @@ class AndroidChromeReproducerTest(helpers.ExtendedTestCase):
     with self.assertRaises(error.GdbNotSupportedOnAndroidError):
       self.reproducer.reproduce_debug()
 
+  def test_reproduce_parallel(self):
+    """Tests AndroidChromeReproducer.reproduce_parallel."""
+    with self.assertRaises(error.ParallelIterationsNotSupportedOnAndroidError):
+      self.reproducer.reproduce_parallel(10, 2)
+
   def test_get_device_id(self):
     """Tests AndroidChromeReproducer.get_device_id."""
     os.environ['ANDROID_SERIAL'] = 'test'
@@ -1242,8 +1643,7 @@ class AndroidChromeReproducerReproduceCrashTest(helpers.ExtendedTestCase):
             self.reproducer.binary_provider.get_android_libclang_dir_path(),
         ],
         lib_tmp_dir_path=mock.ANY)
-    self.mock.symbolize.assert_called_once_with(
-        'fixed log', self.reproducer.binary_provider.get_source_dir_path())
+    self.mock.symbolize.assert_called_once_with('fixed log')
     self.mock.run_monkey_gestures_if_needed.assert_called_once_with(
         self.reproducer.testcase.android_package_name,
         self.reproducer.testcase.gestures)
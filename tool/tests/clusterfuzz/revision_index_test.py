@@ -0,0 +1,145 @@
+"""Test the revision_index module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+
+import mock
+
+from clusterfuzz import revision_index
+from test_libs import helpers
+
+
+SHA_1 = '1' * 40
+SHA_2 = '2' * 40
+SHA_3 = '3' * 40
+
+
+def make_log(commits):
+  """Make the output of `git log` for (sha, body) commits."""
+  return ''.join('\0%s\n%s\n' % (sha, body) for sha, body in commits)
+
+
+class ReadCommitPositionsTest(helpers.ExtendedTestCase):
+  """Test read_commit_positions."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.start_execute'])
+
+  def test_read(self):
+    """Test parsing the commit positions."""
+    self.mock.start_execute.return_value = mock.Mock(stdout=StringIO.StringIO(
+        make_log([
+            (SHA_2, 'Fix.\n\nCr-Commit-Position: refs/heads/master@{#12}'),
+            (SHA_3, 'Merge.\n\nCr-Commit-Position: refs/branch-heads/1@{#3}'),
+            (SHA_1, 'Add.\nCr-Commit-Position: refs/heads/master@{#11}\n'),
+        ])))
+
+    self.assertEqual(
+        [(12, SHA_2), (11, SHA_1)],
+        list(revision_index.read_commit_positions('/src', 'a..b')))
+    self.mock.start_execute.assert_called_once_with(
+        'git', 'log --format=%x00%H%n%b a..b', '/src', print_command=False,
+        stdin=mock.ANY, redirect_stderr_to_stdout=True)
+
+
+class GetShaTest(helpers.ExtendedTestCase):
+  """Test get_sha and update_index."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.revision_index.get_indexed_ref_sha',
+        'clusterfuzz.revision_index.git',
+        'clusterfuzz.revision_index.read_commit_positions',
+    ])
+    self.mock.get_indexed_ref_sha.return_value = SHA_2
+    self.mock.git.return_value = ''
+    self.mock.read_commit_positions.return_value = [(12, SHA_2), (10, SHA_1)]
+
+  def test_build_index(self):
+    """Test building the index on the first lookup."""
+    self.assertEqual(SHA_1, revision_index.get_sha('/src', 10))
+    self.assertEqual(SHA_2, revision_index.get_sha('/src', 12))
+    self.assertIsNone(revision_index.get_sha('/src', 11))
+    self.assertIsNone(revision_index.get_sha('/src', 13))
+
+    self.mock.read_commit_positions.assert_called_once_with('/src', SHA_2)
+
+  def test_update_index(self):
+    """Test indexing only the new commits after a fetch."""
+    revision_index.get_sha('/src', 10)
+    self.mock.get_indexed_ref_sha.return_value = SHA_3
+    self.mock.read_commit_positions.return_value = [(13, SHA_3)]
+
+    self.assertEqual(SHA_3, revision_index.get_sha('/src', 13))
+    self.assertEqual(SHA_1, revision_index.get_sha('/src', 10))
+    self.mock.read_commit_positions.assert_called_with(
+        '/src', '%s..%s' % (SHA_2, SHA_3))
+    self.mock.git.assert_called_once_with(
+        'merge-base --is-ancestor %s %s' % (SHA_2, SHA_3), '/src')
+
+  def test_rewritten_ref(self):
+    """Test rebuilding the index when the indexed commit isn't an
+      ancestor."""
+    revision_index.get_sha('/src', 10)
+    self.mock.get_indexed_ref_sha.return_value = SHA_3
+    self.mock.git.return_value = None
+    self.mock.read_commit_positions.return_value = [(13, SHA_3)]
+
+    self.assertEqual(SHA_3, revision_index.get_sha('/src', 13))
+    self.assertIsNone(revision_index.get_sha('/src', 10))
+    self.mock.read_commit_positions.assert_called_with('/src', SHA_3)
+
+  def test_no_ref(self):
+    """Test returning None when nothing can be indexed."""
+    self.mock.get_indexed_ref_sha.return_value = None
+    self.assertIsNone(revision_index.get_sha('/src', 10))
+    self.assert_n_calls(0, [self.mock.read_commit_positions])
+
+
+class GetIndexedRefShaTest(helpers.ExtendedTestCase):
+  """Test get_indexed_ref_sha."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.revision_index.git'])
+
+  def test_fallback(self):
+    """Test using the first ref that exists."""
+    self.mock.git.side_effect = [None, SHA_1 + '\n']
+    self.assertEqual(SHA_1, revision_index.get_indexed_ref_sha('/src'))
+    self.assert_exact_calls(self.mock.git, [
+        mock.call('rev-parse --verify -q origin/master', '/src'),
+        mock.call('rev-parse --verify -q origin/main', '/src'),
+    ])
+
+
+class GetFileTest(helpers.ExtendedTestCase):
+  """Test get_file."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_get(self):
+    """Test reading a file at a commit."""
+    self.mock.execute.return_value = (0, 'content')
+    self.assertEqual('content', revision_index.get_file('/src', 'sha', 'DEPS'))
+    self.mock.execute.assert_called_once_with(
+        'git', 'show sha:DEPS', '/src', print_command=False,
+        print_output=False, exit_on_error=False, stdin=mock.ANY)
+
+  def test_missing_commit(self):
+    """Test returning None when the commit isn't in the checkout."""
+    self.mock.execute.return_value = (128, 'fatal: bad object')
+    self.assertIsNone(revision_index.get_file('/src', 'sha', 'DEPS'))
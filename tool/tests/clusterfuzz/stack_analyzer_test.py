@@ -0,0 +1,226 @@
+"""Test the stack_analyzer module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import common
+from clusterfuzz import stack_analyzer
+from test_libs import helpers
+
+
+# pylint: disable=line-too-long
+ASAN_HEAP_USE_AFTER_FREE = """
+==1==ERROR: AddressSanitizer: heap-use-after-free on address 0x6020 at pc 0x1
+READ of size 8 at 0x602000000010 thread T0 (chrome)
+    #0 0x7f1 in blink::Node::parentNode() const /src/Node.h:10:3
+    #1 0x7f2 in blink::Range::commonAncestorContainer(blink::Node*, int) /src/Range.cpp:20:5
+    #2 0x7f3 in blink::Range::Create(blink::Document&) /src/Range.cpp:30:1
+    #3 0x7f4 in blink::Editor::Command() /src/Editor.cpp:10:1
+
+0x602000000010 is located 0 bytes inside of 16-byte region
+freed by thread T0 here:
+    #0 0x7f5 in __interceptor_free /src/compiler-rt/lib/asan/asan_malloc.cc:1
+    #1 0x7f6 in blink::Node::~Node() /src/Node.cpp:12:1
+"""
+
+ASAN_HEAP_BUFFER_OVERFLOW = """
+==1==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x60 at pc 0x1
+WRITE of size 13 at 0x6030 thread T0
+    #0 0x4f in __asan_memcpy /src/compiler-rt/lib/asan/asan_interceptors.cc:1
+    #1 0x50 in memcpy /usr/include/string.h:1
+    #2 0x51 in pdfium::CFX_BinaryBuf::AppendBlock(void const*, unsigned long) /src/fx_basic_buffer.cpp:1
+    #3 0x52 in CFX_ByteTextBuf::operator<<(CFX_ByteStringC const&) /src/fx_basic_buffer.cpp:2
+    #4 0x53 in CPDF_SyntaxParser::ReadString() /src/cpdf_syntax_parser.cpp:3
+    #5 0x54 in main /src/pdfium_test.cc:1
+"""
+
+ASAN_NULL_DEREFERENCE = """
+==1==ERROR: AddressSanitizer: SEGV on unknown address 0x000000000010 (pc 0x1)
+==1==The signal is caused by a READ memory access.
+==1==Hint: address points to the zero page.
+    #0 0x1 in v8::internal::Heap::Scavenge() /src/v8/heap.cc:1:1
+    #1 0x2 in v8::internal::Heap::PerformGarbageCollection() /src/v8/heap.cc:2
+    #2 0x3 in v8::internal::Heap::CollectGarbage() /src/v8/heap.cc:3
+"""
+
+ASAN_STACK_OVERFLOW = """
+==1==ERROR: AddressSanitizer: stack-overflow on address 0x7ffe (pc 0x1)
+    #0 0x1 in malloc /src/compiler-rt/lib/asan/asan_malloc_linux.cc:1
+    #1 0x2 in re2::Regexp::Parse(re2::StringPiece const&) /src/re2/parse.cc:1
+    #2 0x3 in re2::Regexp::Parse(re2::StringPiece const&) /src/re2/parse.cc:1
+    #3 0x4 in re2::RE2::Init() /src/re2/re2.cc:1
+    #4 0x5 in LLVMFuzzerTestOneInput /src/re2_fuzzer.cc:1
+"""
+
+MSAN_USE_OF_UNINITIALIZED_VALUE = """
+==1==WARNING: MemorySanitizer: use-of-uninitialized-value
+    #0 0x1 in FX_atof(CFX_ByteStringC const&) /src/fx_basic_util.cpp:10:7
+    #1 0x2 in CPDF_Number::CPDF_Number(CFX_ByteStringC const&) /src/n.cpp:2
+    #2 0x3 in CPDF_SyntaxParser::GetObject() /src/parser.cpp:3
+
+  Uninitialized value was created by a heap allocation
+    #0 0x4 in malloc /src/compiler-rt/lib/msan/msan_interceptors.cc:1
+"""
+
+UBSAN_INTEGER_OVERFLOW = """
+../../src/objects.cc:10:5: runtime error: signed integer overflow: 1 + 2147483647 cannot be represented in type 'int'
+    #0 0x1 in v8::internal::String::Flatten() ../../src/objects.cc:10:5
+    #1 0x2 in v8::internal::Runtime_StringAdd(int, v8::internal::Object**) ../../src/runtime.cc:2:1
+    #2 0x3 in v8::internal::Builtins::Call() ../../src/builtins.cc:3:1
+"""
+
+CFI_BAD_CAST = """
+../../base/memory.h:20:3: runtime error: control flow integrity check for type 'blink::LayoutBlock' failed during cast to unrelated type (vtable address 0x1)
+    #0 0x1 in blink::toLayoutBlock(blink::LayoutObject*) ../../LayoutBlock.h:20:3
+    #1 0x2 in blink::LayoutBox::containingBlock() ../../LayoutBox.cpp:2:1
+    #2 0x3 in blink::LayoutBox::layout() ../../LayoutBox.cpp:3:1
+"""
+
+TSAN_DATA_RACE = """
+==================
+WARNING: ThreadSanitizer: data race (pid=1)
+  Write of size 4 at 0x7b04 by thread T2:
+    #0 net::URLRequest::Start() /src/net/url_request.cc:1:2 (chrome+0x1)
+    #1 net::URLFetcherCore::StartURLRequest() /src/net/url_fetcher.cc:2 (chrome+0x2)
+    #2 base::TaskRunner::Run() /src/base/task_runner.cc:3 (chrome+0x3)
+
+  Previous read of size 4 at 0x7b04 by main thread:
+    #0 net::URLRequest::status() /src/net/url_request.h:1 (chrome+0x4)
+"""
+
+LSAN_DIRECT_LEAK = """
+==1==ERROR: LeakSanitizer: detected memory leaks
+
+Direct leak of 24 byte(s) in 1 object(s) allocated from:
+    #0 0x1 in operator new(unsigned long) /src/compiler-rt/lib/asan/asan_new_delete.cc:1
+    #1 0x2 in sfntly::FontFactory::LoadFonts(std::vector<unsigned char>*) /src/font_factory.cc:1
+    #2 0x3 in LLVMFuzzerTestOneInput /src/sfntly_fuzzer.cc:2
+
+SUMMARY: AddressSanitizer: 24 byte(s) leaked in 1 allocation(s).
+"""
+# pylint: enable=line-too-long
+
+# Hand-written (stacktrace, crash_type, crash_state) for each kind of report,
+# in the format of the /parse_stacktrace responses. They aren't recorded from
+# ClusterFuzz, so they only check the analyzer's rules, not that it agrees
+# with the server.
+EXPECTED_SIGNATURES = [
+    (ASAN_HEAP_USE_AFTER_FREE, 'Heap-use-after-free\nREAD 8',
+     'blink::Node::parentNode\nblink::Range::commonAncestorContainer\n'
+     'blink::Range::Create\n'),
+    (ASAN_HEAP_BUFFER_OVERFLOW, 'Heap-buffer-overflow\nWRITE {*}',
+     'pdfium::CFX_BinaryBuf::AppendBlock\nCFX_ByteTextBuf::operator<<\n'
+     'CPDF_SyntaxParser::ReadString\n'),
+    (ASAN_NULL_DEREFERENCE, 'Null-dereference READ',
+     'v8::internal::Heap::Scavenge\n'
+     'v8::internal::Heap::PerformGarbageCollection\n'
+     'v8::internal::Heap::CollectGarbage\n'),
+    (ASAN_STACK_OVERFLOW, 'Stack-overflow',
+     're2::Regexp::Parse\nre2::RE2::Init\nLLVMFuzzerTestOneInput\n'),
+    (MSAN_USE_OF_UNINITIALIZED_VALUE, 'Use-of-uninitialized-value',
+     'FX_atof\nCPDF_Number::CPDF_Number\nCPDF_SyntaxParser::GetObject\n'),
+    (UBSAN_INTEGER_OVERFLOW, 'Integer-overflow',
+     'v8::internal::String::Flatten\nv8::internal::Runtime_StringAdd\n'
+     'v8::internal::Builtins::Call\n'),
+    (CFI_BAD_CAST, 'Bad-cast',
+     'blink::toLayoutBlock\nblink::LayoutBox::containingBlock\n'
+     'blink::LayoutBox::layout\n'),
+    (TSAN_DATA_RACE, 'Data race\nWRITE 4',
+     'net::URLRequest::Start\nnet::URLFetcherCore::StartURLRequest\n'
+     'base::TaskRunner::Run\n'),
+    (LSAN_DIRECT_LEAK, 'Direct-leak',
+     'sfntly::FontFactory::LoadFonts\nLLVMFuzzerTestOneInput\n'),
+]
+
+
+class KnownStacktracesTest(helpers.ExtendedTestCase):
+  """Test the signatures of the hand-written stacktraces."""
+
+  def test_signatures(self):
+    """Test every stacktrace gets its expected signature."""
+    disagreements = []
+    for stacktrace, crash_type, crash_state in EXPECTED_SIGNATURES:
+      expected = (crash_type.replace('\n', ' '),
+                  tuple(l for l in crash_state.split('\n') if l))
+      signature = stack_analyzer.get_crash_signature(stacktrace)
+      actual = signature and (
+          signature.crash_type, signature.crash_state_lines)
+      if actual != expected:
+        disagreements.append((expected, actual))
+
+    self.assertEqual([], disagreements)
+
+
+class GetCrashSignatureTest(helpers.ExtendedTestCase):
+  """Test get_crash_signature."""
+
+  def test_empty(self):
+    """Test an empty output means no crash."""
+    self.assertEqual(
+        common.CrashSignature('', []),
+        stack_analyzer.get_crash_signature('  \n'))
+
+  def test_unknown(self):
+    """Test an unrecognized output."""
+    self.assertIsNone(stack_analyzer.get_crash_signature(
+        'Received signal 11 SEGV_MAPERR 000000000000\n#0 0x1 in a::b()'))
+
+  def test_no_symbols(self):
+    """Test a report without symbolized frames."""
+    self.assertIsNone(stack_analyzer.get_crash_signature(
+        '==1==ERROR: AddressSanitizer: heap-use-after-free on address 0x1\n'
+        'READ of size 4 at 0x1 thread T0\n'
+        '    #0 0x1 (/lib/libc.so+0x12)\n'))
+
+  def test_double_free(self):
+    """Test a double-free."""
+    self.assertEqual(
+        common.CrashSignature('Heap-double-free', ['a::b']),
+        stack_analyzer.get_crash_signature(
+            '==1==ERROR: AddressSanitizer: attempting double-free on 0x1 in '
+            'thread T0:\n'
+            '    #0 0x1 in free /src/compiler-rt/lib/asan/asan_malloc.cc:1\n'
+            '    #1 0x2 in a::b() /src/a.cc:1\n'))
+
+  def test_unknown_ubsan_error(self):
+    """Test an UBSan error we don't know about."""
+    self.assertIsNone(stack_analyzer.get_crash_signature(
+        'a.cc:1:2: runtime error: something new\n    #0 0x1 in a::b() a.cc:1'))
+
+
+class ParseFrameTest(helpers.ExtendedTestCase):
+  """Test parse_frame."""
+
+  def test_not_frame(self):
+    """Test a line which isn't a frame."""
+    self.assertIsNone(stack_analyzer.parse_frame('READ of size 4'))
+
+  def test_asan_frame(self):
+    """Test an ASan frame."""
+    self.assertEqual(
+        ('a::b<c>::d', '/src/a.cc:1:2'),
+        stack_analyzer.parse_frame(
+            '    #1 0x12 in a::b<c>::d(int, (anonymous namespace)::e) const '
+            '/src/a.cc:1:2'))
+
+  def test_tsan_frame(self):
+    """Test a TSan frame."""
+    self.assertEqual(
+        ('a::b', '/src/a.cc:1 (chrome+0x12)'),
+        stack_analyzer.parse_frame('    #0 a::b() /src/a.cc:1 (chrome+0x12)'))
+
+  def test_unsymbolized_frame(self):
+    """Test a frame without a function."""
+    self.assertEqual(
+        (None, '(/lib/libc.so+0x12)'),
+        stack_analyzer.parse_frame('    #0 0x12 (/lib/libc.so+0x12)'))
@@ -99,6 +99,20 @@ class TestSendLog(helpers.ExtendedTestCase):
              uri='https://logging.googleapis.com/v2/entries:write',
              method='POST', body=json.dumps(structure))])
 
+  def test_send_log_testcase_ids(self):
+    """Test the message of a command with several testcases."""
+    self.mock.get_session_id.return_value = 'user:1234:sessionid'
+
+    params = {'testcase_ids': ['123', '456'],
+              'command': 'reproduce_batch',
+              'current': False,
+              'enable_debug': False}
+    stackdriver_logging.send_log(params)
+
+    self.assertIn(
+        '"message": "name started (reproduce_batch, 123,456)."',
+        (self.mock.ServiceAccountCredentials.from_json_keyfile_name
+         .return_value.authorize.return_value.request.call_args[1]['body']))
 
   def test_send_log_start(self):
     """Test to ensure params are sent properly."""
@@ -0,0 +1,235 @@
+"""Test the symbolizer module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+import struct
+
+import mock
+
+from clusterfuzz import symbolizer
+from error import error
+from test_libs import helpers
+
+
+def make_elf(notes, byte_order='<', elf_class=2):
+  """Make an ELF file with a single note section."""
+  word = 'Q' if elf_class == 2 else 'I'
+  header_format = '%sHHI%s%s%sIHHHHHH' % (byte_order, word, word, word)
+  section_format = byte_order + (
+      'IIQQQQIIQQ' if elf_class == 2 else 'IIIIIIIIII')
+  notes_offset = 16 + struct.calcsize(header_format)
+  sections_offset = notes_offset + len(notes)
+
+  ident = '\x7fELF' + chr(elf_class) + chr(1 if byte_order == '<' else 2)
+  ident += '\x00' * (16 - len(ident))
+  header = struct.pack(
+      header_format, 3, 62, 1, 0, 0, sections_offset, 0, 0, 0, 0,
+      struct.calcsize(section_format), 2, 0)
+  null_section = struct.pack(section_format, *([0] * 10))
+  note_section = struct.pack(
+      section_format, 0, symbolizer.SHT_NOTE, 0, 0, notes_offset, len(notes),
+      0, 0, 4, 0)
+  return ident + header + notes + null_section + note_section
+
+
+def make_note(name, note_type, desc, byte_order='<'):
+  """Make an ELF note."""
+  return (struct.pack(byte_order + 'III', len(name), len(desc), note_type) +
+          name + '\x00' * (symbolizer.align(len(name)) - len(name)) +
+          desc + '\x00' * (symbolizer.align(len(desc)) - len(desc)))
+
+
+class GetBuildIdTest(helpers.ExtendedTestCase):
+  """Test get_build_id."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_build_id(self):
+    """Test reading the build-id after another note."""
+    self.fs.CreateFile('/chrome', contents=make_elf(
+        make_note('GNU\x00', 1, '\x00' * 16) +
+        make_note('GNU\x00', symbolizer.NT_GNU_BUILD_ID, '\xab\xcd\x01')))
+    self.assertEqual('abcd01', symbolizer.get_build_id('/chrome'))
+
+  def test_build_id_32_bit_big_endian(self):
+    """Test reading the build-id of a 32-bit big-endian ELF."""
+    self.fs.CreateFile('/lib.so', contents=make_elf(
+        make_note('GNU\x00', symbolizer.NT_GNU_BUILD_ID, '\x12\x34', '>'),
+        byte_order='>', elf_class=1))
+    self.assertEqual('1234', symbolizer.get_build_id('/lib.so'))
+
+  def test_no_build_id(self):
+    """Test an ELF without a build-id."""
+    self.fs.CreateFile('/chrome', contents=make_elf(
+        make_note('Go\x00\x00', symbolizer.NT_GNU_BUILD_ID, '\x12')))
+    self.assertIsNone(symbolizer.get_build_id('/chrome'))
+
+  def test_not_elf(self):
+    """Test a file which isn't an ELF, or doesn't exist."""
+    self.fs.CreateFile('/script', contents='#!/bin/bash\n')
+    self.assertIsNone(symbolizer.get_build_id('/script'))
+    self.assertIsNone(symbolizer.get_build_id('/missing'))
+
+
+class FakeProcess(object):
+  """A fake llvm-symbolizer process that answers from a fixed output."""
+
+  def __init__(self, output):
+    self.stdin = StringIO.StringIO()
+    self.stdout = StringIO.StringIO(output)
+
+  def wait(self):
+    pass
+
+
+class LlvmSymbolizerTest(helpers.ExtendedTestCase):
+  """Test LlvmSymbolizer."""
+
+  def setUp(self):
+    helpers.patch(self, ['subprocess.Popen'])
+
+  def test_start_fails(self):
+    """Test raising NotInstalledError when llvm-symbolizer can't start."""
+    self.mock.Popen.side_effect = OSError
+    with self.assertRaises(error.NotInstalledError):
+      symbolizer.LlvmSymbolizer('/llvm-symbolizer', '/chrome')
+
+  def test_symbolize_in_batches(self):
+    """Test sending the offsets in batches."""
+    self.mock.Popen.return_value = FakeProcess(
+        'a::b()\n/src/a.cc:1:2\n\n'
+        '??\n??:0:0\n\n'
+        'c()\n\n')
+    self.mock.Popen.return_value.stdin.flush = mock.Mock()
+    process = symbolizer.LlvmSymbolizer('/llvm-symbolizer', '/chrome')
+
+    with mock.patch('clusterfuzz.symbolizer.BATCH_SIZE', 2):
+      frames = process.symbolize(['0x1', '0x2', '0x3'])
+
+    self.assertEqual(
+        [('a::b()', '/src/a.cc:1:2'), ('??', '??:0:0'),
+         ('c()', symbolizer.UNKNOWN_LOCATION)],
+        frames)
+    self.assertEqual(
+        '/chrome 0x1\n/chrome 0x2\n/chrome 0x3\n',
+        self.mock.Popen.return_value.stdin.getvalue())
+    self.assertEqual(
+        2, self.mock.Popen.return_value.stdin.flush.call_count)
+
+  def test_exited(self):
+    """Test llvm-symbolizer exiting in the middle of a query."""
+    self.mock.Popen.return_value = FakeProcess('a::b()\n')
+    process = symbolizer.LlvmSymbolizer('/llvm-symbolizer', '/chrome')
+
+    with self.assertRaises(Exception):
+      process.symbolize(['0x1'])
+
+
+class FormatFrameTest(helpers.ExtendedTestCase):
+  """Test format_frame."""
+
+  def test_unknown_function(self):
+    """Test a frame that can't be symbolized."""
+    self.assertIsNone(
+        symbolizer.format_frame('#0 0x1', '/chrome', '0x1', '??', '??:0:0'))
+
+  def test_unknown_location(self):
+    """Test a frame without debug info."""
+    self.assertEqual(
+        '#0 0x1 in a::b() (/chrome+0x1)',
+        symbolizer.format_frame(
+            '#0 0x1', '/chrome', '0x1', 'a::b()', '??:0:0'))
+
+  def test_known(self):
+    """Test a fully symbolized frame."""
+    self.assertEqual(
+        '#0 0x1 in a::b() /src/a.cc:1:2',
+        symbolizer.format_frame(
+            '#0 0x1', '/chrome', '0x1', 'a::b()', '/src/a.cc:1:2'))
+
+
+class SymbolizerTest(helpers.ExtendedTestCase):
+  """Test Symbolizer."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.symbolizer.LlvmSymbolizer'])
+    self.process = self.mock.LlvmSymbolizer.return_value
+    self.process.symbolize.side_effect = (
+        lambda offsets: [('f%s()' % o, '/src/a.cc:%s' % o) for o in offsets])
+    self.symbolizer = symbolizer.Symbolizer('/llvm-symbolizer')
+
+  def test_symbolize(self):
+    """Test symbolizing frames and leaving the other lines untouched."""
+    output = self.symbolizer.symbolize(
+        'ERROR: AddressSanitizer\n'
+        '    #0 0x7f1 (/chrome+0x2)\n'
+        '    #1 0x7f2 in g() /src/g.cc:1\n'
+        '    #2 0x7f3 (/chrome+0x1)')
+
+    self.assertEqual(
+        'ERROR: AddressSanitizer\n'
+        '    #0 0x7f1 in f0x2() /src/a.cc:0x2\n'
+        '    #1 0x7f2 in g() /src/g.cc:1\n'
+        '    #2 0x7f3 in f0x1() /src/a.cc:0x1',
+        output)
+    self.mock.LlvmSymbolizer.assert_called_once_with(
+        '/llvm-symbolizer', '/chrome')
+    self.process.symbolize.assert_called_once_with(['0x1', '0x2'])
+
+  def test_memoize(self):
+    """Test each (module, offset) is only looked up once."""
+    self.symbolizer.symbolize('#0 0x7f1 (/chrome+0x1)')
+    self.symbolizer.symbolize('#0 0x7f1 (/chrome+0x1)\n#1 0x7f2 (/chrome+0x2)')
+
+    self.assertEqual(1, self.mock.LlvmSymbolizer.call_count)
+    self.assertEqual(
+        [mock.call(['0x1']), mock.call(['0x2'])],
+        self.process.symbolize.call_args_list)
+
+  def test_close(self):
+    """Test closing the processes."""
+    self.symbolizer.symbolize('#0 0x7f1 (/chrome+0x1)')
+    self.symbolizer.close()
+
+    self.process.close.assert_called_once_with()
+    self.assertEqual({}, self.symbolizer.processes)
+
+  def test_frame_cache(self):
+    """Test a new run only looks up the frames the previous runs haven't."""
+    self.fs.CreateFile('/chrome', contents=make_elf(
+        make_note('GNU\x00', symbolizer.NT_GNU_BUILD_ID, '\xab')))
+    self.symbolizer.symbolize('#0 0x7f1 (/chrome+0x1)')
+
+    new_symbolizer = symbolizer.Symbolizer('/llvm-symbolizer')
+    output = new_symbolizer.symbolize(
+        '#0 0x7f1 (/chrome+0x1)\n#1 0x7f2 (/chrome+0x2)')
+
+    self.assertEqual(
+        '#0 0x7f1 in f0x1() /src/a.cc:0x1\n#1 0x7f2 in f0x2() /src/a.cc:0x2',
+        output)
+    self.assertEqual(
+        [mock.call(['0x1']), mock.call(['0x2'])],
+        self.process.symbolize.call_args_list)
+    self.assertEqual(
+        {'0x1': ['f0x1()', '/src/a.cc:0x1'],
+         '0x2': ['f0x2()', '/src/a.cc:0x2']},
+        symbolizer.FRAME_CACHE.get('ab'))
+
+  def test_no_build_id(self):
+    """Test frames of modules without a build-id aren't stored."""
+    self.symbolizer.symbolize('#0 0x7f1 (/chrome+0x1)')
+    self.assertEqual([], symbolizer.FRAME_CACHE.get_entries())
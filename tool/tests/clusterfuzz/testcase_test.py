@@ -13,11 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import BaseHTTPServer
+import base64
+import hashlib
 import os
+import shutil
+import tempfile
+import threading
 import mock
 
 from clusterfuzz import common
 from clusterfuzz import testcase
+from error import error
 from test_libs import helpers
 
 
@@ -258,62 +265,174 @@ class GetCommandLineFilePathTest(helpers.ExtendedTestCase):
       testcase.get_command_line_file_path(sections)
 
 
+class TestcaseRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serve testcase files the way ClusterFuzz does."""
+
+  CONTENT = 'testcase content'
+
+  def log_message(self, *args):
+    """Don't log requests."""
+
+  def send_content(self, content, headers):
+    """Send a 200 response."""
+    self.send_response(200)
+    for name, value in headers:
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(content)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    """Serve the path."""
+    self.server.requests.append((self.path, self.headers.get('Authorization')))
+    md5 = base64.b64encode(hashlib.md5(self.CONTENT).digest())
+    if self.path == '/testcase':
+      self.send_content(self.CONTENT, [
+          ('Content-Disposition', 'attachment; filename="file.js"'),
+          ('Content-Length', str(len(self.CONTENT))),
+          ('x-goog-hash', 'crc32c=abc==,md5=%s' % md5)])
+    elif self.path == '/path/empty.html':
+      self.send_content('', [('Content-Length', '0')])
+    elif self.path == '/flaky' and len(self.server.requests) == 1:
+      self.send_error(503)
+    elif self.path == '/flaky':
+      self.send_content(self.CONTENT, [('Content-MD5', md5)])
+    elif self.path == '/truncated':
+      self.send_content(self.CONTENT, [('Content-Length', '1000')])
+    elif self.path == '/corrupted':
+      self.send_content(self.CONTENT, [('Content-MD5', 'bad')])
+    else:
+      self.send_error(404)
+
+
 class DownloadTestcaseTest(helpers.ExtendedTestCase):
-  """Test download_testcase."""
+  """Test download_testcase against a local HTTP server."""
 
   def setUp(self):
     helpers.patch(self, [
-        'clusterfuzz.common.execute',
         'clusterfuzz.common.get_stored_auth_header',
-        'tempfile.mkdtemp',
-        'os.listdir'
+        'time.sleep',
     ])
     self.mock.get_stored_auth_header.return_value = 'Bearer 1a2s3d4f'
-    self.dir = os.path.join(
-        common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase')
-    self.mock.mkdtemp.return_value = '/tmp/folder'
-    self.mock.listdir.return_value = ['first-file']
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    for name in ['CLUSTERFUZZ_TMP_DIR', 'CLUSTERFUZZ_TESTCASES_DIR']:
+      patcher = mock.patch.object(common, name, self.tmp_dir)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    common.HTTP_SESSION_MANAGER.close()
+    self.addCleanup(common.HTTP_SESSION_MANAGER.close)
+
+    self.server = BaseHTTPServer.HTTPServer(
+        ('127.0.0.1', 0), TestcaseRequestHandler)
+    self.server.requests = []
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+  def test_download(self):
+    """Test naming the file after Content-Disposition."""
+    path = testcase.download_testcase(self.url + '/testcase')
+
+    self.assertEqual('file.js', os.path.basename(path))
+    self.assertTrue(path.startswith(self.tmp_dir))
+    with open(path) as f:
+      self.assertEqual(TestcaseRequestHandler.CONTENT, f.read())
+    self.assertEqual(
+        [('/testcase', 'Bearer 1a2s3d4f')], self.server.requests)
 
-  def test_downloading_testcase(self):
-    """Tests the creation of folders & downloading of the testcase"""
+  def test_empty(self):
+    """Test downloading an empty file named after the URL."""
+    path = testcase.download_testcase(self.url + '/path/empty.html')
+
+    self.assertEqual('empty.html', os.path.basename(path))
+    self.assertEqual(0, os.path.getsize(path))
+
+  def test_retry(self):
+    """Test retrying a server error."""
+    path = testcase.download_testcase(self.url + '/flaky')
+
+    self.assertEqual('flaky', os.path.basename(path))
+    self.assertEqual(2, len(self.server.requests))
+    self.mock.sleep.assert_called_once_with(1)
+
+  def test_truncated(self):
+    """Test failing when the file is shorter than Content-Length."""
+    with self.assertRaises(error.DownloadTestcaseError):
+      testcase.download_testcase(self.url + '/truncated')
     self.assertEqual(
-        '/tmp/folder/first-file', testcase.download_testcase('url'))
-
-    self.mock.get_stored_auth_header.assert_called_once_with()
-    self.mock.execute.assert_called_once_with(
-        'wget',
-        ('--no-verbose --waitretry=%s --retry-connrefused '
-         '--content-disposition --header="Authorization: %s" "url"' % (
-             testcase.DOWNLOAD_TIMEOUT,
-             self.mock.get_stored_auth_header.return_value)),
-        '/tmp/folder'
-    )
-    self.mock.listdir.assert_called_once_with('/tmp/folder')
+        testcase.DOWNLOAD_RETRY_COUNT + 1, len(self.server.requests))
+
+  def test_corrupted(self):
+    """Test failing when the MD5 doesn't match."""
+    with self.assertRaises(error.DownloadTestcaseError):
+      testcase.download_testcase(self.url + '/corrupted')
+
+  def test_not_found(self):
+    """Test not retrying a client error."""
+    with self.assertRaises(error.DownloadTestcaseError):
+      testcase.download_testcase(self.url + '/none')
+    self.assertEqual(1, len(self.server.requests))
 
 
 class GetTestcasePathTest(helpers.ExtendedTestCase):
   """Tests the get_testcase_path method."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, [
-        'clusterfuzz.common.delete_if_exists',
         'clusterfuzz.testcase.get_true_testcase_path',
         'clusterfuzz.testcase.download_testcase',
-        'os.makedirs'
+        'time.time',
     ])
+    self.mock.time.return_value = 1000
     self.test = build_base_testcase()
     self.testcase_dir = os.path.join(
         common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase')
+    self.testcase_path = os.path.join(self.testcase_dir, 'testcase.js')
+
+    def get_true_testcase_path(testcase_dir, unused_absolute_path,
+                               unused_downloaded_file_path):
+      self.fs.CreateFile(os.path.join(testcase_dir, 'testcase.js'))
+      return self.testcase_path
+
+    self.mock.get_true_testcase_path.side_effect = get_true_testcase_path
 
   def test_downloading_testcase(self):
     """Tests the creation of folders & downloading of the testcase"""
-    self.mock.get_true_testcase_path.return_value = 'true_path'
-    self.assertEqual('true_path', self.test.get_testcase_path())
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'old_file'))
+
+    self.assertEqual(self.testcase_path, self.test.get_testcase_path())
 
     self.mock.download_testcase.assert_called_once_with(
         testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345))
-    self.mock.delete_if_exists.assert_called_once_with(self.testcase_dir)
-    self.mock.makedirs.assert_called_once_with(self.testcase_dir)
+    self.assertFalse(
+        os.path.exists(os.path.join(self.testcase_dir, 'old_file')))
+
+  def test_cached(self):
+    """Tests reusing a recently downloaded testcase."""
+    self.test.get_testcase_path()
+    os.utime(
+        os.path.join(self.testcase_dir, testcase.TESTCASE_PATH_STAMP_FILENAME),
+        (500, 500))
+
+    self.assertEqual(
+        self.testcase_path, build_base_testcase().get_testcase_path())
+    self.assertEqual(1, self.mock.download_testcase.call_count)
+
+  def test_expired(self):
+    """Tests downloading the testcase again after the cache expires."""
+    self.test.get_testcase_path()
+    os.utime(
+        os.path.join(self.testcase_dir, testcase.TESTCASE_PATH_STAMP_FILENAME),
+        (0, 0))
+    self.mock.time.return_value = testcase.TESTCASE_CACHE_TTL + 1
+
+    self.assertEqual(
+        self.testcase_path, build_base_testcase().get_testcase_path())
+    self.assertEqual(2, self.mock.download_testcase.call_count)
 
 
 class GetTrueTestcasePathTest(helpers.ExtendedTestCase):
@@ -91,7 +91,8 @@ def make_options(
     skip_deps=False,
     enable_debug=False,
     extra_log_params=None,
-    force=False):
+    force=False,
+    parallel_iterations=1):
   """Make an option."""
   extra_log_params = extra_log_params or {}
   return common.Options(
@@ -108,4 +109,5 @@ def make_options(
       skip_deps=skip_deps,
       enable_debug=enable_debug,
       extra_log_params=extra_log_params,
-      force=force)
+      force=force,
+      parallel_iterations=parallel_iterations)